@@ -0,0 +1,219 @@
+"""
+进程内指标注册表
+
+提供 Counter / Gauge / Histogram 三种指标，按标签值分桶累加，只在取快照时做汇总计算，
+热路径上只有一次加锁的字典更新。Histogram 使用固定桶，分位数由桶边界线性插值估算。
+render_prometheus() 以 Prometheus 文本格式（0.0.4）导出全部指标，供 /metrics 抓取。
+"""
+import bisect
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Seconds; covers fast GraphQL calls through slow websocket queue waits
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 150.0)
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], object] = {}
+
+    def _key(self, labels: Dict[str, object]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def _labels(self, key: Tuple[str, ...]) -> Dict[str, str]:
+        return dict(zip(self.labelnames, key))
+
+    def items(self):
+        with self._lock:
+            return list(self._values.items())
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def snapshot(self) -> List[dict]:
+        return [{"labels": self._labels(key), "value": value} for key, value in self.items()]
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._callback: Optional[Callable[[], Iterable[Tuple[Dict[str, object], float]]]] = None
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, fn: Callable[[], Iterable[Tuple[Dict[str, object], float]]]):
+        """Compute the value at collection time instead; fn yields (labels, value) pairs."""
+        self._callback = fn
+
+    def items(self):
+        if self._callback is None:
+            return super().items()
+        return [(self._key(labels), value) for labels, value in self._callback()]
+
+    def snapshot(self) -> List[dict]:
+        return [{"labels": self._labels(key), "value": value} for key, value in self.items()]
+
+
+class _HistogramState:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self, size: int):
+        self.counts = [0] * size
+        self.sum = 0.0
+        self.count = 0
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = _HistogramState(len(self.buckets) + 1)
+            state.counts[index] += 1
+            state.sum += value
+            state.count += 1
+
+    def items(self):
+        # Copy under the lock so exporters see a consistent view of each series
+        with self._lock:
+            return [(key, (list(s.counts), s.sum, s.count)) for key, s in self._values.items()]
+
+    def quantile(self, counts: List[int], total: int, q: float) -> Optional[float]:
+        if not total:
+            return None
+        rank = q * total
+        seen = 0
+        lower = 0.0
+        for i, n in enumerate(counts):
+            upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+            if n and seen + n >= rank:
+                return lower + (upper - lower) * (rank - seen) / n
+            seen += n
+            lower = upper
+        return self.buckets[-1]
+
+    def snapshot(self) -> List[dict]:
+        result = []
+        for key, (counts, total_sum, total) in self.items():
+            result.append({
+                "labels": self._labels(key),
+                "count": total,
+                "sum": total_sum,
+                "avg": total_sum / total if total else None,
+                "p50": self.quantile(counts, total, 0.50),
+                "p95": self.quantile(counts, total, 0.95),
+                "p99": self.quantile(counts, total, 0.99),
+            })
+        return result
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, _Metric] = {}
+
+    def _get_or_create(self, cls, name: str, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"Metric {name} already registered as {metric.kind}")
+            return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._get_or_create(Counter, name, help, labelnames)
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._get_or_create(Gauge, name, help, labelnames)
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._get_or_create(Histogram, name, help, labelnames, buckets)
+
+    def metrics(self) -> List[_Metric]:
+        with self._lock:
+            return list(self._metrics.values())
+
+    def snapshot(self, prefix: str = '') -> Dict[str, dict]:
+        return {
+            m.name: {"type": m.kind, "help": m.help, "series": m.snapshot()}
+            for m in self.metrics() if m.name.startswith(prefix)
+        }
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels: Dict[str, str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(labels.items())
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(str(value))}"' for name, value in pairs) + '}'
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_prometheus(reg: Optional[Registry] = None) -> str:
+    """Prometheus text exposition format; histogram buckets are emitted cumulatively."""
+    lines: List[str] = []
+    for m in (reg or registry).metrics():
+        lines.append(f"# HELP {m.name} {m.help}")
+        lines.append(f"# TYPE {m.name} {m.kind}")
+        if isinstance(m, Histogram):
+            for key, (counts, total_sum, total) in m.items():
+                labels = m._labels(key)
+                cumulative = 0
+                for bound, n in zip(m.buckets + (float('inf'),), counts):
+                    cumulative += n
+                    lines.append(f"{m.name}_bucket{_format_labels(labels, ('le', _format_value(bound)))} {cumulative}")
+                lines.append(f"{m.name}_sum{_format_labels(labels)} {_format_value(total_sum)}")
+                lines.append(f"{m.name}_count{_format_labels(labels)} {total}")
+        else:
+            for key, value in m.items():
+                lines.append(f"{m.name}{_format_labels(m._labels(key))} {_format_value(value)}")
+    return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
@@ -1,4 +1,6 @@
+from sqlalchemy import bindparam
 from sqlalchemy.orm import Session
+from typing import Dict
 from . import models, schemas
 from passlib.context import CryptContext
 import datetime
@@ -70,6 +72,15 @@ def update_wechat_config(db: Session, user_id: int, config: schemas.WechatConfig
     db.refresh(db_config)
     return db_config
 
+def save_wechat_cookies(db: Session, cookies: Dict[int, str]):
+    """Bulk-update WechatConfig.cookie for several users in a single executemany UPDATE."""
+    if not cookies:
+        return
+    table = models.WechatConfig.__table__
+    stmt = table.update().where(table.c.user_id == bindparam('uid')).values(cookie=bindparam('new_cookie'))
+    db.connection().execute(stmt, [{"uid": uid, "new_cookie": cookie} for uid, cookie in cookies.items()])
+    db.commit()
+
 def get_tasks(db: Session, user_id: int):
     return db.query(models.Task).filter(models.Task.user_id == user_id).all()
 
@@ -1,7 +1,9 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
 import os
 
+from app.core.metrics import registry
+
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./sql_app.db")
 
 # Vercel Serverless environment optimization
@@ -30,6 +32,24 @@ engine = create_engine(
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Connection-level session accounting: a Session holds a pooled connection while it is in a transaction
+DB_CONNECTIONS_IN_USE = registry.gauge("db_connections_in_use", "Database connections currently checked out")
+DB_CHECKOUTS = registry.counter("db_connection_checkouts_total", "Database connection checkouts")
+DB_CONNECTS = registry.counter("db_connections_opened_total", "New DBAPI connections opened")
+
+@event.listens_for(engine, "checkout")
+def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+    DB_CHECKOUTS.inc()
+    DB_CONNECTIONS_IN_USE.inc()
+
+@event.listens_for(engine, "checkin")
+def _on_checkin(dbapi_connection, connection_record):
+    DB_CONNECTIONS_IN_USE.dec()
+
+@event.listens_for(engine, "connect")
+def _on_connect(dbapi_connection, connection_record):
+    DB_CONNECTS.inc()
+
 def get_db():
     db = SessionLocal()
     try:
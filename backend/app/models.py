@@ -108,12 +108,33 @@ class BarkNotification(Base):
     url = Column(String(500), nullable=True)  # 跳转链接
     
     # 发送状态
-    status = Column(String(20), default="pending")  # pending/success/failed
+    status = Column(String(20), default="pending")  # pending/sending/success/failed
     error_message = Column(String(255), nullable=True)  # 错误信息
+    attempts = Column(Integer, default=0)  # 已投递次数（含重试）
+    next_attempt_at = Column(DateTime(timezone=True), nullable=True)  # sending: 认领租约到期时间；pending: 最早重试时间
     
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
 
+class TaskRun(Base):
+    """调度任务执行记录表，用于分析调度延迟和线程池排队"""
+    __tablename__ = "task_runs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    job_id = Column(String(64), nullable=False)  # APScheduler 任务ID（用户任务为 task.id）
+    task_id = Column(Integer, nullable=True, index=True)  # 用户任务ID，系统任务为空
+
+    scheduled_at = Column(DateTime(timezone=True), nullable=False, index=True)  # 计划执行时间
+    submitted_at = Column(DateTime(timezone=True), nullable=False)  # 提交到线程池的时间
+    started_at = Column(DateTime(timezone=True), nullable=False)  # 实际开始执行的时间
+    finished_at = Column(DateTime(timezone=True), nullable=False)  # 执行结束时间
+
+    lag_ms = Column(Integer, nullable=False)  # 开始 - 计划
+    pool_wait_ms = Column(Integer, nullable=False)  # 开始 - 提交
+    duration_ms = Column(Integer, nullable=False)  # 结束 - 开始
+    status = Column(String(20), nullable=False)  # success/error/missed
+
+
 class SeatStatusCache(Base):
     """座位状态缓存表，用于监控任务"""
     __tablename__ = "seat_status_cache"
@@ -131,7 +152,7 @@ class SeatStatusCache(Base):
     cookie_invalid_notified = Column(Boolean, default=False)  # 是否已发送Cookie失效通知
     
     # 延迟签到（用于监督举报后的自动签到）
-    delayed_signin_at = Column(DateTime(timezone=True), nullable=True)  # 计划执行延迟签到的时间
+    delayed_signin_at = Column(DateTime(timezone=True), nullable=True, index=True)  # 计划执行延迟签到的时间
     
     # 保活节流
     keepalive_fail_count = Column(Integer, default=0)
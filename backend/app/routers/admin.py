@@ -1,10 +1,11 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 import secrets
 
-from app import database, models, schemas, crud
+from app import database, models, schemas, crud, scheduler
 from app.routers import auth
+from app.services import task_runs
 
 router = APIRouter(
     prefix="/admin",
@@ -46,3 +47,21 @@ def generate_invite_code(db: Session = Depends(database.get_db), admin: models.U
     db.commit()
     db.refresh(db_code)
     return db_code
+
+@router.get("/task-runs/lag")
+def get_task_run_lag(minutes: int = 60, kind: Optional[str] = 'task', db: Session = Depends(database.get_db), admin: models.User = Depends(get_current_admin)):
+    """按分钟汇总调度延迟（开始 - 计划）与线程池排队时间的 p50/p95/p99，kind 为空时包含系统任务"""
+    minutes = max(1, min(minutes, 24 * 60))
+    task_runs.recorder.flush()
+    return {
+        "workers": task_runs.SCHEDULER_WORKERS,
+        "minutes": task_runs.summarize(db, minutes, kind or None),
+    }
+
+@router.post("/keep-alive/sweep")
+def run_keep_alive_sweep(admin: models.User = Depends(get_current_admin)):
+    """立即对所有用户执行一次完整保活（与分片保活共用线程池）；后台调度器运行时异步执行"""
+    summary = scheduler.trigger_keep_alive_sweep()
+    if summary is None and scheduler.scheduler.running:
+        return {"status": "queued"}
+    return {"status": "ok" if summary else "skipped", "summary": summary}
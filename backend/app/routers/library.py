@@ -1,8 +1,11 @@
+from typing import Optional
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from app import database, models, schemas, crud
 from app.routers import auth
-from app.services.lib_service import LibService
+from app.services.lib_service import AsyncLibService
+from app.services import http_client, session_registry, cookie_store, cookie_lifetime, lib_cache, seat_monitor
 from app.services.auth_service import AuthService
 
 router = APIRouter(
@@ -11,20 +14,12 @@ router = APIRouter(
 )
 
 def get_lib_service(
-    current_user: models.User = Depends(auth.get_current_user),
-    db: Session = Depends(database.get_db)
+    current_user: models.User = Depends(auth.get_current_user)
 ):
     if not current_user.wechat_config or not current_user.wechat_config.cookie:
         raise HTTPException(status_code=400, detail="请先在设置中绑定微信 Cookie")
-    
-    def save_cookie(new_cookie: str):
-        try:
-            update_data = schemas.WechatConfigUpdate(cookie=new_cookie)
-            crud.update_wechat_config(db, current_user.id, update_data)
-        except Exception as e:
-            print(f"Failed to auto-save cookie: {e}")
 
-    return LibService(current_user.wechat_config.cookie, save_cookie)
+    return session_registry.acquire(current_user.id, current_user.wechat_config.cookie)
 
 @router.get("/config", response_model=schemas.WechatConfigResponse)
 def get_config(
@@ -46,97 +41,102 @@ def update_config(
     current_user: models.User = Depends(auth.get_current_user),
     db: Session = Depends(database.get_db)
 ):
+    if config.cookie:
+        # A newly bound cookie must not be overwritten by a queued refresh of the old one
+        cookie_store.store.discard(current_user.id)
+        # Lifetime samples of the old token say nothing about the new one
+        cookie_lifetime.tracker.forget(current_user.id)
     return crud.update_wechat_config(db, current_user.id, config)
 
 @router.get("/list")
-def get_lib_list(service: LibService = Depends(get_lib_service)):
+async def get_lib_list(service: AsyncLibService = Depends(get_lib_service)):
     try:
-        return service.get_lib_list()
+        return await lib_cache.cache.get_lib_list(service)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/{lib_id}/floors")
-def get_floor_list(lib_id: int, service: LibService = Depends(get_lib_service)):
+async def get_floor_list(lib_id: int, service: AsyncLibService = Depends(get_lib_service)):
     try:
-        return service.get_floor_list(lib_id)
+        return await service.get_floor_list(lib_id)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/{lib_id}/layout")
-def get_lib_layout(lib_id: int, service: LibService = Depends(get_lib_service)):
+async def get_lib_layout(lib_id: int, service: AsyncLibService = Depends(get_lib_service)):
     try:
-        return service.get_lib_layout(lib_id)
+        return await lib_cache.cache.get_lib_layout(service, lib_id)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/reserve")
-def get_reserve_info(service: LibService = Depends(get_lib_service)):
+async def get_reserve_info(fresh: bool = False, service: AsyncLibService = Depends(get_lib_service)):
     try:
-        return service.get_reserve_info()
+        return await service.get_reserve_info(fresh=fresh)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 from app.services import bark_service
 
 @router.post("/reserve")
-def reserve_seat(
+async def reserve_seat(
     lib_id: int, 
     seat_key: str, 
-    service: LibService = Depends(get_lib_service),
+    service: AsyncLibService = Depends(get_lib_service),
     db: Session = Depends(database.get_db),
     current_user: models.User = Depends(auth.get_current_user)
 ):
     try:
-        return service.reserve_seat(lib_id, seat_key)
+        res = await service.reserve_seat(lib_id, seat_key)
+        # 新预约的过期提醒依赖监控尽快看到它
+        seat_monitor.schedule.wake(current_user.id)
+        return res
     except Exception as e:
         msg = str(e)
         lowered = msg.lower()
         if ('限制预约' in msg) or ('异常预约' in msg) or ('restricted' in lowered):
             try:
-                bark_service.send_account_restricted_notification(db, current_user.id)
+                await run_in_threadpool(bark_service.send_account_restricted_notification, db, current_user.id)
             except Exception:
                 pass
             return {"status": "restricted", "message": msg}
         raise HTTPException(status_code=500, detail=msg)
 
 @router.delete("/reserve")
-def cancel_reserve(service: LibService = Depends(get_lib_service)):
+async def cancel_reserve(service: AsyncLibService = Depends(get_lib_service)):
     try:
-        return service.cancel_reserve()
+        return await service.cancel_reserve()
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/frequent-seats")
-def get_frequent_seats(service: LibService = Depends(get_lib_service)):
+async def get_frequent_seats(service: AsyncLibService = Depends(get_lib_service)):
     try:
-        return service.get_seat_info()
+        return await service.get_seat_info()
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/seat_info")
-def get_seat_info_alias(service: LibService = Depends(get_lib_service)):
+async def get_seat_info_alias(service: AsyncLibService = Depends(get_lib_service)):
     try:
-        return service.get_seat_info()
+        return await service.get_seat_info()
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/user_info")
-def get_user_info(service: LibService = Depends(get_lib_service)):
+async def get_user_info(service: AsyncLibService = Depends(get_lib_service)):
     try:
-        return service.get_user_info()
+        return await service.get_user_info()
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/seat-state")
-def get_seat_state(service: LibService = Depends(get_lib_service)):
+async def get_seat_state(lib_id: Optional[int] = None, service: AsyncLibService = Depends(get_lib_service)):
     try:
-        current = service.get_reserve_info()
-        frequent = service.get_seat_info()
-        return {
-            "current": current,
-            "frequent": frequent,
-            "timestamp": int(__import__('time').time())
-        }
+        # One GraphQL document for reservation + often-seats (+ the room's live status when lib_id is given)
+        state = await service.get_seat_state(lib_id)
+        state["timestamp"] = int(__import__('time').time())
+        return state
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 @router.post("/get_cookie_from_url")
@@ -153,6 +153,8 @@ def get_cookie_from_url(
         config_update = schemas.WechatConfigUpdate()
         if is_auth_url:
             config_update.cookie = cookie_str
+            cookie_store.store.discard(current_user.id)
+            cookie_lifetime.tracker.forget(current_user.id)
         else:
             config_update.sess_id = cookie_str
             
@@ -173,10 +175,12 @@ def signin(
         # 前置只读热身（若绑定了 Cookie）
         if config.cookie:
             try:
-                LibService(config.cookie).refresh_page()
+                service = session_registry.acquire(current_user.id, config.cookie)
+                http_client.run_sync(service.refresh_page())
             except Exception:
                 pass
         res = AuthService.sign_in(config.sess_id, config.major, config.minor)
+        seat_monitor.schedule.wake(current_user.id)
         
         # 发送签到成功通知
         try:
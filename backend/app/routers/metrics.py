@@ -0,0 +1,48 @@
+from fastapi import APIRouter, Depends, Header, HTTPException, status
+from fastapi.responses import PlainTextResponse
+from sqlalchemy.orm import Session
+from typing import Optional
+import os
+import secrets
+
+from app import database
+from app.core.metrics import registry, render_prometheus
+from app.routers import auth
+# Importing registers the upstream_* metrics even before the first upstream call
+from app.services import upstream_metrics  # noqa: F401
+
+router = APIRouter(
+    prefix="/metrics",
+    tags=["metrics"]
+)
+
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+# Explicit opt-out (e.g. scraped only over a private network): METRICS_PUBLIC=1 serves metrics without auth
+METRICS_PUBLIC = os.getenv("METRICS_PUBLIC", "0") == "1"
+
+async def verify_metrics_token(authorization: Optional[str] = Header(None), db: Session = Depends(database.get_db)):
+    """Accepts "Authorization: Bearer <METRICS_TOKEN>" (for Prometheus) or an admin's login token."""
+    if METRICS_PUBLIC:
+        return
+    if not authorization or not authorization.startswith("Bearer "):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="需要指标令牌或管理员登录",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    token = authorization[len("Bearer "):]
+    if METRICS_TOKEN and secrets.compare_digest(token, METRICS_TOKEN):
+        return
+    user = await auth.get_current_user(token, db)
+    if not user.is_admin:
+        raise HTTPException(status_code=403, detail="需要管理员权限")
+
+@router.get("", response_class=PlainTextResponse, dependencies=[Depends(verify_metrics_token)])
+def get_metrics():
+    """全部进程内指标（Prometheus 文本格式），供 Prometheus 抓取"""
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@router.get("/upstream", dependencies=[Depends(verify_metrics_token)])
+def get_upstream_metrics():
+    """上游 Traceint 调用的耗时分布、错误码计数和收发字节数（按操作）"""
+    return registry.snapshot(prefix="upstream_")
@@ -1,20 +1,78 @@
 from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.events import EVENT_JOB_SUBMITTED, EVENT_JOB_ERROR, EVENT_JOB_MISSED, EVENT_JOB_MAX_INSTANCES
 from apscheduler.triggers.cron import CronTrigger
 from apscheduler.triggers.interval import IntervalTrigger
+from sqlalchemy import bindparam
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 from app import crud, models, database, schemas
-from app.services.lib_service import LibService
+from app.services import http_client, session_registry, cookie_lifetime, precision_launch, clock_sync, reserve_engine, task_runs, seat_monitor
+from app.services.keepalive_slots import KeepAliveSlots
 from app.services.auth_service import AuthService
 from app.services import bark_service
+from app.core.metrics import registry
 import logging
 from datetime import datetime, timedelta
 from sqlalchemy.sql import func
+import os
 import random
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 logger = logging.getLogger(__name__)
 
-scheduler = BackgroundScheduler(timezone='Asia/Shanghai')
+# Jobs run on a timed pool so every execution records its scheduled/submitted/start/end times.
+# Precision-mode reservations sleep through their lead on a separate pool.
+scheduler = BackgroundScheduler(timezone='Asia/Shanghai', executors={
+    'default': task_runs.TimedThreadPoolExecutor(),
+    'precision': task_runs.TimedThreadPoolExecutor(precision_launch.LAUNCH_WORKERS),
+})
+
+KEEPALIVE_CONCURRENCY = int(os.getenv("KEEPALIVE_CONCURRENCY", "8"))
+KEEPALIVE_INTERVAL_MINUTES = int(os.getenv("KEEPALIVE_INTERVAL_MINUTES", "55"))
+KEEPALIVE_TICK_SECONDS = int(os.getenv("KEEPALIVE_TICK_SECONDS", "30"))
+
+KEEPALIVE_BATCH_SIZE = int(os.getenv("KEEPALIVE_BATCH_SIZE", "500"))
+
+# Shared by the staggered ticks and full sweeps so total keep-alive concurrency stays bounded
+keepalive_pool = ThreadPoolExecutor(max_workers=KEEPALIVE_CONCURRENCY, thread_name_prefix="keep-alive")
+keepalive_slots = KeepAliveSlots(KEEPALIVE_INTERVAL_MINUTES * 60)
+# Held while an on-demand full sweep runs; ticks stand down meanwhile
+_sweep_lock = threading.Lock()
+
+SCHEDULER_JOBS = registry.gauge("scheduler_jobs", "Scheduled jobs by kind (task jobs are keyed by numeric task id)", ("kind",))
+SCHEDULER_LAG = registry.histogram("scheduler_job_lag_seconds", "Delay between a job's scheduled run time and its submission", ("kind",))
+SCHEDULER_EVENTS = registry.counter("scheduler_job_events_total", "Missed, failed and skipped (max instances) job runs", ("kind", "event"))
+TASK_RUNS = registry.counter("task_runs_total", "User task outcomes by task type", ("task_type", "status"))
+TASK_DURATION = registry.histogram("task_run_duration_seconds", "User task execution time", ("task_type",))
+KEEPALIVE_SWEEP = registry.histogram("keepalive_sweep_duration_seconds", "Keep-alive batch duration (full sweep or staggered tick)", ("mode",))
+KEEPALIVE_USERS = registry.counter("keepalive_users_total", "Keep-alive refreshes by outcome", ("outcome",))
+
+def _job_counts():
+    counts = {}
+    for job in scheduler.get_jobs():
+        kind = task_runs.job_kind(job.id)
+        counts[kind] = counts.get(kind, 0) + 1
+    return [({"kind": kind}, n) for kind, n in counts.items()]
+
+SCHEDULER_JOBS.set_function(_job_counts)
+
+_JOB_EVENT_NAMES = {EVENT_JOB_ERROR: 'error', EVENT_JOB_MISSED: 'missed', EVENT_JOB_MAX_INSTANCES: 'max_instances'}
+
+def _on_job_event(event):
+    kind = task_runs.job_kind(event.job_id)
+    if event.code == EVENT_JOB_SUBMITTED:
+        now = datetime.now(scheduler.timezone)
+        for run_time in event.scheduled_run_times:
+            SCHEDULER_LAG.observe(max(0.0, (now - run_time).total_seconds()), kind=kind)
+    else:
+        SCHEDULER_EVENTS.inc(kind=kind, event=_JOB_EVENT_NAMES.get(event.code, str(event.code)))
+
+def _record_task_run(task_type: str, task, started: float):
+    status = (task.last_status if task else None) or 'failed'
+    TASK_RUNS.inc(task_type=task_type, status=status)
+    TASK_DURATION.observe(time.perf_counter() - started, task_type=task_type)
 
 def compute_next_run(task: models.Task):
     try:
@@ -27,9 +85,30 @@ def compute_next_run(task: models.Task):
     except Exception:
         return None
 
+def _launch_target(task: models.Task):
+    """Exact launch timestamp (server epoch seconds) for a precision-mode run, or None for a plain run."""
+    if not precision_launch.is_enabled(task.config) or not task.cron_expression:
+        return None
+    tz = getattr(scheduler, 'timezone', None)
+    now = datetime.now(tz) if tz else datetime.now()
+    cron = CronTrigger.from_crontab(task.cron_expression, timezone=tz) if tz else CronTrigger.from_crontab(task.cron_expression)
+    lead = precision_launch.lead_seconds(task.config)
+    target = precision_launch.LeadTrigger(cron, lead).target_for(now)
+    if not target:
+        return None
+    launch_at = target.timestamp() + precision_launch.fire_offset_seconds(task.config)
+    # Started more than `lead` after the fire time (e.g. via /cron/tick): the target is the next
+    # occurrence, possibly a day away. Run right away as a plain run instead of waiting for it.
+    if launch_at - clock_sync.precise_server_now() > lead + precision_launch.LAUNCH_MARGIN_SECONDS:
+        logger.info(f"Task {task.id} started outside its precision window; running without a timed launch")
+        return None
+    return launch_at
+
 def run_seat_task(user_id: int, task_id: int):
     db = database.SessionLocal()
     task = None
+    launch_note = ''
+    started = time.perf_counter()
     try:
         user = crud.get_user(db, user_id)
         task = db.query(models.Task).filter(models.Task.id == task_id).first()
@@ -44,20 +123,11 @@ def run_seat_task(user_id: int, task_id: int):
                 logger.error(f"发送Cookie失效通知失败: {notify_error}")
             return
 
-        def save_cookie(new_cookie):
-            try:
-                if user.wechat_config:
-                    user.wechat_config.cookie = new_cookie
-                    db.add(user.wechat_config)
-                    db.commit()
-            except Exception as e:
-                logger.error(f"Scheduler failed to save cookie: {e}")
-
-        service = LibService(user.wechat_config.cookie, save_cookie)
+        service = session_registry.acquire(user_id, user.wechat_config.cookie)
         
         # Skip if user already has a seat today
         try:
-            reserve = service.get_reserve_info()
+            reserve = http_client.run_sync(service.get_reserve_info(fresh=True))
             if reserve:
                 task.last_status = 'skipped'
                 task.last_message = '用户当前已有预约，跳过任务'
@@ -74,7 +144,7 @@ def run_seat_task(user_id: int, task_id: int):
         if strategy == 'default_all':
             # Fetch all default seats
             try:
-                often_seats = service.get_seat_info()
+                often_seats = http_client.run_sync(service.get_seat_info())
                 target_seats = [{'lib_id': s['lib_id'], 'seat_key': s['seat_key']} for s in often_seats]
             except Exception as e:
                 logger.error(f"Failed to fetch default seats: {e}")
@@ -90,19 +160,55 @@ def run_seat_task(user_id: int, task_id: int):
         if not target_seats:
              raise Exception("没有可用的目标座位")
 
+        # Precision launch: everything above ran during the lead time; warm the page and the
+        # libLayout preflight now so only reserueSeat is left on the wire at the target instant.
+        launch_at = _launch_target(task)
+        layouts = None
+        if launch_at is not None:
+            try:
+                http_client.run_sync(service.refresh_page())
+            except Exception:
+                pass
+            if strategy == 'default_all' and task.task_type == 'reserve':
+                # The full layouts rank the fan-out and double as the preflight
+                layouts = http_client.run_sync(reserve_engine.fetch_layouts(service, [seat['lib_id'] for seat in target_seats]))
+            else:
+                for lib_id in dict.fromkeys(seat['lib_id'] for seat in target_seats):
+                    try:
+                        http_client.run_sync(service.prepare_reserve(lib_id, force=True))
+                    except Exception as e:
+                        logger.warning(f"Preflight for lib {lib_id} failed: {e}")
+            clock_sync.clock.ensure_fresh()
+            precision_launch.sleep_until(launch_at, clock=clock_sync.precise_server_now)
+            launch_offset_ms = (clock_sync.precise_server_now() - launch_at) * 1000
+            launch_note = f"（发射偏差 {launch_offset_ms:+.1f}ms）"
+            logger.info(f"Task {task_id} launched at target {launch_at:.3f} with offset {launch_offset_ms:+.1f}ms")
+
         last_error = None
         success = False
         attempt = 0
+        reserve_info = None
         
+        if strategy == 'default_all' and task.task_type == 'reserve':
+            # Rank by live status from one layout fetch per room and fan out over the free seats
+            seat, reserve_info = http_client.run_sync(reserve_engine.reserve_any(service, target_seats, layouts=layouts))
+            success = seat is not None
+            if not success and reserve_info:
+                task.last_status = 'skipped'
+                task.last_message = '用户当前已有预约，跳过任务' + launch_note
+                return
+            target_seats = []
+
         for seat in target_seats:
             try:
-                if attempt % 2 == 0:
+                # The first precision-mode attempt is already warm
+                if attempt % 2 == 0 and not (launch_at is not None and attempt == 0):
                     try:
-                        service.refresh_page()
+                        http_client.run_sync(service.refresh_page())
                     except Exception:
                         pass
                 if task.task_type == 'reserve':
-                    service.reserve_seat(seat['lib_id'], seat['seat_key'])
+                    http_client.run_sync(service.reserve_seat(seat['lib_id'], seat['seat_key']))
                 success = True
                 break # Stop if success
             except Exception as e:
@@ -116,20 +222,23 @@ def run_seat_task(user_id: int, task_id: int):
         
         if success:
             task.last_status = 'success'
-            task.last_message = '执行成功'
+            task.last_message = '执行成功' + launch_note
             # 发送预约成功通知
             try:
-                reserve_info = service.get_reserve_info()
+                if not reserve_info:
+                    reserve_info = http_client.run_sync(service.get_reserve_info())
                 if reserve_info:
                     bark_service.send_reserve_success_notification(db, user_id, reserve_info)
             except Exception as notify_error:
                 logger.error(f"发送预约成功通知失败: {notify_error}")
+            # The monitor's schedule still thinks this user has no reservation
+            seat_monitor.schedule.wake(user_id)
         else:
             # If all seats were occupied or attempts failed
             if last_error:
                 raise last_error
             task.last_status = 'skipped'
-            task.last_message = '目标座位今日已被占用或无可用座位，跳过任务'
+            task.last_message = '目标座位今日已被占用或无可用座位，跳过任务' + launch_note
 
     except Exception as e:
         logger.error(f"Task {task_id} failed: {e}")
@@ -137,7 +246,7 @@ def run_seat_task(user_id: int, task_id: int):
         
         if task:
             task.last_status = 'failed'
-            task.last_message = error_msg
+            task.last_message = (error_msg + launch_note)[:500]
             
             #检测Cookie失效并发送通知
             if '40001' in error_msg.lower() or 'cookie失效' in error_msg.lower() or '403' in error_msg:
@@ -153,6 +262,7 @@ def run_seat_task(user_id: int, task_id: int):
                     logger.error(f"发送预约失败通知失败: {notify_error}")
                     
     finally:
+        _record_task_run('reserve', task, started)
         if task:
             task.last_run = func.now()
             db.commit()
@@ -161,6 +271,7 @@ def run_seat_task(user_id: int, task_id: int):
 def run_signin_task(user_id: int, task_id: int):
     db = database.SessionLocal()
     task = None
+    started = time.perf_counter()
     try:
         user = crud.get_user(db, user_id)
         task = db.query(models.Task).filter(models.Task.id == task_id).first()
@@ -189,21 +300,15 @@ def run_signin_task(user_id: int, task_id: int):
 
         try:
             if user.wechat_config.cookie:
-                def save_cookie(new_cookie):
-                    try:
-                        if user.wechat_config:
-                            user.wechat_config.cookie = new_cookie
-                            db.add(user.wechat_config)
-                            db.commit()
-                    except Exception as e:
-                        logger.error(f"Scheduler failed to save cookie: {e}")
-                LibService(user.wechat_config.cookie, save_cookie).refresh_page()
+                service = session_registry.acquire(user_id, user.wechat_config.cookie)
+                http_client.run_sync(service.refresh_page())
         except Exception:
             pass
 
         res = AuthService.sign_in(user.wechat_config.sess_id, user.wechat_config.major, user.wechat_config.minor)
         task.last_status = 'success'
         task.last_message = res
+        seat_monitor.schedule.wake(user_id)
         # 发送签到成功通知
         try:
             bark_service.send_signin_success_notification(db, user_id)
@@ -227,6 +332,7 @@ def run_signin_task(user_id: int, task_id: int):
             except Exception as notify_error:
                 logger.error(f"发送签到失败通知失败: {notify_error}")
     finally:
+        _record_task_run('signin', task, started)
         if task:
             task.last_run = func.now()
             db.commit()
@@ -253,6 +359,13 @@ def add_task_job(task: models.Task):
             tz = getattr(scheduler, 'timezone', None)
             now = datetime.now(tz) if tz else datetime.now()
             trigger = CronTrigger.from_crontab(task.cron_expression, timezone=tz) if tz else CronTrigger.from_crontab(task.cron_expression)
+            job_options = {}
+            if func is run_seat_task and precision_launch.is_enabled(task.config):
+                # Wake up early to warm up; run_seat_task then waits for the exact cron time
+                lead = precision_launch.lead_seconds(task.config)
+                trigger = precision_launch.LeadTrigger(trigger, lead)
+                # A late start still runs (as a plain run once the window has passed) instead of being dropped
+                job_options = {'executor': 'precision', 'misfire_grace_time': int(lead) + 60}
             next_run = trigger.get_next_fire_time(None, now)
             scheduler.add_job(
                 func,
@@ -260,7 +373,8 @@ def add_task_job(task: models.Task):
                 id=job_id,
                 args=[task.user_id, task.id],
                 replace_existing=True,
-                next_run_time=next_run
+                next_run_time=next_run,
+                **job_options
             )
             logger.info(f"Added job {job_id} for task {task.task_type}")
         except Exception as e:
@@ -274,172 +388,347 @@ def remove_task_job(task_id: int):
 
 def run_global_keep_alive():
     """
-    Global background task to refresh cookies for all users.
-    Runs independently of user-defined tasks.
+    Refresh cookies for all users in one sweep, on the same worker pool as the staggered ticks.
+    Not scheduled; triggered on demand through trigger_keep_alive_sweep (POST /admin/keep-alive/sweep).
     """
+    if not _sweep_lock.acquire(blocking=False):
+        logger.info("Global keep-alive already running, skipped")
+        return None
     logger.info("Starting global keep-alive task...")
+    started = time.monotonic()
+    try:
+        outcomes = _run_keep_alive_batch()
+    except Exception as e:
+        logger.error(f"Global keep-alive task critical failure: {e}")
+        return None
+    finally:
+        _sweep_lock.release()
+    total = sum(outcomes.values())
+    elapsed = time.monotonic() - started
+    throughput = total / elapsed if elapsed > 0 else 0.0
+    logger.info(
+        f"Global keep-alive finished: {total} users in {elapsed:.1f}s "
+        f"({throughput:.2f} users/s, concurrency={KEEPALIVE_CONCURRENCY}), outcomes={outcomes}"
+    )
+    return {"users": total, "duration": elapsed, "throughput": throughput, "outcomes": outcomes}
+
+def trigger_keep_alive_sweep():
+    """
+    Run a full sweep as a one-off scheduler job; without a running scheduler (e.g. Vercel)
+    it runs inline and the summary is returned. Returns None when the sweep was queued.
+    """
+    if scheduler.running:
+        scheduler.add_job(
+            run_global_keep_alive,
+            id='keep_alive_sweep',
+            replace_existing=True,
+            misfire_grace_time=None,
+            name="Full Cookie Keep-Alive Sweep"
+        )
+        return None
+    return run_global_keep_alive()
+
+def _keep_alive_user_ids(db: Session):
+    return [row[0] for row in db.query(models.WechatConfig.user_id).filter(
+        models.WechatConfig.cookie != None,
+        models.WechatConfig.cookie != ''
+    ).all()]
+
+def run_keep_alive_tick():
+    """
+    Staggered keep-alive: every user owns a stable slot inside the keep-alive interval,
+    and each tick only refreshes users whose slot has just come up or whose token is
+    predicted to expire soon. Users with recent organic API activity are skipped.
+    """
+    if _sweep_lock.locked():
+        # A full sweep is refreshing everyone right now
+        return
     db = database.SessionLocal()
     try:
-        # Ensure required columns exist for adaptive backoff (runtime safety)
-        try:
-            from sqlalchemy import inspect, text
-            inspector = inspect(database.engine)
-            if inspector.has_table("seat_status_cache"):
-                cache_cols = [c['name'] for c in inspector.get_columns('seat_status_cache')]
-                ddl_needed = False
-                with database.engine.begin() as conn:
-                    if 'keepalive_fail_count' not in cache_cols:
-                        conn.execute(text("ALTER TABLE seat_status_cache ADD COLUMN keepalive_fail_count INT DEFAULT 0"))
-                        ddl_needed = True
-                    if 'htmlrule_backoff_until' not in cache_cols:
-                        dialect = database.engine.dialect.name
-                        if dialect == 'mysql':
-                            conn.execute(text("ALTER TABLE seat_status_cache ADD COLUMN htmlrule_backoff_until DATETIME"))
-                        else:
-                            conn.execute(text("ALTER TABLE seat_status_cache ADD COLUMN htmlrule_backoff_until TIMESTAMP WITH TIME ZONE"))
-                        ddl_needed = True
-                if ddl_needed:
-                    logger.info("Applied runtime migration for seat_status_cache adaptive backoff columns")
-        except Exception as mig_error:
-            logger.warning(f"Adaptive backoff columns check/migration failed: {mig_error}")
-        
-        # Fetch users with valid cookie config
-        users = db.query(models.User).join(models.WechatConfig).filter(
-            models.WechatConfig.cookie != None,
-            models.WechatConfig.cookie != ''
-        ).all()
-        
-        logger.info(f"Found {len(users)} users for keep-alive check")
-        
+        user_ids = _keep_alive_user_ids(db)
+    except Exception as e:
+        logger.error(f"Keep-alive tick failed to load users: {e}")
+        return
+    finally:
+        db.close()
+
+    session_registry.registry.ensure_capacity(len(user_ids))
+    if keepalive_slots.rebalance(user_ids):
+        logger.info(f"Keep-alive slot table rebalanced: {len(keepalive_slots)} users over {KEEPALIVE_INTERVAL_MINUTES} min")
+
+    now = time.time()
+    # Slots guarantee coverage for users we know nothing about (e.g. after a restart);
+    # the lifetime tracker pulls users forward when their token is about to expire.
+    due = set(keepalive_slots.due(now)) | set(cookie_lifetime.tracker.due(now))
+    if not due:
+        return
+    # Organic API traffic keeps the Authorization cookie alive but never touches wechatSESS_ID,
+    # so recently active users still get their SESS_ID refreshed on their slot
+    cookie_fresh = {uid for uid in due if not cookie_lifetime.tracker.needs_refresh(uid, now)}
+
+    try:
+        outcomes = _run_keep_alive_batch(due, skip_cookie=cookie_fresh)
+        logger.info(f"Keep-alive tick: {len(due)} user(s) due, {len(cookie_fresh)} cookie refresh(es) skipped (recently active), outcomes={outcomes}")
+    except Exception as e:
+        logger.error(f"Keep-alive tick failed: {e}")
+
+def _run_keep_alive_batch(user_ids=None, skip_cookie=frozenset()):
+    """
+    Stream keep-alive state for the given users (all users with a cookie when None) in one
+    joined query, refresh them on the worker pool, then write cache state back in batches.
+    Users in skip_cookie only get their SESS_ID refreshed.
+    """
+    outcomes = {}
+    started = time.perf_counter()
+    try:
+        for chunk in _iter_keep_alive_state(user_ids):
+            for state in chunk:
+                state['refresh_cookie'] = state['user_id'] not in skip_cookie
+            random.shuffle(chunk)
+            # Each user is 2-3 upstream round trips plus jitter; fan out so the sweep scales with concurrency
+            results = list(keepalive_pool.map(_keep_alive_user, chunk))
+            _apply_keep_alive_results(results)
+            for r in results:
+                outcomes[r['outcome']] = outcomes.get(r['outcome'], 0) + 1
+                KEEPALIVE_USERS.inc(outcome=r['outcome'])
+    finally:
+        KEEPALIVE_SWEEP.observe(time.perf_counter() - started, mode='full' if user_ids is None else 'tick')
+    return outcomes
+
+def _iter_keep_alive_state(user_ids=None):
+    """
+    Yield chunks of plain state dicts (cookie, SESS_ID, cached backoff) so workers never touch the session.
+    Pages are read by user_id keyset on a short-lived session that is closed before the chunk is
+    processed, so no cursor or transaction stays open across the upstream calls and write-backs.
+    """
+    if user_ids is not None and not user_ids:
+        return
+    wanted = sorted(user_ids) if user_ids is not None else None
+    last_id = None
+    while True:
+        db = database.SessionLocal()
         try:
-            random.shuffle(users)
-        except Exception:
-            pass
-        
-        for user in users:
+            query = db.query(
+                models.WechatConfig.user_id,
+                models.WechatConfig.cookie,
+                models.WechatConfig.sess_id,
+                models.SeatStatusCache.id,
+                models.SeatStatusCache.keepalive_fail_count,
+                models.SeatStatusCache.htmlrule_backoff_until,
+            ).outerjoin(
+                models.SeatStatusCache, models.SeatStatusCache.user_id == models.WechatConfig.user_id
+            ).filter(
+                models.WechatConfig.cookie != None,
+                models.WechatConfig.cookie != ''
+            )
+            if wanted is not None:
+                # Page the requested ids themselves so the IN list stays bounded too
+                page_ids = wanted[:KEEPALIVE_BATCH_SIZE]
+                wanted = wanted[KEEPALIVE_BATCH_SIZE:]
+                query = query.filter(models.WechatConfig.user_id.in_(page_ids))
+            elif last_id is not None:
+                query = query.filter(models.WechatConfig.user_id > last_id)
+            rows = query.order_by(models.WechatConfig.user_id).limit(KEEPALIVE_BATCH_SIZE).all()
+        finally:
+            db.close()
+
+        if rows:
+            last_id = rows[-1][0]
+            yield [{
+                'user_id': row[0],
+                'cookie': row[1],
+                'sess_id': row[2],
+                'has_cache': row[3] is not None,
+                'fail_count': row[4] or 0,
+                'backoff_until': row[5],
+            } for row in rows]
+        if wanted is not None:
+            if not wanted:
+                return
+        elif len(rows) < KEEPALIVE_BATCH_SIZE:
+            return
+
+def _notify_cookie_invalid(user_id: int):
+    db = database.SessionLocal()
+    try:
+        bark_service.send_cookie_invalid_notification(db, user_id)
+    except Exception as notify_error:
+        logger.error(f"发送Cookie失效通知失败: {notify_error}")
+    finally:
+        db.close()
+
+def _keep_alive_user(state: dict) -> dict:
+    """Refresh one user's cookie and SESS_ID on a worker thread; returns the new cache state and outcome."""
+    user_id = state['user_id']
+    result = {
+        'user_id': user_id,
+        'outcome': 'skipped',
+        'has_cache': state['has_cache'],
+        'fail_count': state['fail_count'],
+        'backoff_until': state['backoff_until'],
+        'deactivate': False,
+    }
+    try:
+        # 1. Maintain Authorization Cookie (for reservation)
+        if state['cookie'] and state.get('refresh_cookie', True):
+            # Reuse the user's long-lived service (session, cookie jar); updated cookies are persisted by the registry
+            service = session_registry.acquire(user_id, state['cookie'])
+
             try:
-                # 1. Maintain Authorization Cookie (for reservation)
-                if user.wechat_config and user.wechat_config.cookie:
-                    # Define callback to save updated cookie
-                    # We need to capture user_id to query fresh if needed, but 'user' object is attached to session
-                    def save_cookie(new_cookie):
-                        try:
-                            # Ensure we are working with the latest state
-                            user.wechat_config.cookie = new_cookie
-                            db.add(user.wechat_config)
-                            db.commit()
-                        except Exception as e:
-                            logger.error(f"Failed to save cookie for user {user.id}: {e}")
-
-                    # Initialize service with current cookie
-                    service = LibService(user.wechat_config.cookie, save_cookie)
-                    
+                time.sleep(random.uniform(0.2, 1.0))
+            except Exception:
+                pass
+
+            tz = getattr(scheduler, 'timezone', None)
+            now = datetime.now(tz) if tz else datetime.now()
+            now_naive = now.replace(tzinfo=None)
+
+            # Note: 'htmlrule_backoff_until' column name is preserved to avoid migration, 
+            # but it now controls backoff for getUserCancleConfig query.
+            do_keepalive = True
+            if state['backoff_until']:
+                try:
+                    backoff_time = state['backoff_until']
+                    if backoff_time.tzinfo is not None:
+                        cmp_now = now
+                    else:
+                        cmp_now = now_naive
+                    if backoff_time > cmp_now:
+                        do_keepalive = False
+                except Exception as cmp_error:
+                    logger.warning(f"Backoff time compare failed for user {user_id}: {cmp_error}")
+                    do_keepalive = False
+
+            try:
+                status = http_client.run_sync(service.keep_alive(do_keepalive_query=do_keepalive))
+                page_ok = bool((status or {}).get('page_ok'))
+                api_ok = bool((status or {}).get('api_ok'))
+                result['outcome'] = 'ok' if api_ok else 'failed'
+
+                if api_ok:
+                    result['fail_count'] = 0
+                    result['backoff_until'] = None
+                elif page_ok and not api_ok:
+                    # 2024-12-27: keep-alive query (getUserCancleConfig) failing.
+                    # Check if session is actually valid using a read operation.
+                    is_valid = False
                     try:
-                        time.sleep(random.uniform(0.2, 1.0))
+                        http_client.run_sync(service.check_alive())
+                        is_valid = True
                     except Exception:
-                        pass
-                    
-                    tz = getattr(scheduler, 'timezone', None)
-                    now = datetime.now(tz) if tz else datetime.now()
-                    now_naive = now.replace(tzinfo=None)
-                    cache = db.query(models.SeatStatusCache).filter(models.SeatStatusCache.user_id == user.id).first()
-                    if not cache:
-                        cache = models.SeatStatusCache(user_id=user.id, keepalive_fail_count=0)
-                        db.add(cache)
-                        db.commit()
-                        db.refresh(cache)
-                    
-                    # Note: 'htmlrule_backoff_until' column name is preserved to avoid migration, 
-                    # but it now controls backoff for getUserCancleConfig query.
-                    do_keepalive = True
-                    if cache.htmlrule_backoff_until:
-                        try:
-                            backoff_time = cache.htmlrule_backoff_until
-                            if backoff_time.tzinfo is not None:
-                                cmp_now = now
-                                backoff_cmp = backoff_time
-                            else:
-                                cmp_now = now_naive
-                                backoff_cmp = backoff_time
-                            if backoff_cmp > cmp_now:
-                                do_keepalive = False
-                        except Exception as cmp_error:
-                            logger.warning(f"Backoff time compare failed for user {user.id}: {cmp_error}")
-                            do_keepalive = False
-                    
-                    try:
-                        status = service.keep_alive(do_keepalive_query=do_keepalive)
-                        page_ok = bool((status or {}).get('page_ok'))
-                        api_ok = bool((status or {}).get('api_ok'))
-                        
-                        if api_ok:
-                            cache.keepalive_fail_count = 0
-                            cache.htmlrule_backoff_until = None
-                            db.add(cache)
-                            db.commit()
-                        elif page_ok and not api_ok:
-                            # 2024-12-27: keep-alive query (getUserCancleConfig) failing.
-                            # Check if session is actually valid using a read operation.
-                            is_valid = False
-                            try:
-                                service.get_user_info()
-                                is_valid = True
-                            except Exception:
-                                is_valid = False
-
-                            if is_valid:
-                                logger.warning(f"User {user.id} keep-alive partial: Page OK, but API failed. Session verified via get_user_info.")
-                                # Reset fail count because session is actually valid
-                                cache.keepalive_fail_count = 0
-                                db.add(cache)
-                                db.commit()
-                            else:
-                                # Session is DEAD.
-                                logger.error(f"User {user.id} keep-alive FAILED: API failed AND get_user_info failed.")
-                                cache.keepalive_fail_count = (cache.keepalive_fail_count or 0) + 1
-                                if cache.keepalive_fail_count >= 2:
-                                    # Send notification
-                                    try:
-                                        bark_service.send_cookie_invalid_notification(db, user.id)
-                                    except Exception as notify_error:
-                                        logger.error(f"发送Cookie失效通知失败: {notify_error}")
-                                    
-                                    # Deactivate cookies to stop keep-alive
-                                    try:
-                                        if user.wechat_config:
-                                            user.wechat_config.cookie = None
-                                            user.wechat_config.sess_id = None
-                                            db.add(user.wechat_config)
-                                            db.commit()
-                                            logger.info(f"Deactivated cookies for user {user.id} due to persistent failures.")
-                                    except Exception as db_error:
-                                        logger.error(f"Failed to deactivate cookies for user {user.id}: {db_error}")
-
-                                db.add(cache)
-                                db.commit()
-                    except Exception as e:
-                        # Log but do not stop processing other users
-                        logger.warning(f"Keep-alive failed for user {user.id}: {e}")
-                        emsg = str(e).lower()
-                        try:
-                            if '40001' in emsg or 'cookie失效' in emsg or '403' in emsg:
-                                bark_service.send_cookie_invalid_notification(db, user.id)
-                        except Exception as notify_error:
-                            logger.error(f"发送Cookie失效通知失败: {notify_error}")
-
-                # 2. Maintain wechatSESS_ID (for bluetooth check-in)
-                if user.wechat_config and user.wechat_config.sess_id:
-                     try:
-                         # Lightweight keep-alive for SESS_ID
-                         AuthService.keep_alive_sess_id(user.wechat_config.sess_id)
-                     except Exception as e:
-                         logger.warning(f"SESS_ID keep-alive failed for user {user.id}: {e}")
-                
+                        is_valid = False
+
+                    if is_valid:
+                        logger.warning(f"User {user_id} keep-alive partial: Page OK, but API failed. Session verified via liveness probe.")
+                        # Reset fail count because session is actually valid
+                        result['outcome'] = 'partial'
+                        result['fail_count'] = 0
+                    else:
+                        # Session is DEAD.
+                        logger.error(f"User {user_id} keep-alive FAILED: API failed AND liveness probe failed.")
+                        result['outcome'] = 'dead'
+                        result['fail_count'] = (state['fail_count'] or 0) + 1
+                        if result['fail_count'] >= 2:
+                            # Send notification, then deactivate cookies to stop keep-alive
+                            _notify_cookie_invalid(user_id)
+                            result['deactivate'] = True
             except Exception as e:
-                logger.error(f"Error processing user {user.id}: {e}")
-                
+                # Log but do not stop processing other users
+                result['outcome'] = 'failed'
+                logger.warning(f"Keep-alive failed for user {user_id}: {e}")
+                emsg = str(e).lower()
+                if '40001' in emsg or 'cookie失效' in emsg or '403' in emsg:
+                    _notify_cookie_invalid(user_id)
+
+        # 2. Maintain wechatSESS_ID (for bluetooth check-in)
+        if state['sess_id'] and not result['deactivate']:
+             try:
+                 # Lightweight keep-alive for SESS_ID
+                 AuthService.keep_alive_sess_id(state['sess_id'])
+             except Exception as e:
+                 logger.warning(f"SESS_ID keep-alive failed for user {user_id}: {e}")
+
     except Exception as e:
-        logger.error(f"Global keep-alive task critical failure: {e}")
+        result['outcome'] = 'error'
+        logger.error(f"Error processing user {user_id}: {e}")
+    return result
+
+def _apply_keep_alive_results(results):
+    """Write back keep-alive cache state and deactivations for one chunk in a handful of statements."""
+    cache_table = models.SeatStatusCache.__table__
+    config_table = models.WechatConfig.__table__
+    updates = [
+        {'uid': r['user_id'], 'fail_count': r['fail_count'], 'backoff_until': r['backoff_until']}
+        for r in results if r['has_cache']
+    ]
+    inserts = [
+        {'user_id': r['user_id'], 'keepalive_fail_count': r['fail_count'], 'htmlrule_backoff_until': r['backoff_until']}
+        for r in results if not r['has_cache']
+    ]
+    deactivated = [r['user_id'] for r in results if r['deactivate']]
+
+    db = database.SessionLocal()
+    try:
+        conn = db.connection()
+        if updates:
+            conn.execute(
+                cache_table.update()
+                .where(cache_table.c.user_id == bindparam('uid'))
+                .values(keepalive_fail_count=bindparam('fail_count'), htmlrule_backoff_until=bindparam('backoff_until')),
+                updates
+            )
+        if deactivated:
+            conn.execute(
+                config_table.update()
+                .where(config_table.c.user_id.in_(deactivated))
+                .values(cookie=None, sess_id=None)
+            )
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Failed to write keep-alive state for {len(results)} users: {e}")
+        deactivated = []
+    finally:
+        db.close()
+
+    if inserts:
+        _insert_keep_alive_cache_rows(inserts)
+
+    for user_id in deactivated:
+        session_registry.evict(user_id)
+        cookie_lifetime.tracker.forget(user_id)
+        logger.info(f"Deactivated cookies for user {user_id} due to persistent failures.")
+
+def _insert_keep_alive_cache_rows(rows):
+    cache_table = models.SeatStatusCache.__table__
+    db = database.SessionLocal()
+    try:
+        db.connection().execute(cache_table.insert(), rows)
+        db.commit()
+        return
+    except IntegrityError:
+        # Another job (e.g. the seat monitor) created some of the rows meanwhile; fall back to per-row upserts
+        db.rollback()
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Failed to create keep-alive cache rows: {e}")
+        db.close()
+        return
+
+    try:
+        conn = db.connection()
+        for row in rows:
+            updated = conn.execute(
+                cache_table.update()
+                .where(cache_table.c.user_id == row['user_id'])
+                .values(keepalive_fail_count=row['keepalive_fail_count'], htmlrule_backoff_until=row['htmlrule_backoff_until'])
+            )
+            if updated.rowcount == 0:
+                conn.execute(cache_table.insert().values(**row))
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Failed to upsert keep-alive cache rows: {e}")
     finally:
         db.close()
 
@@ -457,24 +746,74 @@ def start_scheduler():
             
         # --- Add Global Keep-Alive Job ---
         # This ensures cookies are refreshed automatically in the background
-        # without user intervention.
+        # without user intervention. Users are spread over the interval in
+        # stable slots instead of being refreshed in one burst.
         keep_alive_job_id = 'global_keep_alive'
         if not scheduler.get_job(keep_alive_job_id):
             try:
                 scheduler.add_job(
-                    run_global_keep_alive,
-                    IntervalTrigger(minutes=55),
+                    run_keep_alive_tick,
+                    IntervalTrigger(seconds=KEEPALIVE_TICK_SECONDS),
                     id=keep_alive_job_id,
                     replace_existing=True,
-                    name="Global Cookie Keep-Alive"
+                    name="Staggered Cookie Keep-Alive"
                 )
                 logger.info(f"Registered system job: {keep_alive_job_id}")
             except Exception as e:
                 logger.error(f"Failed to register global keep-alive job: {e}")
                 
+        clock_sync_job_id = 'clock_sync'
+        if not scheduler.get_job(clock_sync_job_id):
+            try:
+                scheduler.add_job(
+                    clock_sync.clock.sample,
+                    IntervalTrigger(seconds=clock_sync.SYNC_INTERVAL_SECONDS),
+                    id=clock_sync_job_id,
+                    replace_existing=True,
+                    name="Upstream Clock Sync",
+                    next_run_time=datetime.now(scheduler.timezone)
+                )
+                logger.info(f"Registered system job: {clock_sync_job_id}")
+            except Exception as e:
+                logger.error(f"Failed to register clock sync job: {e}")
+
+        # Delayed sign-ins after a supervision event run as one-shot jobs at their exact time
+        seat_monitor.bind_scheduler(scheduler)
+        seat_monitor.rehydrate_delayed_signins()
+
+        # Per-user adaptive seat monitoring; each tick only checks users whose next check is due
+        seat_monitor_job_id = 'seat_monitor'
+        if not scheduler.get_job(seat_monitor_job_id):
+            try:
+                scheduler.add_job(
+                    seat_monitor.run_scheduled_cycle,
+                    IntervalTrigger(seconds=seat_monitor.SEAT_MONITOR_TICK_SECONDS),
+                    id=seat_monitor_job_id,
+                    replace_existing=True,
+                    name="Adaptive Seat Monitor"
+                )
+                logger.info(f"Registered system job: {seat_monitor_job_id}")
+            except Exception as e:
+                logger.error(f"Failed to register seat monitor job: {e}")
+
+        prune_job_id = 'task_run_prune'
+        if not scheduler.get_job(prune_job_id):
+            try:
+                scheduler.add_job(
+                    task_runs.prune,
+                    CronTrigger(hour=4, minute=17),
+                    id=prune_job_id,
+                    replace_existing=True,
+                    name="Task Run History Prune"
+                )
+                logger.info(f"Registered system job: {prune_job_id}")
+            except Exception as e:
+                logger.error(f"Failed to register task run prune job: {e}")
+                
     except Exception as e:
         logger.error(f"Failed to load tasks: {e}")
     finally:
         db.close()
         
+    scheduler.add_listener(_on_job_event, EVENT_JOB_SUBMITTED | EVENT_JOB_ERROR | EVENT_JOB_MISSED | EVENT_JOB_MAX_INSTANCES)
     scheduler.start()
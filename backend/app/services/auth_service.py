@@ -1,10 +1,13 @@
 import requests
 import json
+import time
 import base64
 import urllib.parse
 from Crypto.Cipher import PKCS1_v1_5 as Cipher_pksc1_v1_5
 from Crypto.PublicKey import RSA
 
+from app.services import clock_sync, upstream_metrics
+
 class AuthService:
     PUBLIC_KEY_STR = 'MIIBIjANBgkqhkiG9w0BAQEFAAOCAQ8AMIIBCgKCAQEA0dmmkW4xPa+HhBTyaa0dgAb0fVZRS67jK4y15BQthjJ/ZuUZQmrbGqhG7rwnxfm7g+nFH9zEyRU5KLX3ty9jpNrPjyg7FBF9OvBDYHEt83b77W3mfBjpmoTJOt27E7RZ4InHqJQjqSEo4bw1PDz2OBmtlNIlXMu0VA8I0Bh39hBBnm0oouRV7FdqEzAp8nsF7a3VuBYpx9xek+cRVip0pMXI1AXM6bmyWWNzV0oikQW4ZIbutgDziTMeW28zl/hRbW9Ht34w0sWYyxumuLr1qweW3qnxycn3zn47weFYe6nJp71z+lgVtNTGtowNPPqBLXqusvwf+uNhSy1wKQFpUwIDAQAB'
 
@@ -102,10 +105,16 @@ class AuthService:
             'Referer': 'https://servicewechat.com/wx3b9352e6b254ed2b/11/page-frame.html',
         }
         
-        # Get Time
+        # Get Time (skipped when the clock-offset estimate is fresh enough to reproduce it)
         try:
-            r_time = requests.get('https://wechat.v2.traceint.com/index.php/wxApp/getTime.html', headers=headers)
-            password = AuthService._encrypt(r_time.text, AuthService.PUBLIC_KEY_STR)
+            server_time = clock_sync.clock.server_time_text()
+            if server_time is None:
+                t0 = time.time()
+                with upstream_metrics.track('getTime') as call:
+                    r_time = call.response = requests.get(clock_sync.GET_TIME_URL, headers=headers)
+                clock_sync.clock.observe_get_time(t0, r_time.text, time.time())
+                server_time = r_time.text
+            password = AuthService._encrypt(server_time, AuthService.PUBLIC_KEY_STR)
         except Exception as e:
             raise Exception(f"Failed to get timestamp: {e}")
 
@@ -130,7 +139,8 @@ class AuthService:
         }
         
         try:
-            r = requests.post(url=sign_url, data=datas, headers=headers)
+            with upstream_metrics.track('sign') as call:
+                r = call.response = requests.post(url=sign_url, data=datas, headers=headers)
             if r.status_code == 403:
                 raise Exception('Forbidden(403) 打卡被阻止')
             msg = {}
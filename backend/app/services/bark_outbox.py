@@ -0,0 +1,376 @@
+"""
+Bark 推送发件箱（outbox）
+
+send_notification 只写入一条 status="pending" 的 BarkNotification 并把 ID 放进内存队列，立即返回；
+后台工作线程负责实际推送并回写结果。网络错误、超时、5xx / 429 按指数退避重试，
+超过 BARK_MAX_ATTEMPTS 次或遇到不可重试的错误后标记为 failed。
+投递前用条件 UPDATE 把 pending 改为 sending 来认领，避免同一条通知被重复推送；认领时在
+next_attempt_at 写入租约到期时间，投递中途出错（进程退出、数据库异常）而停留在 sending 的
+通知在租约过期后回到 pending：后台模式下工作线程每 BARK_RECLAIM_INTERVAL_SECONDS 检查一次并
+重新入队。进程重启后由 rehydrate() 重新加载表中未完成的通知。
+没有常驻进程的部署（如 Vercel）默认同步投递，且不启动后台线程：可重试的失败只把通知留在
+pending 并记下重试时间，由外部 Cron 调用 drain() 补发。
+
+推送按 server_url 复用长连接的 httpx.Client（装有 h2 时启用 HTTP/2），每个服务器的并发
+请求数受 BARK_SERVER_CONCURRENCY 限制，耗时按服务器分别统计。
+"""
+import heapq
+import itertools
+import logging
+import os
+import random
+import threading
+import time
+import urllib.parse
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+from sqlalchemy import or_
+
+from app import database, models
+from app.core.metrics import registry
+from app.services.http_client import HTTP2_AVAILABLE
+
+logger = logging.getLogger(__name__)
+# httpx logs every request URL at INFO, and a Bark push URL carries the device key and the message
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+DEFAULT_SERVER_URL = "https://api.day.app"
+PUSH_ICON = "https://lingxilearn.cn/logo.jpg"
+PUSH_GROUP = "图书馆助手"
+
+BARK_WORKERS = int(os.getenv("BARK_WORKERS", "8"))
+MAX_ATTEMPTS = int(os.getenv("BARK_MAX_ATTEMPTS", "5"))
+RETRY_BASE_SECONDS = float(os.getenv("BARK_RETRY_BASE_SECONDS", "2"))
+RETRY_MAX_SECONDS = float(os.getenv("BARK_RETRY_MAX_SECONDS", "300"))
+# Serverless instances freeze between requests, so background delivery would stall there
+ASYNC_DELIVERY = os.getenv("BARK_OUTBOX_ASYNC", "0" if os.getenv("VERCEL") else "1") == "1"
+# A "sending" row older than this was abandoned mid-delivery and may be claimed again
+LEASE_SECONDS = float(os.getenv("BARK_LEASE_SECONDS", "300"))
+RECLAIM_INTERVAL_SECONDS = float(os.getenv("BARK_RECLAIM_INTERVAL_SECONDS", "60"))
+DRAIN_BATCH_SIZE = int(os.getenv("BARK_DRAIN_BATCH_SIZE", "50"))
+
+# Below BARK_WORKERS so one slow server cannot hold every worker
+SERVER_CONCURRENCY = int(os.getenv("BARK_SERVER_CONCURRENCY", "4"))
+PUSH_TIMEOUT = float(os.getenv("BARK_TIMEOUT", "10"))
+KEEPALIVE_EXPIRY = float(os.getenv("BARK_KEEPALIVE_EXPIRY", "120"))
+HTTP2_ENABLED = os.getenv("BARK_HTTP2", "1") == "1" and HTTP2_AVAILABLE
+
+SEND_LATENCY = registry.histogram("bark_send_duration_seconds", "Bark push request latency by server", ("server",))
+SENDS = registry.counter("bark_sends_total", "Bark push attempts by outcome", ("outcome",))
+RETRIES = registry.counter("bark_retries_total", "Bark pushes rescheduled after a retriable failure")
+QUEUE_DEPTH = registry.gauge("bark_outbox_queued", "Notifications waiting in the Bark outbox (including scheduled retries)")
+
+
+def build_push_url(server_url: Optional[str], bark_key: str, title: str, content: str, url: Optional[str] = None) -> str:
+    push_url = f"{server_url or DEFAULT_SERVER_URL}/{bark_key}/{urllib.parse.quote(title)}/{urllib.parse.quote(content)}"
+
+    params = [f"icon={urllib.parse.quote(PUSH_ICON)}"]
+    if url:
+        params.append(f"url={urllib.parse.quote(url)}")
+    params.append(f"group={urllib.parse.quote(PUSH_GROUP)}")
+
+    return push_url + "?" + "&".join(params)
+
+
+class ServerPool:
+    """One keep-alive client and one concurrency cap per Bark server, shared by all workers."""
+
+    def __init__(self, concurrency: int = SERVER_CONCURRENCY):
+        self.concurrency = concurrency
+        self._lock = threading.Lock()
+        self._servers: Dict[str, Tuple[httpx.Client, threading.BoundedSemaphore]] = {}
+
+    def get(self, server_url: str) -> Tuple[httpx.Client, threading.BoundedSemaphore]:
+        entry = self._servers.get(server_url)
+        if entry is None:
+            with self._lock:
+                entry = self._servers.get(server_url)
+                if entry is None:
+                    client = httpx.Client(
+                        http2=HTTP2_ENABLED,
+                        timeout=PUSH_TIMEOUT,
+                        limits=httpx.Limits(
+                            max_connections=self.concurrency,
+                            max_keepalive_connections=self.concurrency,
+                            keepalive_expiry=KEEPALIVE_EXPIRY,
+                        ),
+                    )
+                    entry = self._servers[server_url] = (client, threading.BoundedSemaphore(self.concurrency))
+                    logger.info(f"Bark client opened for {server_label(server_url)} (http2={HTTP2_ENABLED})")
+        return entry
+
+    def close(self):
+        with self._lock:
+            servers, self._servers = self._servers, {}
+        for client, _ in servers.values():
+            try:
+                client.close()
+            except Exception:
+                pass
+
+
+servers = ServerPool()
+
+
+def server_label(server_url: Optional[str]) -> str:
+    return urllib.parse.urlsplit(server_url or DEFAULT_SERVER_URL).netloc or 'unknown'
+
+
+def push(server_url: Optional[str], bark_key: str, title: str, content: str, url: Optional[str] = None) -> dict:
+    """Send one push and return Bark's JSON reply; transport and HTTP errors propagate."""
+    server_url = (server_url or DEFAULT_SERVER_URL).rstrip('/')
+    push_url = build_push_url(server_url, bark_key, title, content, url)
+    client, slots = servers.get(server_url)
+    label = server_label(server_url)
+    with slots:
+        started = time.perf_counter()
+        try:
+            response = client.get(push_url)
+            response.raise_for_status()
+            result = response.json()
+        except Exception:
+            SENDS.inc(outcome='error')
+            raise
+        finally:
+            SEND_LATENCY.observe(time.perf_counter() - started, server=label)
+    SENDS.inc(outcome='success' if result.get('code') == 200 else 'rejected')
+    return result
+
+
+def is_retriable(e: Exception) -> bool:
+    if isinstance(e, httpx.TransportError):
+        return True
+    if isinstance(e, httpx.HTTPStatusError):
+        return e.response.status_code >= 500 or e.response.status_code == 429
+    return False
+
+
+def retry_delay(attempts: int) -> float:
+    delay = min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * (2 ** max(0, attempts - 1)))
+    return delay * random.uniform(0.8, 1.2)
+
+
+def _seconds_until(at: Optional[datetime], now: datetime) -> float:
+    if at is None:
+        return 0.0
+    if at.tzinfo is not None:
+        at = at.astimezone().replace(tzinfo=None)
+    return max(0.0, (at - now).total_seconds())
+
+
+class BarkOutbox:
+    def __init__(self, workers: int = BARK_WORKERS, max_attempts: int = MAX_ATTEMPTS, background: bool = ASYNC_DELIVERY):
+        self.workers = workers
+        self.max_attempts = max_attempts
+        # Without background workers retries wait in the table for drain()
+        self.background = background
+        self._cond = threading.Condition()
+        # (due monotonic time, sequence, notification id)
+        self._heap = []
+        self._seq = itertools.count()
+        self._threads = []
+        self._stopped = False
+        self._next_reclaim = time.monotonic() + RECLAIM_INTERVAL_SECONDS
+
+    def __len__(self):
+        with self._cond:
+            return len(self._heap)
+
+    # --- Queue ---
+    def enqueue(self, notification_id: int, delay: float = 0.0):
+        with self._cond:
+            heapq.heappush(self._heap, (time.monotonic() + delay, next(self._seq), notification_id))
+            self._ensure_workers()
+            self._cond.notify()
+
+    def _ensure_workers(self):
+        self._threads = [t for t in self._threads if t.is_alive()]
+        self._stopped = False
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._run, name=f"bark-outbox-{len(self._threads)}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        """Undelivered notifications stay pending in the table and are picked up again by rehydrate()."""
+        with self._cond:
+            self._stopped = True
+            self._heap = []
+            self._cond.notify_all()
+        servers.close()
+
+    def _run(self):
+        while True:
+            reclaim = False
+            with self._cond:
+                while not self._stopped:
+                    now = time.monotonic()
+                    if now >= self._next_reclaim:
+                        # One worker takes the periodic lease sweep; the rest keep waiting
+                        self._next_reclaim = now + RECLAIM_INTERVAL_SECONDS
+                        reclaim = True
+                        break
+                    if self._heap and self._heap[0][0] <= now:
+                        break
+                    wake_at = min(self._heap[0][0], self._next_reclaim) if self._heap else self._next_reclaim
+                    self._cond.wait(timeout=wake_at - now)
+                if self._stopped:
+                    return
+                if not reclaim:
+                    _, _, notification_id = heapq.heappop(self._heap)
+            if reclaim:
+                self.reclaim()
+                continue
+            try:
+                self.deliver(notification_id)
+            except Exception as e:
+                logger.error(f"投递Bark通知 {notification_id} 异常: {e}")
+
+    @staticmethod
+    def _reclaim(db) -> List[int]:
+        """Return deliveries whose lease ran out (abandoned mid-delivery) to pending; returns their IDs."""
+        expired = (
+            models.BarkNotification.status == "sending",
+            or_(models.BarkNotification.next_attempt_at == None,
+                models.BarkNotification.next_attempt_at < datetime.now()),
+        )
+        ids = [notification_id for (notification_id,) in db.query(models.BarkNotification.id).filter(*expired).all()]
+        if ids:
+            # Re-check the lease so a delivery finishing meanwhile is left alone
+            db.query(models.BarkNotification).filter(
+                models.BarkNotification.id.in_(ids), *expired
+            ).update({"status": "pending", "next_attempt_at": None}, synchronize_session=False)
+        db.commit()
+        if ids:
+            logger.warning(f"Reclaimed {len(ids)} Bark notification(s) abandoned mid-delivery")
+        return ids
+
+    def reclaim(self) -> int:
+        """Background-mode sweep: put deliveries with an expired lease back on the queue."""
+        db = database.SessionLocal()
+        try:
+            ids = self._reclaim(db)
+        except Exception as e:
+            db.rollback()
+            logger.error(f"回收超时的Bark通知失败: {e}")
+            return 0
+        finally:
+            db.close()
+        for notification_id in ids:
+            # deliver() claims only rows still pending, so an ID that finished meanwhile is a no-op
+            self.enqueue(notification_id)
+        return len(ids)
+
+    def rehydrate(self) -> int:
+        """Re-queue notifications left pending (or abandoned mid-delivery) by a previous process."""
+        db = database.SessionLocal()
+        try:
+            self._reclaim(db)
+            rows = db.query(models.BarkNotification.id, models.BarkNotification.next_attempt_at).filter(
+                models.BarkNotification.status == "pending"
+            ).order_by(models.BarkNotification.id).all()
+        except Exception as e:
+            db.rollback()
+            logger.error(f"加载待投递的Bark通知失败: {e}")
+            return 0
+        finally:
+            db.close()
+        now = datetime.now()
+        for notification_id, next_attempt_at in rows:
+            # Keep the backoff a retry was already waiting out
+            self.enqueue(notification_id, _seconds_until(next_attempt_at, now))
+        if rows:
+            logger.info(f"Re-queued {len(rows)} pending Bark notification(s)")
+        return len(rows)
+
+    def drain(self, limit: int = DRAIN_BATCH_SIZE) -> int:
+        """Deliver due pending notifications inline; the cron pass for deployments without background workers."""
+        db = database.SessionLocal()
+        try:
+            self._reclaim(db)
+            rows = db.query(models.BarkNotification.id).filter(
+                models.BarkNotification.status == "pending",
+                or_(models.BarkNotification.next_attempt_at == None,
+                    models.BarkNotification.next_attempt_at <= datetime.now())
+            ).order_by(models.BarkNotification.id).limit(limit).all()
+        except Exception as e:
+            db.rollback()
+            logger.error(f"加载待投递的Bark通知失败: {e}")
+            return 0
+        finally:
+            db.close()
+        return sum(1 for (notification_id,) in rows if self.deliver(notification_id))
+
+    # --- Delivery ---
+    def deliver(self, notification_id: int, retry: bool = True) -> bool:
+        """Push one queued notification and record the outcome; returns whether Bark accepted it."""
+        db = database.SessionLocal()
+        try:
+            claimed = db.query(models.BarkNotification).filter(
+                models.BarkNotification.id == notification_id,
+                models.BarkNotification.status == "pending"
+            ).update({
+                "status": "sending",
+                "next_attempt_at": datetime.now() + timedelta(seconds=LEASE_SECONDS),
+            }, synchronize_session=False)
+            db.commit()
+            if not claimed:
+                return False
+
+            notification = db.query(models.BarkNotification).filter(
+                models.BarkNotification.id == notification_id
+            ).first()
+            bark_config = db.query(models.BarkConfig).filter(
+                models.BarkConfig.user_id == notification.user_id
+            ).first()
+            notification.attempts = (notification.attempts or 0) + 1
+            notification.next_attempt_at = None
+
+            if not bark_config:
+                notification.status = "failed"
+                notification.error_message = "未配置Bark推送"
+                db.commit()
+                return False
+
+            delay = None
+            success = False
+            try:
+                result = push(bark_config.server_url, bark_config.bark_key,
+                              notification.title, notification.content, notification.url)
+                success = result.get('code') == 200
+                notification.status = "success" if success else "failed"
+                notification.error_message = None if success else str(result)[:255]
+            except Exception as e:
+                # HTTPStatusError messages quote the push URL
+                notification.error_message = str(e).replace(bark_config.bark_key, '***')[:255]
+                if retry and is_retriable(e) and notification.attempts < self.max_attempts:
+                    notification.status = "pending"
+                    delay = retry_delay(notification.attempts)
+                    notification.next_attempt_at = datetime.now() + timedelta(seconds=delay)
+                else:
+                    notification.status = "failed"
+            db.commit()
+
+            if success:
+                logger.info(f"Bark推送发送成功: 用户 {notification.user_id}, 类型 {notification.notification_type}")
+            elif delay is not None:
+                RETRIES.inc()
+                logger.warning(f"Bark推送失败，{delay:.1f}s 后第 {notification.attempts + 1} 次重试: 用户 {notification.user_id}, 错误 {notification.error_message}")
+                if self.background:
+                    self.enqueue(notification_id, delay)
+                # Otherwise the row stays pending until a drain() after next_attempt_at
+            else:
+                logger.warning(f"Bark推送发送失败: 用户 {notification.user_id}, 原因 {notification.error_message}")
+            return success
+        except Exception as e:
+            db.rollback()
+            logger.error(f"投递Bark通知 {notification_id} 失败: {e}")
+            return False
+        finally:
+            db.close()
+
+
+outbox = BarkOutbox()
+QUEUE_DEPTH.set_function(lambda: [({}, len(outbox))])
@@ -2,11 +2,11 @@
 Bark推送服务模块
 支持发送iOS推送通知到Bark应用
 """
-import requests
 import logging
 from typing import Optional, List
 from sqlalchemy.orm import Session
 from app import models
+from app.services import bark_outbox
 
 logger = logging.getLogger(__name__)
 
@@ -71,11 +71,14 @@ def send_notification(
     content: str,
     icon: Optional[str] = None,
     url: Optional[str] = None,
-    force: bool = False
+    force: bool = False,
+    wait: bool = False
 ) -> bool:
     """
     发送Bark推送通知
     
+    通知写入发件箱后立即返回，由后台工作线程投递（失败自动重试）。
+    
     Args:
         db: 数据库会话
         user_id: 用户ID
@@ -85,9 +88,10 @@ def send_notification(
         icon: 通知图标（emoji）
         url: 跳转链接
         force: 是否强制发送（忽略订阅设置）
+        wait: 是否同步投递并等待结果（不重试）
     
     Returns:
-        是否发送成功
+        是否已加入发件箱；wait=True 时为是否发送成功
     """
     try:
         # 1. 查询用户的Bark配置
@@ -111,36 +115,7 @@ def send_notification(
                 logger.info(f"用户 {user_id} 未订阅 {category} 类型的通知")
                 return False
         
-        # 3. 构建推送URL
-        server_url = bark_config.server_url or "https://api.day.app"
-        bark_key = bark_config.bark_key
-        
-        # URL编码标题和内容
-        import urllib.parse
-        encoded_title = urllib.parse.quote(title)
-        encoded_content = urllib.parse.quote(content)
-        
-        push_url = f"{server_url}/{bark_key}/{encoded_title}/{encoded_content}"
-        
-        params = []
-        params.append(f"icon={urllib.parse.quote('https://lingxilearn.cn/logo.jpg')}")
-        
-        if url:
-            params.append(f"url={urllib.parse.quote(url)}")
-        
-        params.append(f"group={urllib.parse.quote('图书馆助手')}")
-        
-        if params:
-            push_url += "?" + "&".join(params)
-        
-        # 4. 发送推送请求
-        response = requests.get(push_url, timeout=10)
-        response.raise_for_status()
-        
-        result = response.json()
-        success = result.get('code') == 200
-        
-        # 5. 记录通知历史
+        # 3. 写入发件箱
         notification = models.BarkNotification(
             user_id=user_id,
             notification_type=notification_type,
@@ -148,39 +123,20 @@ def send_notification(
             content=content,
             icon=icon,
             url=url,
-            status="success" if success else "failed",
-            error_message=None if success else str(result)
+            status="pending",
+            attempts=0
         )
         db.add(notification)
         db.commit()
         
-        if success:
-            logger.info(f"Bark推送发送成功: 用户 {user_id}, 类型 {notification_type}")
-        else:
-            logger.warning(f"Bark推送发送失败: 用户 {user_id}, 响应 {result}")
-        
-        return success
+        # 4. 投递：默认交给后台工作线程，调用方不等待推送结果
+        if wait or not bark_outbox.outbox.background:
+            return bark_outbox.outbox.deliver(notification.id, retry=not wait)
+        bark_outbox.outbox.enqueue(notification.id)
+        return True
         
     except Exception as e:
         logger.error(f"发送Bark推送异常: 用户 {user_id}, 错误 {e}")
-        
-        # 记录失败的通知
-        try:
-            notification = models.BarkNotification(
-                user_id=user_id,
-                notification_type=notification_type,
-                title=title,
-                content=content,
-                icon=icon,
-                url=url,
-                status="failed",
-                error_message=str(e)[:255]
-            )
-            db.add(notification)
-            db.commit()
-        except Exception as db_error:
-            logger.error(f"记录通知历史失败: {db_error}")
-        
         return False
 
 
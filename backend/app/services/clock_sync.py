@@ -0,0 +1,173 @@
+"""
+上游服务器时钟偏移估计
+
+定期请求 wxApp/getTime.html，并顺带利用每个上游响应的 HTTP Date 头，按 NTP 的方式估计
+本机与 Traceint 服务器之间的时钟偏移：offset = server_time - (t0 + t1) / 2，误差上界为
+RTT / 2 加上时间戳分辨率的一半，并随样本老化线性增长。服务器时间戳是截断值，因此取
+所在分辨率区间的中点（加上分辨率的一半）。
+
+getTime 样本（毫秒精度）与 Date 头样本（秒精度）分开保存：只要有未过期的 getTime 样本
+就只用它们，Date 头样本仅作兜底；is_fresh() 也只看 getTime 样本。
+
+server_now() 给出按偏移校正后的服务器时间；精准发射使用 server_now(precise=True)，
+没有新鲜的 getTime 估计时退回本机时钟。估计足够新时，签到可以直接生成服务器时间戳
+而省去一次 getTime 请求。
+"""
+import logging
+import os
+import threading
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+import requests
+
+from app.services import upstream_metrics
+
+logger = logging.getLogger(__name__)
+
+GET_TIME_URL = "https://wechat.v2.traceint.com/index.php/wxApp/getTime.html"
+
+SYNC_INTERVAL_SECONDS = int(os.getenv("CLOCK_SYNC_INTERVAL_SECONDS", "300"))
+MAX_AGE_SECONDS = float(os.getenv("CLOCK_SYNC_MAX_AGE_SECONDS", "900"))
+MAX_ERROR_SECONDS = float(os.getenv("CLOCK_SYNC_MAX_ERROR_MS", "500")) / 1000
+BURST_SIZE = 3
+# Assumed worst-case drift of the local clock between samples (NTP uses 15 ppm)
+DRIFT_RATE = 15e-6
+
+
+class _Sample:
+    __slots__ = ("offset", "rtt", "resolution", "taken_at")
+
+    def __init__(self, offset: float, rtt: float, resolution: float, taken_at: float):
+        self.offset = offset
+        self.rtt = rtt
+        self.resolution = resolution
+        self.taken_at = taken_at
+
+    def error(self, now: float) -> float:
+        return self.rtt / 2 + self.resolution / 2 + max(0.0, now - self.taken_at) * DRIFT_RATE
+
+
+class ClockSync:
+    def __init__(self, url: str = GET_TIME_URL):
+        self.url = url
+        self._lock = threading.Lock()
+        self._samples = deque(maxlen=16)
+        # Date-header samples arrive with every response; kept apart so they never evict getTime samples
+        self._header_samples = deque(maxlen=16)
+        # Digits of the getTime.html response (10 = seconds, 13 = milliseconds); needed to synthesize it
+        self._time_digits: Optional[int] = None
+        self._session: Optional[requests.Session] = None
+
+    # --- Observations ---
+    def _add(self, t0: float, server_time: float, t1: float, resolution: float, pool: deque):
+        if t1 < t0:
+            return
+        # The server truncates to its resolution; the true time lies anywhere in [t, t + resolution)
+        sample = _Sample(server_time + resolution / 2 - (t0 + t1) / 2, t1 - t0, resolution, t1)
+        with self._lock:
+            pool.append(sample)
+
+    def observe_get_time(self, t0: float, text: str, t1: float) -> bool:
+        """Record a getTime.html response (a bare epoch timestamp) bracketed by local send/receive times."""
+        text = (text or '').strip()
+        if not text.isdigit():
+            return False
+        digits = len(text)
+        if digits >= 13:
+            server_time, resolution = int(text) / 1000, 0.001
+        else:
+            server_time, resolution = float(text), 1.0
+        self._time_digits = digits
+        self._add(t0, server_time, t1, resolution, self._samples)
+        return True
+
+    def observe_date_header(self, t0: float, date_header: Optional[str], t1: float):
+        """HTTP Date headers only have one-second resolution, but they come for free with every response (fallback only)."""
+        if not date_header:
+            return
+        try:
+            server_time = parsedate_to_datetime(date_header).timestamp()
+        except (TypeError, ValueError):
+            return
+        self._add(t0, server_time, t1, 1.0, self._header_samples)
+
+    # --- Estimate ---
+    def _best(self, now: float, precise: bool = False) -> Optional[_Sample]:
+        pools = (self._samples,) if precise else (self._samples, self._header_samples)
+        with self._lock:
+            for pool in pools:
+                candidates = [s for s in pool if now - s.taken_at <= MAX_AGE_SECONDS]
+                if candidates:
+                    return min(candidates, key=lambda s: s.error(now))
+        return None
+
+    def offset(self, precise: bool = False) -> Optional[float]:
+        best = self._best(time.time(), precise)
+        return best.offset if best else None
+
+    def error(self, precise: bool = False) -> Optional[float]:
+        now = time.time()
+        best = self._best(now, precise)
+        return best.error(now) if best else None
+
+    def is_fresh(self) -> bool:
+        """Whether a recent getTime sample pins the offset within MAX_ERROR_SECONDS."""
+        err = self.error(precise=True)
+        return err is not None and err <= MAX_ERROR_SECONDS
+
+    def server_now(self, precise: bool = False) -> float:
+        """
+        Upstream server time as epoch seconds; falls back to the local clock without an estimate.
+        With precise=True only a fresh getTime estimate is applied, never a Date-header one.
+        """
+        if precise and not self.is_fresh():
+            return time.time()
+        offset = self.offset(precise)
+        return time.time() + (offset or 0.0)
+
+    def server_time_text(self) -> Optional[str]:
+        """Synthesize the getTime.html response from the estimate, or None if it is not trustworthy."""
+        if self._time_digits is None or not self.is_fresh():
+            return None
+        now = self.server_now()
+        return str(int(now * 1000)) if self._time_digits >= 13 else str(int(now))
+
+    # --- Sampling ---
+    def sample(self, headers: Optional[dict] = None) -> Optional[float]:
+        """Take a short burst of getTime samples; returns the resulting offset estimate."""
+        if self._session is None:
+            self._session = requests.Session()
+        for _ in range(BURST_SIZE):
+            try:
+                t0 = time.time()
+                with upstream_metrics.track('getTime') as call:
+                    r = call.response = self._session.get(self.url, headers=headers, timeout=5)
+                t1 = time.time()
+                if not self.observe_get_time(t0, r.text, t1):
+                    self.observe_date_header(t0, r.headers.get('Date'), t1)
+            except Exception as e:
+                logger.warning(f"Clock sync sample failed: {e}")
+                break
+        offset = self.offset()
+        if offset is not None:
+            logger.info(f"Upstream clock offset {offset * 1000:+.1f}ms (±{self.error() * 1000:.1f}ms)")
+        return offset
+
+    def ensure_fresh(self):
+        if not self.is_fresh():
+            self.sample()
+
+
+clock = ClockSync()
+
+
+def server_now() -> float:
+    return clock.server_now()
+
+
+def precise_server_now() -> float:
+    """Clock for precision launches: fresh getTime estimate or the local clock."""
+    return clock.server_now(precise=True)
@@ -0,0 +1,110 @@
+"""
+Cookie 生命周期追踪
+
+记录每个用户最近一次成功的 GraphQL 调用（任何成功的 _post 都相当于一次保活）以及
+观察到 Cookie 失效(40001)的时间，估算该用户 Authorization 的存活时长，
+让保活调度只在预计过期前刷新，跳过近期有正常业务调用的活跃用户。
+
+40001 同时表示"账号被临时限制"，失效样本噪声很大：两次刷新之间的间隔不会短于
+MIN_REFRESH_SECONDS（默认保活周期的一半），Token 实际存活超过某个失效样本后该样本作废，
+重新绑定 Cookie 时清空该用户的记录。
+"""
+import os
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional
+
+DEFAULT_LIFETIME_SECONDS = float(os.getenv("COOKIE_LIFETIME_MINUTES", "65")) * 60
+LEAD_SECONDS = float(os.getenv("KEEPALIVE_LEAD_MINUTES", "10")) * 60
+MIN_LIFETIME_SECONDS = 10 * 60
+# Floor on the predicted refresh interval so one noisy 40001 cannot make a user due on every tick
+MIN_REFRESH_SECONDS = float(os.getenv("KEEPALIVE_INTERVAL_MINUTES", "55")) * 60 / 2
+RETRY_SECONDS = 5 * 60
+
+
+class _Record:
+    __slots__ = ("last_success", "alive_since", "next_due", "deaths")
+
+    def __init__(self):
+        self.last_success: Optional[float] = None
+        # First success since the last observed death; how long the current token has provably lived
+        self.alive_since: Optional[float] = None
+        self.next_due: Optional[float] = None
+        # Upper bounds on the token lifetime: time from last success to an observed 40001
+        self.deaths = deque(maxlen=5)
+
+
+class CookieLifetimeTracker:
+    def __init__(self, default_lifetime: float = DEFAULT_LIFETIME_SECONDS, lead: float = LEAD_SECONDS,
+                 min_refresh: float = MIN_REFRESH_SECONDS):
+        self.default_lifetime = default_lifetime
+        self.lead = lead
+        self.min_refresh = min_refresh
+        self._lock = threading.Lock()
+        self._records: Dict[int, _Record] = {}
+
+    def _record(self, user_id: int) -> _Record:
+        rec = self._records.get(user_id)
+        if rec is None:
+            rec = self._records[user_id] = _Record()
+        return rec
+
+    def _lifetime(self, rec: _Record) -> float:
+        if rec.deaths:
+            return max(MIN_LIFETIME_SECONDS, min(min(rec.deaths), self.default_lifetime))
+        return self.default_lifetime
+
+    def _refresh_interval(self, rec: _Record) -> float:
+        return max(self.min_refresh, self._lifetime(rec) - self.lead)
+
+    def record_success(self, user_id: int, now: Optional[float] = None):
+        now = time.time() if now is None else now
+        with self._lock:
+            rec = self._record(user_id)
+            if rec.alive_since is None:
+                rec.alive_since = now
+            survived = now - rec.alive_since
+            if rec.deaths and min(rec.deaths) < survived:
+                # The token outlived these samples, so they were not its real lifetime
+                rec.deaths = deque((d for d in rec.deaths if d >= survived), maxlen=rec.deaths.maxlen)
+            rec.last_success = now
+            rec.next_due = now + self._refresh_interval(rec)
+
+    def record_death(self, user_id: int, now: Optional[float] = None):
+        now = time.time() if now is None else now
+        with self._lock:
+            rec = self._record(user_id)
+            if rec.last_success is not None:
+                rec.deaths.append(now - rec.last_success)
+            rec.last_success = None
+            rec.alive_since = None
+            rec.next_due = None
+
+    def forget(self, user_id: int):
+        """Drop everything learned about a user, e.g. after the cookie was deactivated or re-bound."""
+        with self._lock:
+            self._records.pop(user_id, None)
+
+    def needs_refresh(self, user_id: int, now: Optional[float] = None) -> bool:
+        """False while the token is known to be fresh (recent keep-alive or organic activity)."""
+        now = time.time() if now is None else now
+        with self._lock:
+            rec = self._records.get(user_id)
+            if rec is None or rec.last_success is None:
+                return True
+            return now >= rec.last_success + self._refresh_interval(rec)
+
+    def due(self, now: Optional[float] = None) -> List[int]:
+        """Users whose predicted refresh time has passed. Each is handed out at most once per RETRY_SECONDS."""
+        now = time.time() if now is None else now
+        result = []
+        with self._lock:
+            for user_id, rec in self._records.items():
+                if rec.next_due is not None and rec.next_due <= now:
+                    rec.next_due = now + RETRY_SECONDS
+                    result.append(user_id)
+        return result
+
+
+tracker = CookieLifetimeTracker()
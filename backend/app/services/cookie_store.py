@@ -0,0 +1,100 @@
+"""
+Cookie 写回队列（write-behind）
+
+LibService 只在 Authorization / SERVERID 变化时提交新 Cookie，这里再按用户合并，
+等待一个短暂的防抖窗口后由后台线程批量写入数据库，避免每次 GraphQL 调用都触发一次 UPDATE。
+"""
+import logging
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+from app import crud, database
+
+logger = logging.getLogger(__name__)
+
+DEBOUNCE_SECONDS = float(os.getenv("COOKIE_FLUSH_DEBOUNCE", "2"))
+MAX_DELAY_SECONDS = float(os.getenv("COOKIE_FLUSH_MAX_DELAY", "10"))
+
+
+class CookieWriteBehind:
+    def __init__(self, debounce: float = DEBOUNCE_SECONDS, max_delay: float = MAX_DELAY_SECONDS):
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self._cond = threading.Condition()
+        self._pending: Dict[int, str] = {}
+        self._first_at: Optional[float] = None
+        self._last_at: Optional[float] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = False
+
+    def submit(self, user_id: int, cookie: str):
+        with self._cond:
+            self._pending[user_id] = cookie
+            now = time.monotonic()
+            if self._first_at is None:
+                self._first_at = now
+            self._last_at = now
+            if self._thread is None or not self._thread.is_alive():
+                self._stopped = False
+                self._thread = threading.Thread(target=self._run, name="cookie-write-behind", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def discard(self, user_id: int):
+        """Drop a queued write, e.g. when the cookie was replaced or deactivated by the user/scheduler."""
+        with self._cond:
+            self._pending.pop(user_id, None)
+
+    def flush(self):
+        with self._cond:
+            batch = self._take_batch()
+        self._write(batch)
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        self.flush()
+
+    def _take_batch(self) -> Dict[int, str]:
+        batch = self._pending
+        self._pending = {}
+        self._first_at = None
+        self._last_at = None
+        return batch
+
+    def _due_in(self, now: float) -> Optional[float]:
+        if not self._pending:
+            return None
+        return max(0.0, min(self._last_at + self.debounce, self._first_at + self.max_delay) - now)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stopped:
+                    wait = self._due_in(time.monotonic())
+                    if wait == 0:
+                        break
+                    self._cond.wait(timeout=wait)
+                if self._stopped:
+                    return
+                batch = self._take_batch()
+            self._write(batch)
+
+    @staticmethod
+    def _write(batch: Dict[int, str]):
+        if not batch:
+            return
+        db = database.SessionLocal()
+        try:
+            crud.save_wechat_cookies(db, batch)
+            logger.debug(f"Flushed {len(batch)} cookie update(s)")
+        except Exception as e:
+            logger.error(f"Failed to flush {len(batch)} cookie update(s): {e}")
+        finally:
+            db.close()
+
+
+store = CookieWriteBehind()
@@ -0,0 +1,50 @@
+"""
+GraphQL 请求体预序列化与快速 JSON 编解码
+
+每个操作的 operationName + query 部分只编码一次并缓存为 bytes 前缀，发请求时只序列化
+variables 再拼接；响应同样用 orjson 解析。orjson 为可选依赖，未安装时退回标准库 json。
+"""
+import json
+import threading
+from typing import Any, Dict, Tuple
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    orjson = None
+    ORJSON_AVAILABLE = False
+
+_TEMPLATE_KEYS = frozenset(('operationName', 'query', 'variables'))
+
+_lock = threading.Lock()
+_prefixes: Dict[Tuple[Any, str], bytes] = {}
+
+
+def dumps(obj: Any, sort_keys: bool = False) -> bytes:
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS if sort_keys else 0)
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'), sort_keys=sort_keys).encode('utf-8')
+
+
+def loads(data) -> Any:
+    if ORJSON_AVAILABLE:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _prefix(operation_name, query: str) -> bytes:
+    key = (operation_name, query)
+    prefix = _prefixes.get(key)
+    if prefix is None:
+        prefix = b'{"operationName":' + dumps(operation_name) + b',"query":' + dumps(query) + b',"variables":'
+        with _lock:
+            _prefixes[key] = prefix
+    return prefix
+
+
+def encode_payload(payload: Dict[str, Any]) -> bytes:
+    """Request body for a GraphQL payload dict; the static part comes from the template cache."""
+    if not _TEMPLATE_KEYS.issuperset(payload) or 'query' not in payload:
+        return dumps(payload)
+    return _prefix(payload.get('operationName'), payload['query']) + dumps(payload.get('variables') or {}) + b'}'
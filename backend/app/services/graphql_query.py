@@ -0,0 +1,59 @@
+"""
+按用途裁剪字段的 GraphQL 查询构建器
+
+用嵌套的 dict / tuple 描述选择集，只请求某个场景真正用到的字段（常用座位、预约状态、
+存活探测……），避免为了读一个字段而发送整份 index 大查询。查询字符串在模块加载时
+构建一次并缓存，调用方只取字符串。
+"""
+from typing import Any, Dict, Union
+
+Selection = Union[str, tuple, Dict[str, Any]]
+
+
+def render(selection: Selection) -> str:
+    """{'a': ('b', {'c': ('d',)})} -> 'a { b c { d } }'. Keys may carry arguments or aliases verbatim."""
+    if isinstance(selection, str):
+        return selection
+    if isinstance(selection, dict):
+        return ' '.join(
+            f"{name} {{ {render(children)} }}" if children else name
+            for name, children in selection.items()
+        )
+    return ' '.join(render(item) for item in selection)
+
+
+def define(operation_name: str, selection: Selection, kind: str = 'query', params: str = '') -> str:
+    return f"{kind} {operation_name}{params} {{ {render(selection)} }}"
+
+
+# Everything the dashboard shows about the current reservation (mistakeNum was listed twice upstream)
+RESERVE_INFO_FIELDS = (
+    'token', 'status', 'user_id', 'user_nick', 'sch_name', 'lib_id', 'lib_name', 'lib_floor', 'seat_key',
+    'seat_name', 'date', 'exp_date', 'exp_date_str', 'validate_date', 'hold_date', 'diff', 'diff_str',
+    'mark_source', 'isRecordUser', 'isChooseSeat', 'isRecord', 'mistakeNum', 'openTime', 'threshold', 'daynum',
+    'closeTime', 'timerange', 'forbidQrValid', 'renewTimeNext', 'forbidRenewTime', 'forbidWechatCancle',
+)
+RESERVE_FIELDS = ('status', 'lib_id', 'lib_name', 'lib_floor', 'seat_key', 'seat_name', 'date')
+OFTEN_SEAT_FIELDS = ('id', 'info', 'lib_id', 'seat_key', 'status')
+
+# Often-seats only (get_seat_info used to send the whole index query for this)
+OFTEN_SEATS = define('index', {'userAuth': {'oftenseat': {'list': OFTEN_SEAT_FIELDS}}})
+# Enough of the reservation for _parse_reserve_info and notifications
+RESERVE_STATUS = define('index', {'userAuth': {'reserve': {'reserve': RESERVE_FIELDS}}})
+# Bare status, for hold / withdraw decisions
+RESERVE_STATUS_ONLY = define('index', {'userAuth': {'reserve': {'reserve': ('status',)}}})
+# Cheapest authenticated read: proves the cookie is alive and tells us the school
+LIVENESS = define('index', {'userAuth': {'currentUser': ('user_id', 'user_sch_id')}})
+# Full reservation (get_reserve_info)
+RESERVE_INFO = define('index', {'userAuth': {'reserve': {'reserve': RESERVE_INFO_FIELDS, 'getSToken': None}}})
+# Dashboard seat state in one round trip: reservation + often-seats (+ one room's live status)
+LIB_STATUS_FIELDS = {'lib_id': None, 'is_open': None,
+                     'lib_layout': {'seats_booking': None, 'seats_used': None, 'seats': ('key', 'seat_status', 'status')}}
+SEAT_STATE = define('index', {'userAuth': {
+    'reserve': {'reserve': RESERVE_INFO_FIELDS},
+    'oftenseat': {'list': OFTEN_SEAT_FIELDS},
+}})
+SEAT_STATE_WITH_LIB = define('index', {'userAuth': {
+    'reserve': {'reserve': RESERVE_INFO_FIELDS, 'libs(libId: $libId)': LIB_STATUS_FIELDS},
+    'oftenseat': {'list': OFTEN_SEAT_FIELDS},
+}}, params='($libId: Int)')
@@ -0,0 +1,119 @@
+"""
+进程级上游 HTTP 连接池
+
+所有发往 Traceint 的异步请求共享同一个 httpx.AsyncClient（keep-alive 连接池，可选 HTTP/2）。
+该 Client 绑定在一个专用的后台事件循环线程上，FastAPI 路由（uvicorn 事件循环）和
+调度器线程都可以通过 `request()` 复用同一批已握手的连接。
+"""
+import asyncio
+import http.cookiejar
+import logging
+import os
+import threading
+from typing import Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+MAX_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "100"))
+MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_KEEPALIVE", "20"))
+KEEPALIVE_EXPIRY = float(os.getenv("UPSTREAM_KEEPALIVE_EXPIRY", "60"))
+REQUEST_TIMEOUT = float(os.getenv("UPSTREAM_TIMEOUT", "10"))
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+HTTP2_ENABLED = os.getenv("UPSTREAM_HTTP2", "0") == "1" and HTTP2_AVAILABLE
+
+_lock = threading.Lock()
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_thread: Optional[threading.Thread] = None
+_client: Optional[httpx.AsyncClient] = None
+
+
+class _RejectAllCookies(http.cookiejar.DefaultCookiePolicy):
+    """The pool is shared by every user, so it must never remember anyone's cookies."""
+
+    def set_ok(self, cookie, request):
+        return False
+
+    def return_ok(self, cookie, request):
+        return False
+
+
+def _ensure_loop() -> asyncio.AbstractEventLoop:
+    global _loop, _thread
+    with _lock:
+        if _loop is None or _loop.is_closed():
+            _loop = asyncio.new_event_loop()
+            _thread = threading.Thread(target=_loop.run_forever, name="upstream-io", daemon=True)
+            _thread.start()
+            logger.info(f"Upstream HTTP pool started (http2={HTTP2_ENABLED}, max_connections={MAX_CONNECTIONS})")
+        return _loop
+
+
+def _get_client() -> httpx.AsyncClient:
+    # Only ever called on the pool loop, so no locking is needed here.
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            http2=HTTP2_ENABLED,
+            timeout=REQUEST_TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=MAX_CONNECTIONS,
+                max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=KEEPALIVE_EXPIRY,
+            ),
+        )
+        _client.cookies.jar.set_policy(_RejectAllCookies())
+    return _client
+
+
+async def _send(method: str, url: str, **kwargs) -> httpx.Response:
+    return await _get_client().request(method, url, **kwargs)
+
+
+async def request(method: str, url: str, **kwargs) -> httpx.Response:
+    """
+    Send a request through the shared pool from any event loop.
+    The response body is fully read before it is handed back.
+    """
+    loop = _ensure_loop()
+    try:
+        current = asyncio.get_running_loop()
+    except RuntimeError:
+        current = None
+    if current is loop:
+        return await _send(method, url, **kwargs)
+    future = asyncio.run_coroutine_threadsafe(_send(method, url, **kwargs), loop)
+    return await asyncio.wrap_future(future)
+
+
+def run_sync(coro):
+    """
+    Drive a coroutine to completion from synchronous code (scheduler threads,
+    sync route handlers). The HTTP I/O itself still happens on the pool loop.
+    """
+    return asyncio.run(coro)
+
+
+def close():
+    global _client, _loop, _thread
+    with _lock:
+        loop = _loop
+        if loop is None or loop.is_closed():
+            return
+        client = _client
+        try:
+            if client is not None and not client.is_closed:
+                asyncio.run_coroutine_threadsafe(client.aclose(), loop).result(timeout=5)
+        except Exception as e:
+            logger.warning(f"Failed to close upstream HTTP pool: {e}")
+        loop.call_soon_threadsafe(loop.stop)
+        _client = None
+        _loop = None
+        _thread = None
@@ -0,0 +1,52 @@
+"""
+保活时间槽表
+
+把每个用户按稳定哈希排序后均匀分布在保活周期内（slot = 排名 × 周期 / 用户数），
+调度器每个 tick 只刷新时间槽落在上一 tick 与当前时刻之间的用户，
+把原先每 55 分钟一次的集中爆发摊平成连续、平稳的请求流。
+"""
+import hashlib
+import threading
+from typing import Dict, Iterable, List, Optional
+
+
+class KeepAliveSlots:
+    def __init__(self, interval_seconds: float):
+        self.interval = float(interval_seconds)
+        self._lock = threading.Lock()
+        self._ids: List[int] = []
+        self._offsets: Dict[int, float] = {}
+        self._last_pos: Optional[float] = None
+
+    @staticmethod
+    def _hash(user_id: int) -> int:
+        return int(hashlib.sha1(str(user_id).encode()).hexdigest()[:8], 16)
+
+    def rebalance(self, user_ids: Iterable[int]) -> bool:
+        """Recompute slots when the user set changed; returns True if the table was rebuilt."""
+        ids = sorted(set(user_ids), key=lambda uid: (self._hash(uid), uid))
+        with self._lock:
+            if ids == self._ids:
+                return False
+            step = self.interval / len(ids) if ids else 0.0
+            self._ids = ids
+            self._offsets = {uid: i * step for i, uid in enumerate(ids)}
+            return True
+
+    def slot_of(self, user_id: int) -> Optional[float]:
+        return self._offsets.get(user_id)
+
+    def due(self, now: float) -> List[int]:
+        """Users whose slot was crossed since the previous call (the first call only sets the cursor)."""
+        pos = now % self.interval
+        with self._lock:
+            start, self._last_pos = self._last_pos, pos
+            if start is None or start == pos:
+                return []
+            if start < pos:
+                return [uid for uid in self._ids if start <= self._offsets[uid] < pos]
+            # Window wrapped around the end of the cycle
+            return [uid for uid in self._ids if self._offsets[uid] >= start or self._offsets[uid] < pos]
+
+    def __len__(self):
+        return len(self._ids)
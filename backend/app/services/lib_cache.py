@@ -0,0 +1,155 @@
+"""
+全校共享的阅览室列表 / 座位布局缓存
+
+同一学校所有用户看到的阅览室列表和座位几何（x/y/name/type）完全相同，按 (学校, lib_id)
+缓存在进程内：几何信息长期有效，座位占用状态只在很短的 TTL 内复用，过期后只拉取
+状态字段并覆盖到缓存的几何信息上。几何缓存本身不保留任何状态字段，状态刷新失败时
+返回的布局不含 is_open / 座位状态并带上 status_stale=True，而不是沿用过期的状态。
+并发未命中通过 single-flight 合并为一次上游请求。
+"""
+import copy
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from app.services.lib_service import AsyncLibService
+from app.services.single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+LIB_LIST_TTL = float(os.getenv("LIB_LIST_TTL_SECONDS", "60"))
+GEOMETRY_TTL = float(os.getenv("LIB_GEOMETRY_TTL_SECONDS", "86400"))
+STATUS_TTL = float(os.getenv("LIB_STATUS_TTL_SECONDS", "5"))
+
+# Per-seat and per-room fields that change while the room is in use
+SEAT_STATUS_FIELDS = ('seat_status', 'status')
+LAYOUT_STATUS_FIELDS = ('seats_booking', 'seats_used')
+
+
+class LibCache:
+    def __init__(self, list_ttl: float = LIB_LIST_TTL, geometry_ttl: float = GEOMETRY_TTL,
+                 status_ttl: float = STATUS_TTL):
+        self.list_ttl = list_ttl
+        self.geometry_ttl = geometry_ttl
+        self.status_ttl = status_ttl
+        self._lock = threading.Lock()
+        # school -> (fetched_at, lib list)
+        self._lists: Dict[Any, tuple] = {}
+        # (school, lib_id) -> (fetched_at, layout as last fetched, status fields stripped)
+        self._geometry: Dict[tuple, tuple] = {}
+        # (school, lib_id) -> (fetched_at, status-only layout)
+        self._status: Dict[tuple, tuple] = {}
+        self._flight = SingleFlight()
+
+    def _fresh(self, table: Dict, key, ttl: float):
+        with self._lock:
+            entry = table.get(key)
+        if entry and time.monotonic() - entry[0] < ttl:
+            return entry[1]
+        return None
+
+    def _store(self, table: Dict, key, value):
+        with self._lock:
+            table[key] = (time.monotonic(), value)
+
+    # --- Lib list ---
+    async def get_lib_list(self, service: AsyncLibService) -> List[Dict[str, Any]]:
+        school = await service.get_school_id()
+        if school is None:
+            return await service.get_lib_list()
+
+        cached = self._fresh(self._lists, school, self.list_ttl)
+        if cached is not None:
+            return copy.deepcopy(cached)
+
+        async def fetch():
+            libs = await service.get_lib_list()
+            # get_lib_list reports failures as an empty list; never cache those
+            if libs:
+                self._store(self._lists, school, libs)
+            return libs
+
+        return copy.deepcopy(await self._flight.do(('list', school), fetch))
+
+    # --- Layout ---
+    async def get_lib_layout(self, service: AsyncLibService, lib_id: int) -> Optional[Dict[str, Any]]:
+        school = await service.get_school_id()
+        if school is None:
+            return await service.get_lib_layout(lib_id)
+
+        key = (school, lib_id)
+        geometry = self._fresh(self._geometry, key, self.geometry_ttl)
+        if geometry is None:
+            layout = await self._flight.do(('layout', key), lambda: self._fetch_layout(service, key))
+            # Just fetched, so its own status is current
+            return copy.deepcopy(layout) if layout else None
+        status = self._fresh(self._status, key, self.status_ttl)
+        if status is None:
+            status = await self._flight.do(('status', key), lambda: self._fetch_status(service, key))
+        return self._merge(geometry, status)
+
+    async def _fetch_layout(self, service: AsyncLibService, key: tuple):
+        layout = await service.get_lib_layout(key[1])
+        if layout:
+            # A full layout carries its own fresh status as well; geometry keeps none of it
+            self._store(self._geometry, key, self._strip_status(layout))
+            self._store(self._status, key, layout)
+        return layout
+
+    async def _fetch_status(self, service: AsyncLibService, key: tuple):
+        status = await service.get_lib_status(key[1])
+        if status:
+            self._store(self._status, key, status)
+        return status
+
+    @staticmethod
+    def _strip_status(layout: Dict[str, Any]) -> Dict[str, Any]:
+        geometry = copy.deepcopy(layout)
+        geometry.pop('is_open', None)
+        inner = geometry.get('lib_layout') or {}
+        for field in LAYOUT_STATUS_FIELDS:
+            inner.pop(field, None)
+        for seat in inner.get('seats') or []:
+            for field in SEAT_STATUS_FIELDS:
+                seat.pop(field, None)
+        return geometry
+
+    @staticmethod
+    def _merge(geometry: Dict[str, Any], status: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        merged = copy.deepcopy(geometry)
+        if not status:
+            # Status refresh failed and the cached one expired: seats read as unavailable, not stale-free
+            merged['status_stale'] = True
+            return merged
+        if 'is_open' in status:
+            merged['is_open'] = status['is_open']
+        live_layout = status.get('lib_layout') or {}
+        layout = merged.get('lib_layout') or {}
+        for field in LAYOUT_STATUS_FIELDS:
+            if field in live_layout:
+                layout[field] = live_layout[field]
+        live = {str(seat.get('key')): seat for seat in live_layout.get('seats') or []}
+        for seat in layout.get('seats') or []:
+            state = live.get(str(seat.get('key')))
+            if state:
+                for field in SEAT_STATUS_FIELDS:
+                    if field in state:
+                        seat[field] = state[field]
+        return merged
+
+    def invalidate(self, school=None):
+        with self._lock:
+            if school is None:
+                self._lists.clear()
+                self._geometry.clear()
+                self._status.clear()
+                return
+            self._lists.pop(school, None)
+            for table in (self._geometry, self._status):
+                for key in [k for k in table if k[0] == school]:
+                    table.pop(key, None)
+
+
+cache = LibCache()
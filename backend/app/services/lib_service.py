@@ -1,30 +1,74 @@
+import os
 import requests
 import random
 import time
 from datetime import datetime
-import json
 import asyncio
+import functools
+import inspect
 import websockets
+from collections import deque
 from typing import Optional, Dict, Any
 
+from app.services import http_client, cookie_lifetime, clock_sync, reserve_state_cache, graphql_query, gql_codec
+from app.services.single_flight import SingleFlight
+from app.services import upstream_metrics
+
 import logging
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Seat confirmation after reserueSeat: poll the reserve status with exponential backoff until the deadline
+RESERVE_CONFIRM_FIRST_DELAY = float(os.getenv("RESERVE_CONFIRM_FIRST_DELAY_MS", "50")) / 1000
+RESERVE_CONFIRM_DEADLINE = float(os.getenv("RESERVE_CONFIRM_DEADLINE_MS", "2000")) / 1000
+
+# Shared by every LibService/AsyncLibService instance; see LibService._flight_key
+_post_flight = SingleFlight()
+
+
+def _invalidates_reserve_state(method):
+    """Drop the user's cached reserve state once a state-changing call returns or fails."""
+    if inspect.iscoroutinefunction(method):
+        @functools.wraps(method)
+        async def async_wrapper(self, *args, **kwargs):
+            try:
+                return await method(self, *args, **kwargs)
+            finally:
+                self._invalidate_reserve_state()
+        return async_wrapper
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self._invalidate_reserve_state()
+    return wrapper
+
+
 class LibService:
     SERVERID = ['82967fec9605fac9a28c437e2a3ef1a4', 'b9fc7bd86d2eed91b23d7347e0ee995e',
                 'e3fa93b0fb9e2e6d4f53273540d4e924', 'd3936289adfff6c3874a2579058ac651']
     
     BASE_URL = "https://wechat.v2.traceint.com/index.php/graphql/"
+    # Only changes to these cookies are worth persisting; the rest are regenerated on load
+    PERSISTED_COOKIES = frozenset(['Authorization', 'SERVERID'])
     WS_URL = "wss://wechat.v2.traceint.com/ws?ns=prereserve/queue"
 
     def __init__(self, cookie: str, on_cookie_update=None):
         self.cookie = cookie
         self.on_cookie_update = on_cookie_update
-        self.session = requests.Session()
+        # Set by the session registry; enables per-user bookkeeping such as cookie lifetime tracking
+        self.user_id: Optional[int] = None
+        # Cookie strings this instance started from or handed to on_cookie_update (see adopt_cookie)
+        self._known_cookies = deque([cookie], maxlen=8)
+        self._jar: Dict[str, str] = {}
+        self.session = self._create_session()
         self._lib_layout_seen = set()
+        # Learned from any currentUser response; keys the school-wide lib cache
+        self.school_id: Optional[int] = None
         self.headers = {
             'Host': 'wechat.v2.traceint.com',
             'Connection': 'keep-alive',
@@ -45,6 +89,14 @@ class LibService:
         }
         self._init_cookie()
 
+    def _create_session(self):
+        return requests.Session()
+
+    def _sync_cookie_header(self):
+        self.headers['Cookie'] = self.cookie
+        if self.session is not None:
+            self.session.headers['Cookie'] = self.cookie
+
     def _init_cookie(self):
         # Clean existing cookie: remove generated fields to avoid duplication
         clean_cookie = []
@@ -72,8 +124,19 @@ class LibService:
             + str(now)
             + '|' + str(now - 86400) # Previous timestamp
         )
+        self._jar = self._parse_cookie(self.cookie)
         self.headers['Cookie'] = self.cookie
-        self.session.headers.update(self.headers)
+        if self.session is not None:
+            self.session.headers.update(self.headers)
+
+    @staticmethod
+    def _parse_cookie(cookie: Optional[str]) -> Dict[str, str]:
+        jar = {}
+        for chunk in (cookie or '').split(';'):
+            if '=' in chunk:
+                k, v = chunk.strip().split('=', 1)
+                jar[k] = v
+        return jar
 
     def _extract_serverid(self, set_cookie_header: Optional[str]) -> Optional[str]:
         if not set_cookie_header:
@@ -89,19 +152,14 @@ class LibService:
     def _reset_serverid(self, serverid: str):
         if not serverid:
             return
-        parts = self.cookie.split(';')
-        found = False
-        for i, p in enumerate(parts):
-            t = p.strip()
-            if t.startswith('SERVERID='):
-                parts[i] = ' SERVERID=' + serverid
-                found = True
-                break
-        if not found:
-            parts.append(' SERVERID=' + serverid)
-        self.cookie = ';'.join(parts)
-        self.headers['Cookie'] = self.cookie
-        self.session.headers['Cookie'] = self.cookie
+        self._update_cookies({'SERVERID': serverid})
+
+    @staticmethod
+    def _persisted_value(name: str, value: Optional[str]) -> Optional[str]:
+        # SERVERID is "server|ts|ts" and its timestamps roll on nearly every response; only the server part matters
+        if name == 'SERVERID' and value:
+            return value.split('|', 1)[0]
+        return value
 
     def _update_cookies(self, new_cookies: Dict[str, str]):
         """
@@ -109,74 +167,119 @@ class LibService:
         """
         if not new_cookies:
             return
-        
-        # Parse current cookies
-        cookie_dict = {}
-        if self.cookie:
-            for chunk in self.cookie.split(';'):
-                if '=' in chunk:
-                    k, v = chunk.strip().split('=', 1)
-                    cookie_dict[k] = v
-        
-        # Update with new cookies
-        cookie_dict.update(new_cookies)
-        
+
+        # Most responses echo the cookies we already hold; skip them without touching the header
+        changed = {k: v for k, v in new_cookies.items() if self._jar.get(k) != v}
+        if not changed:
+            return
+        persist = any(
+            self._persisted_value(k, v) != self._persisted_value(k, self._jar.get(k))
+            for k, v in changed.items() if k in self.PERSISTED_COOKIES
+        )
+        self._jar.update(changed)
+
         # Reconstruct cookie string
         # Use '; ' as separator which is standard
-        self.cookie = '; '.join([f"{k}={v}" for k, v in cookie_dict.items()])
-        
+        self.cookie = '; '.join([f"{k}={v}" for k, v in self._jar.items()])
+
         # Update headers
-        self.headers['Cookie'] = self.cookie
-        self.session.headers['Cookie'] = self.cookie
-        
-        # Notify callback
-        if self.on_cookie_update:
+        self._sync_cookie_header()
+
+        # Notify callback (only when the auth token or sticky server actually moved)
+        if self.on_cookie_update and persist:
             try:
                 self.on_cookie_update(self.cookie)
+                self._known_cookies.append(self.cookie)
             except Exception as e:
                 logger.error(f"Failed to save updated cookie: {e}")
 
+    def adopt_cookie(self, cookie: str):
+        """
+        Re-sync a long-lived instance with the stored cookie when it was changed elsewhere
+        (user re-bound WeChat, or another instance refreshed the token).
+        """
+        # Ignore versions we produced ourselves: the DB may still lag behind the write-behind queue
+        if not cookie or cookie in self._known_cookies:
+            return
+        self.cookie = cookie
+        self._known_cookies.append(cookie)
+        self._lib_layout_seen.clear()
+        self._init_cookie()
+
+    def _check_errors(self, data: Dict[str, Any], payload: Dict[str, Any], silent: bool = False):
+        if 'errors' in data:
+            if not silent:
+                logger.error(f"GraphQL Error for {payload.get('operationName')}: {data['errors']}")
+            errs = data.get('errors') or []
+            for e in errs:
+                msg = e.get('msg') or e.get('message') or ''
+                code = e.get('code')
+                if code == 40001 or ('access denied' in str(msg).lower()):
+                    if self.user_id is not None:
+                        cookie_lifetime.tracker.record_death(self.user_id)
+                    raise Exception('Cookie失效或账号被临时限制(40001)')
+                if code == 40005 or '绑定学号' in str(msg):
+                    raise Exception('需要绑定学号(40005)')
+
+    def _record_activity(self, data: Dict[str, Any]):
+        # Any clean GraphQL round trip keeps the token alive just like a keep-alive call would
+        if self.user_id is not None and 'errors' not in data:
+            cookie_lifetime.tracker.record_success(self.user_id)
+
+    def _flight_key(self, payload: Dict[str, Any]):
+        """
+        Identical read-only queries of the same user in flight at the same time share one upstream call.
+        Mutations are never merged. The query text is part of the key because several different
+        queries share the operationName 'index'.
+        """
+        query = payload.get('query') or ''
+        if not query.lstrip().startswith('query'):
+            return None
+        owner = self.user_id if self.user_id is not None else id(self)
+        variables = gql_codec.dumps(payload.get('variables') or {}, sort_keys=True)
+        return (type(self), owner, payload.get('operationName'), variables, query)
+
     def _post(self, payload: Dict[str, Any], silent: bool = False) -> Dict[str, Any]:
-        try:
-            r = self.session.post(self.BASE_URL, json=payload, timeout=10)
-            r.raise_for_status()
-            
-            # Update cookies automatically from response (handles SERVERID and auth tokens)
-            if r.cookies:
-                self._update_cookies(r.cookies.get_dict())
-            
-            # Legacy SERVERID handling (backup, though _update_cookies should cover it)
-            # sc = r.headers.get('Set-Cookie')
-            # sid = self._extract_serverid(sc)
-            # if sid:
-            #     self._reset_serverid(sid)
-
-            data = r.json()
-            if 'errors' in data:
+        key = self._flight_key(payload)
+        if key is None:
+            return self._send_post(payload, silent)
+        return _post_flight.do_sync(key, lambda: self._send_post(payload, silent))
+
+    def _send_post(self, payload: Dict[str, Any], silent: bool = False) -> Dict[str, Any]:
+        body = gql_codec.encode_payload(payload)
+        r = None
+        with upstream_metrics.track(payload.get('operationName'), sent=len(body)) as call:
+            try:
+                t0 = time.time()
+                r = call.response = self.session.post(self.BASE_URL, data=body, timeout=10)
+                clock_sync.clock.observe_date_header(t0, r.headers.get('Date'), time.time())
+                r.raise_for_status()
+                
+                # Update cookies automatically from response (handles SERVERID and auth tokens)
+                if r.cookies:
+                    self._update_cookies(r.cookies.get_dict())
+                
+                # Legacy SERVERID handling (backup, though _update_cookies should cover it)
+                # sc = r.headers.get('Set-Cookie')
+                # sid = self._extract_serverid(sc)
+                # if sid:
+                #     self._reset_serverid(sid)
+
+                data = gql_codec.loads(r.content)
+                self._check_errors(data, payload, silent)
+                self._record_activity(data)
+                return data
+            except Exception as e:
                 if not silent:
-                    logger.error(f"GraphQL Error for {payload.get('operationName')}: {data['errors']}")
-                try:
-                    errs = data.get('errors') or []
-                    for e in errs:
-                        msg = e.get('msg') or e.get('message') or ''
-                        code = e.get('code')
-                        if code == 40001 or ('access denied' in str(msg).lower()):
-                            raise Exception('Cookie失效或账号被临时限制(40001)')
-                        if code == 40005 or '绑定学号' in str(msg):
-                            raise Exception('需要绑定学号(40005)')
-                except Exception as ex:
-                    raise ex
-            return data
-        except Exception as e:
-            if not silent:
-                logger.error(f"Request failed: {e}")
-            if 'r' in locals() and r is not None and not silent:
-                logger.error(f"Response content: {r.text}")
-            raise
+                    logger.error(f"Request failed: {e}")
+                if r is not None and not silent:
+                    logger.error(f"Response content: {r.text}")
+                raise
 
     # --- Crawl / Info ---
-    def get_user_info(self):
-        payload = {
+    @staticmethod
+    def _user_info_payload():
+        return {
             "operationName": "index",
             "query": "query index($pos: String!, $param: [hash]) {\n "
                      "userAuth {\n oftenseat {\n list {\n id\n info\n lib_id\n seat_key\n status\n }\n }\n "
@@ -194,8 +297,8 @@ class LibService:
                      "ad(pos: $pos, param: $param) {\n name\n pic\n url\n }\n}",
             "variables": {"pos": "App-首页"}
         }
-        data = self._post(payload)
-        
+
+    def _parse_user_info(self, data: Dict[str, Any]):
         # DEBUG: Log raw userAuth data for troubleshooting ban status
         user_auth_raw = (data.get('data') or {}).get('userAuth')
         if user_auth_raw:
@@ -212,10 +315,10 @@ class LibService:
         if 'errors' in data:
             error_item = data['errors'][0]
             raise Exception(error_item.get('msg') or error_item.get('message') or 'Unknown API Error')
-        
+
         # Safe access to data.get('data') which might be None
         user_auth = (data.get('data') or {}).get('userAuth')
-        
+
         # Fallback: if userAuth is missing but we have errors, it might be a partial success or specific error state
         if not user_auth and 'errors' in data:
              logger.warning(f"User info fetch partial/failed: {data['errors']}")
@@ -226,15 +329,51 @@ class LibService:
 
         if not user_auth:
             raise Exception('Failed to get user info')
-            
+
+        self._remember_school(user_auth)
         return user_auth
 
-    def get_seat_info(self):
-        user_auth = self.get_user_info()
+    def _remember_school(self, user_auth: Dict[str, Any]):
+        sch_id = ((user_auth or {}).get('currentUser') or {}).get('user_sch_id')
+        if sch_id is not None:
+            self.school_id = sch_id
+
+    @staticmethod
+    def _user_auth(data: Dict[str, Any]) -> Dict[str, Any]:
+        """userAuth of a projected query; raises like get_user_info when the call was rejected."""
+        if 'errors' in data:
+            error_item = data['errors'][0]
+            raise Exception(error_item.get('msg') or error_item.get('message') or 'Unknown API Error')
+        user_auth = (data.get('data') or {}).get('userAuth')
+        if not user_auth:
+            raise Exception('Failed to get user info')
+        return user_auth
+
+    @staticmethod
+    def _liveness_payload():
+        return {"operationName": "index", "query": graphql_query.LIVENESS, "variables": {}}
+
+    def check_alive(self) -> bool:
+        """Cheapest authenticated read; raises if the cookie is no longer accepted."""
+        user_auth = self._user_auth(self._post(self._liveness_payload()))
+        self._remember_school(user_auth)
+        return True
+
+    def get_school_id(self):
+        if self.school_id is None:
+            self.check_alive()
+        return self.school_id
+
+    def get_user_info(self):
+        data = self._post(self._user_info_payload())
+        return self._parse_user_info(data)
+
+    @staticmethod
+    def _parse_seat_info(user_auth: Dict[str, Any]):
         oftenseat = user_auth.get('oftenseat', {}).get('list', [])
         if not oftenseat:
             return []
-        
+
         enriched = []
         for item in oftenseat:
             try:
@@ -245,19 +384,27 @@ class LibService:
                 pass
         return enriched
 
+    @staticmethod
+    def _often_seats_payload():
+        return {"operationName": "index", "query": graphql_query.OFTEN_SEATS, "variables": {}}
+
+    def get_seat_info(self):
+        user_auth = self._user_auth(self._post(self._often_seats_payload()))
+        return self._parse_seat_info(user_auth)
+
     # --- Reserve ---
-    def reserve_seat(self, lib_id: int, seat_key: str):
-        if lib_id not in self._lib_layout_seen:
-            lib_payload = {
-                "operationName": "libLayout",
-                "query": "query libLayout($libId: Int, $libType: Int) {\n userAuth {\n reserve {\n libs(libType: "
-                         "$libType, libId: $libId) {\n lib_id\n }\n }\n }\n}",
-                "variables": {"libId": lib_id}
-            }
-            self._post(lib_payload)
-            self._lib_layout_seen.add(lib_id)
+    @staticmethod
+    def _lib_preflight_payload(lib_id: int):
+        return {
+            "operationName": "libLayout",
+            "query": "query libLayout($libId: Int, $libType: Int) {\n userAuth {\n reserve {\n libs(libType: "
+                     "$libType, libId: $libId) {\n lib_id\n }\n }\n }\n}",
+            "variables": {"libId": lib_id}
+        }
 
-        reserve_payload = {
+    @staticmethod
+    def _reserve_payload(lib_id: int, seat_key: str):
+        return {
             "operationName": "reserueSeat",
             "query": "mutation reserueSeat($libId: Int!, $seatKey: String!, $captchaCode: String, $captcha: "
                      "String!) {\n userAuth {\n reserve {\n reserueSeat(\n libId: $libId\n seatKey: "
@@ -269,46 +416,123 @@ class LibService:
                 "captcha": ""
             }
         }
-        res = self._post(reserve_payload)
 
-        # Do not trust reserveSeat error messages. Always trust index status.
-        time.sleep(0.5)
-        reserve_info = self.get_reserve_info()
-        if reserve_info:
-            r_lib_id = reserve_info.get('lib_id')
-            r_seat_key = reserve_info.get('seat_key')
-            # Check if reserved seat matches requested (handle string/int conversion safely)
-            if str(r_lib_id) == str(lib_id) and str(r_seat_key) == str(seat_key):
-                return True
+    @staticmethod
+    def _is_reserved_seat(reserve_info, lib_id: int, seat_key: str) -> bool:
+        if not reserve_info:
+            return False
+        r_lib_id = reserve_info.get('lib_id')
+        r_seat_key = reserve_info.get('seat_key')
+        # Check if reserved seat matches requested (handle string/int conversion safely)
+        return str(r_lib_id) == str(lib_id) and str(r_seat_key) == str(seat_key)
+
+    @classmethod
+    def _match_reserved(cls, reserve_info, seats):
+        """The seat from `seats` that reserve_info shows as ours, if any."""
+        for seat in seats:
+            if cls._is_reserved_seat(reserve_info, seat['lib_id'], seat['seat_key']):
+                return seat
+        return None
+
+    @staticmethod
+    def _reserve_accepted(res: Dict[str, Any]) -> bool:
+        """Whether the mutation itself reported success; only then is it worth waiting for the index to catch up."""
+        if not res or res.get('errors'):
+            return False
+        return bool((((res.get('data') or {}).get('userAuth') or {}).get('reserve') or {}).get('reserueSeat'))
+
+    @staticmethod
+    def _reserve_confirm_payload():
+        # Just the fields _parse_reserve_info validates plus what notifications display
+        return {"operationName": "index", "query": graphql_query.RESERVE_STATUS, "variables": {}}
 
+    @staticmethod
+    def _confirm_delays(accepted: bool):
+        """Sleep before each follow-up poll; a rejected mutation gets a single immediate check only."""
+        if not accepted:
+            return
+        deadline = time.monotonic() + RESERVE_CONFIRM_DEADLINE
+        delay = RESERVE_CONFIRM_FIRST_DELAY
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            yield min(delay, remaining)
+            delay *= 2
+
+    @staticmethod
+    def _raise_reserve_failure(res: Dict[str, Any]):
         if 'errors' in res:
             error_item = res['errors'][0]
             raise Exception(error_item.get('msg') or error_item.get('message') or 'Reserve Failed')
-        
+
         raise Exception('预约失败：系统未确认座位，请稍后重试')
 
-    def cancel_reserve(self):
-        # Step 1: Get sToken from index
-        index_payload = {
+    def prepare_reserve(self, lib_id: int, force: bool = False):
+        """libLayout preflight required before reserueSeat; done once per lib unless forced (e.g. warm-up before launch)."""
+        if force or lib_id not in self._lib_layout_seen:
+            self._post(self._lib_preflight_payload(lib_id))
+            self._lib_layout_seen.add(lib_id)
+
+    @_invalidates_reserve_state
+    def reserve_seat(self, lib_id: int, seat_key: str):
+        self.prepare_reserve(lib_id)
+
+        res = self._post(self._reserve_payload(lib_id, seat_key))
+
+        # Do not trust reserveSeat error messages. Always trust index status.
+        seat, _ = self.confirm_reserve([{'lib_id': lib_id, 'seat_key': seat_key}], self._reserve_accepted(res))
+        if seat:
+            return True
+
+        self._raise_reserve_failure(res)
+
+    def _poll_reserve_status(self):
+        try:
+            r = self._post(self._reserve_confirm_payload(), silent=True)
+            return self._parse_reserve_info(r, silent=True)
+        except Exception:
+            return None
+
+    def confirm_reserve(self, seats, accepted: bool = True):
+        """Poll the reserve status until one of `seats` shows up; returns (seat, reserve_info) or (None, reserve_info)."""
+        reserve_info = self._poll_reserve_status()
+        delays = self._confirm_delays(accepted)
+        while True:
+            seat = self._match_reserved(reserve_info, seats)
+            # Another seat showing up is just as final as ours
+            if seat or reserve_info:
+                return seat, reserve_info
+            delay = next(delays, None)
+            if delay is None:
+                return None, reserve_info
+            time.sleep(delay)
+            reserve_info = self._poll_reserve_status()
+
+    @staticmethod
+    def _stoken_payload():
+        return {
             "operationName": "index",
             "query": "query index { userAuth { reserve { getSToken } } }",
             "variables": {}
         }
-        r = self._post(index_payload)
-        token = r.get('data', {}).get('userAuth', {}).get('reserve', {}).get('getSToken')
-        
-        if not token:
-            raise Exception("无法获取取消凭证(sToken)，请重试")
 
-        # Step 2: Call reserveCancle
-        payload = {
+    @staticmethod
+    def _parse_stoken(r: Dict[str, Any]):
+        return r.get('data', {}).get('userAuth', {}).get('reserve', {}).get('getSToken')
+
+    @staticmethod
+    def _cancel_payload(token: str):
+        return {
             "operationName": "reserveCancle",
             "query": "mutation reserveCancle($sToken: String!) {\n userAuth {\n "
                      "reserve {\n reserveCancle(sToken: $sToken) {\n "
                      "timerange\n }\n }\n }\n}",
             "variables": {"sToken": token}
         }
-        res = self._post(payload)
+
+    @staticmethod
+    def _parse_cancel_result(res: Dict[str, Any]):
         if 'errors' in res:
             errs = res.get('errors') or []
             # Treat certain messages as success when not yet签到：退预选座位成功
@@ -319,16 +543,29 @@ class LibService:
                     return {"message": "退预选座位成功"}
             error_item = errs[0]
             raise Exception(error_item.get('msg') or error_item.get('message') or 'Cancel Failed')
-        
+
         return res.get('data', {}).get('userAuth', {}).get('reserve', {}).get('reserveCancle')
 
+    @_invalidates_reserve_state
+    def cancel_reserve(self):
+        # Step 1: Get sToken from index
+        r = self._post(self._stoken_payload())
+        token = self._parse_stoken(r)
+
+        if not token:
+            raise Exception("无法获取取消凭证(sToken)，请重试")
+
+        # Step 2: Call reserveCancle
+        res = self._post(self._cancel_payload(token))
+        return self._parse_cancel_result(res)
+
     def keep_alive(self, silent: bool = False):
         """
         Strictly matches igotolib-person/crawldata.py cookie_update method.
         Uses htmlRule query to refresh cookies.
         """
         rule_payload = {
-            "operationName": "htmlRule", 
+            "operationName": "htmlRule",
             "query": "query htmlRule {\n userAuth {\n rule {\n htmlRule\n }\n }\n}"
         }
         try:
@@ -340,97 +577,158 @@ class LibService:
                 logger.error(f"Keep-alive (htmlRule) failed: {e}")
             return False
 
-    def get_reserve_info(self, silent: bool = False):
-        # API 9 (getReserveInfo) is unreliable when pre-selected seat is occupied by others
-        # User instructed to rely on index API (API 8) and check if data.userAuth.reserve.reserve is null
-        try:
-            # Use complete query structure to avoid schema issues
-            index_payload = {
-                "operationName": "index",
-                "query": "query index { userAuth { reserve { reserve { token status user_id user_nick sch_name lib_id lib_name lib_floor seat_key seat_name date exp_date exp_date_str validate_date hold_date diff diff_str mark_source isRecordUser isChooseSeat isRecord mistakeNum openTime threshold daynum mistakeNum closeTime timerange forbidQrValid renewTimeNext forbidRenewTime forbidWechatCancle } getSToken } } }",
-                "variables": {}
-            }
-            r = self._post(index_payload, silent=silent)
-            reserve_data = ((r.get('data') or {}).get('userAuth') or {}).get('reserve', {}).get('reserve')
-            
-            # Comprehensive validation based on user feedback
-            if not reserve_data:
-                return None
-
-            # 1. Check status (0 or None means no valid reservation)
-            # Status: 0=None, 1=Reserved, 2=Signed In, 3=In Use, 4=Away, 5=Supervised/Finished
-            status = reserve_data.get('status')
-            if not silent:
-                logger.info(f"DEBUG: get_reserve_info raw status: {status}, data: {reserve_data}")
-            
-            # Fix: Only allow active statuses.
-            valid_statuses = [1, 2, 3, 4, 5]
-            if status not in valid_statuses:
-                return None
-
-            # 2. Check seat_key
-            if not reserve_data.get('seat_key'):
-                return None
-
-            # 3. Check date (Ignore past reservations)
-            # If the reservation date is strictly before today, it's a stale record.
-            date_str = reserve_data.get('date')
-            if not date_str or str(date_str).strip() == '':
-                return None
-            else:
-                try:
-                    # Handle timestamp or date string
-                    d_str = str(date_str)
-                    if d_str.isdigit():
-                        res_date = datetime.fromtimestamp(int(d_str)).date()
+    @staticmethod
+    def _reserve_info_payload():
+        # Use complete query structure to avoid schema issues
+        return {"operationName": "index", "query": graphql_query.RESERVE_INFO, "variables": {}}
+
+    @staticmethod
+    def _parse_reserve_info(r: Dict[str, Any], silent: bool = False):
+        reserve_data = ((r.get('data') or {}).get('userAuth') or {}).get('reserve', {}).get('reserve')
+
+        # Comprehensive validation based on user feedback
+        if not reserve_data:
+            return None
+
+        # 1. Check status (0 or None means no valid reservation)
+        # Status: 0=None, 1=Reserved, 2=Signed In, 3=In Use, 4=Away, 5=Supervised/Finished
+        status = reserve_data.get('status')
+        if not silent:
+            logger.info(f"DEBUG: get_reserve_info raw status: {status}, data: {reserve_data}")
+
+        # Fix: Only allow active statuses.
+        valid_statuses = [1, 2, 3, 4, 5]
+        if status not in valid_statuses:
+            return None
+
+        # 2. Check seat_key
+        if not reserve_data.get('seat_key'):
+            return None
+
+        # 3. Check date (Ignore past reservations)
+        # If the reservation date is strictly before today, it's a stale record.
+        date_str = reserve_data.get('date')
+        if not date_str or str(date_str).strip() == '':
+            return None
+        else:
+            try:
+                # Handle timestamp or date string
+                d_str = str(date_str)
+                if d_str.isdigit():
+                    res_date = datetime.fromtimestamp(int(d_str)).date()
+                else:
+                    res_date = datetime.strptime(d_str, "%Y-%m-%d").date()
+
+                today = datetime.now().date()
+                if res_date < today:
+                    if status == 5:
+                        if not silent:
+                            logger.info(f"Allowing past reservation for status 5 (Supervised). Date: {date_str}")
                     else:
-                        res_date = datetime.strptime(d_str, "%Y-%m-%d").date()
-                        
-                    today = datetime.now().date()
-                    if res_date < today:
-                        if status == 5:
-                            if not silent:
-                                logger.info(f"Allowing past reservation for status 5 (Supervised). Date: {date_str}")
-                        else:
-                            if not silent:
-                                logger.info(f"Ignoring past reservation for {date_str} (Status: {status})")
-                            return None
-                except Exception as e:
-                    if not silent:
-                        logger.warning(f"Date parse failed: {e}")
+                        if not silent:
+                            logger.info(f"Ignoring past reservation for {date_str} (Status: {status})")
+                        return None
+            except Exception as e:
+                if not silent:
+                    logger.warning(f"Date parse failed: {e}")
+
+        # Note: Do not check expiration locally. Trust the server's status.
+        # If status is active, the seat is ours even if local time > exp_date.
+
+        selection_status = 'reserved' if status == 1 else 'checked-in'
+        reserve_data['selection_status'] = selection_status
+        return reserve_data
 
-            # Note: Do not check expiration locally. Trust the server's status.
-            # If status is active, the seat is ours even if local time > exp_date.
+    def _invalidate_reserve_state(self):
+        if self.user_id is not None:
+            reserve_state_cache.cache.invalidate(self.user_id)
 
-            selection_status = 'reserved' if status == 1 else 'checked-in'
-            reserve_data['selection_status'] = selection_status
-            return reserve_data
+    def _cached_reserve_state(self, fresh: bool):
+        if fresh or self.user_id is None:
+            return reserve_state_cache.MISS
+        return reserve_state_cache.cache.get(self.user_id)
+
+    def _store_reserve_state(self, reserve_info, generation: int):
+        if self.user_id is not None:
+            reserve_state_cache.cache.put(self.user_id, reserve_info, generation)
+
+    def _reserve_state_generation(self) -> int:
+        return reserve_state_cache.cache.generation(self.user_id) if self.user_id is not None else 0
+
+    def get_reserve_info(self, silent: bool = False, fresh: bool = False, raise_errors: bool = False):
+        """
+        Current reservation (None if none); served from a short per-user cache unless fresh=True.
+        Upstream failures also read as None unless raise_errors=True.
+        """
+        cached = self._cached_reserve_state(fresh)
+        if cached is not reserve_state_cache.MISS:
+            return cached
+        # API 9 (getReserveInfo) is unreliable when pre-selected seat is occupied by others
+        # User instructed to rely on index API (API 8) and check if data.userAuth.reserve.reserve is null
+        try:
+            generation = self._reserve_state_generation()
+            r = self._post(self._reserve_info_payload(), silent=silent)
+            reserve_info = self._parse_reserve_info(r, silent)
+            self._store_reserve_state(reserve_info, generation)
+            return reserve_info
         except Exception as e:
             if not silent:
                 logger.error(f"get_reserve_info failed: {e}")
+            if raise_errors:
+                raise
             return None
 
+    # --- Dashboard seat state ---
+    @staticmethod
+    def _seat_state_payload(lib_id: Optional[int] = None):
+        if lib_id is None:
+            return {"operationName": "index", "query": graphql_query.SEAT_STATE, "variables": {}}
+        return {"operationName": "index", "query": graphql_query.SEAT_STATE_WITH_LIB, "variables": {"libId": lib_id}}
+
+    def _parse_seat_state(self, data: Dict[str, Any], lib_id: Optional[int], generation: int):
+        user_auth = self._user_auth(data)
+        current = self._parse_reserve_info(data, silent=True)
+        self._store_reserve_state(current, generation)
+        state = {"current": current, "frequent": self._parse_seat_info(user_auth)}
+        if lib_id is not None:
+            libs = (user_auth.get('reserve') or {}).get('libs') or []
+            state["lib"] = libs[0] if libs else None
+        return state
+
+    def get_seat_state(self, lib_id: Optional[int] = None):
+        """Current reservation, often-seats and optionally one room's live status in a single request."""
+        generation = self._reserve_state_generation()
+        data = self._post(self._seat_state_payload(lib_id))
+        return self._parse_seat_state(data, lib_id, generation)
+
     # --- Interactive Info ---
-    def get_lib_list(self):
-        payload = {
+    @staticmethod
+    def _lib_list_payload():
+        return {
             "operationName": "list",
             "query": "query list { userAuth { reserve { libs(libType: -1) { lib_id lib_name lib_floor is_open lib_rt { seats_total seats_has open_time_str close_time_str advance_booking } } } } }",
             "variables": {}
         }
+
+    @staticmethod
+    def _parse_lib_list(data: Dict[str, Any]):
+        libs = ((data.get('data') or {}).get('userAuth') or {}).get('reserve', {}).get('libs') or []
+        result = []
+        for lib in libs:
+            result.append({
+                "id": lib.get('lib_id'),
+                "name": f"{lib.get('lib_name')} - {lib.get('lib_floor')}",
+                "status": 1 if lib.get('is_open') else 0,
+                "open_time_str": ((lib.get('lib_rt') or {}) or {}).get('open_time_str'),
+                "close_time_str": ((lib.get('lib_rt') or {}) or {}).get('close_time_str'),
+                "advance_booking": ((lib.get('lib_rt') or {}) or {}).get('advance_booking'),
+            })
+        return result
+
+    def get_lib_list(self):
         try:
-            data = self._post(payload)
-            libs = ((data.get('data') or {}).get('userAuth') or {}).get('reserve', {}).get('libs') or []
-            result = []
-            for lib in libs:
-                result.append({
-                    "id": lib.get('lib_id'),
-                    "name": f"{lib.get('lib_name')} - {lib.get('lib_floor')}",
-                    "status": 1 if lib.get('is_open') else 0,
-                    "open_time_str": ((lib.get('lib_rt') or {}) or {}).get('open_time_str'),
-                    "close_time_str": ((lib.get('lib_rt') or {}) or {}).get('close_time_str'),
-                    "advance_booking": ((lib.get('lib_rt') or {}) or {}).get('advance_booking'),
-                })
-            return result
+            data = self._post(self._lib_list_payload())
+            return self._parse_lib_list(data)
         except Exception as e:
             logger.error(f"get_lib_list failed: {e}")
             return []
@@ -439,8 +737,9 @@ class LibService:
         # Deprecated: get_lib_list now returns all rooms directly
         return []
 
-    def get_lib_layout(self, lib_id: int):
-        payload = {
+    @staticmethod
+    def _lib_layout_payload(lib_id: int):
+        return {
             "operationName": "libLayout",
             "query": "query libLayout($libId: Int, $libType: Int) {\n userAuth {\n reserve {\n libs(libType: "
                      "$libType, libId: $libId) {\n lib_id\n is_open\n lib_floor\n lib_name\n lib_type\n "
@@ -448,13 +747,34 @@ class LibService:
                      "{\n x\n y\n key\n type\n name\n seat_status\n status\n }\n }\n }\n }\n }\n}",
             "variables": {"libId": lib_id}
         }
-        data = self._post(payload)
+
+    @staticmethod
+    def _lib_status_payload(lib_id: int):
+        # Only the volatile part of libLayout; geometry comes from the lib cache
+        return {
+            "operationName": "libLayout",
+            "query": "query libLayout($libId: Int, $libType: Int) {\n userAuth {\n reserve {\n libs(libType: "
+                     "$libType, libId: $libId) {\n lib_id\n is_open\n lib_layout {\n seats_booking\n "
+                     "seats_used\n seats {\n key\n seat_status\n status\n }\n }\n }\n }\n }\n}",
+            "variables": {"libId": lib_id}
+        }
+
+    def get_lib_status(self, lib_id: int):
+        data = self._post(self._lib_status_payload(lib_id))
+        return self._parse_lib_layout(data)
+
+    @staticmethod
+    def _parse_lib_layout(data: Dict[str, Any]):
         libs = ((data.get('data') or {}).get('userAuth') or {}).get('reserve', {}).get('libs') or []
         if libs:
             return libs[0]
         logger.warning(f"get_lib_layout returned no libs. Response: {data}")
         return None
 
+    def get_lib_layout(self, lib_id: int):
+        data = self._post(self._lib_layout_payload(lib_id))
+        return self._parse_lib_layout(data)
+
     # --- Pre-reserve (Next Day) ---
     async def _wait_queue(self):
         socket_headers = self.headers.copy()
@@ -463,62 +783,111 @@ class LibService:
             'Cache-Control': 'no-cache', 'Sec-WebSocket-Version': '13',
             'Sec-WebSocket-Extensions': 'permessage-deflate; client_max_window_bits'
         })
-        
+
         start = time.time()
-        async with websockets.connect(self.WS_URL, extra_headers=socket_headers) as websocket:
-            while True:
-                await websocket.send('{"ns":"prereserve/queue","msg":""}')
-                response = await websocket.recv()
-                if 'u6392' in response or 'success' in response:
-                    break
-                await asyncio.sleep(0.8)
-                if time.time() - start > 150:
-                    raise Exception('队列等待超时')
-    
-    def prereserve_seat(self, lib_id: int, seat_key: str):
-        # 1. Check Msg
-        check_payload = {
+        with upstream_metrics.track('prereserve_queue') as call:
+            async with websockets.connect(self.WS_URL, extra_headers=socket_headers) as websocket:
+                while True:
+                    message = '{"ns":"prereserve/queue","msg":""}'
+                    await websocket.send(message)
+                    call.sent += len(message)
+                    response = await websocket.recv()
+                    call.received += len(response)
+                    if 'u6392' in response or 'success' in response:
+                        break
+                    await asyncio.sleep(0.8)
+                    if time.time() - start > 150:
+                        raise Exception('队列等待超时')
+
+    @staticmethod
+    def _prereserve_check_payload():
+        return {
             "operationName": "prereserveCheckMsg",
             "query": "query prereserveCheckMsg {\n userAuth {\n prereserve {\n prereserveCheckMsg\n }\n }\n}"
         }
-        r = self._post(check_payload)
-        msg = ((r.get('data') or {}).get('userAuth') or {}).get('prereserve', {}).get('prereserveCheckMsg')
-        
+
+    @staticmethod
+    def _parse_prereserve_msg(r: Dict[str, Any]):
+        return ((r.get('data') or {}).get('userAuth') or {}).get('prereserve', {}).get('prereserveCheckMsg')
+
+    @staticmethod
+    def _prereserve_save_payload(lib_id: int, seat_key: str):
+        return {
+            "operationName": "save",
+            "query": "mutation save($key: String!, $libid: Int!, $captchaCode: String, $captcha: String) "
+                     "{\n userAuth {\n prereserve {\n save(key: $key, libId: $libid, captcha: $captcha, "
+                     "captchaCode: $captchaCode)\n }\n }\n}",
+            "variables": {
+                "libid": lib_id,
+                "key": seat_key,
+                "captchaCode": "",
+                "captcha": ""
+            }
+        }
+
+    @staticmethod
+    def _check_prereserve_saved(res: Dict[str, Any]):
+        if 'errors' in res:
+             error_item = res['errors'][0]
+             raise Exception(error_item.get('msg') or error_item.get('message') or 'Prereserve Failed')
+        return True
+
+    @_invalidates_reserve_state
+    def prereserve_seat(self, lib_id: int, seat_key: str):
+        # 1. Check Msg
+        r = self._post(self._prereserve_check_payload())
+        msg = self._parse_prereserve_msg(r)
+
         if msg == '':
             # Queue
             asyncio.run(self._wait_queue())
-            
+
             # Save
-            save_payload = {
-                "operationName": "save",
-                "query": "mutation save($key: String!, $libid: Int!, $captchaCode: String, $captcha: String) "
-                         "{\n userAuth {\n prereserve {\n save(key: $key, libId: $libid, captcha: $captcha, "
-                         "captchaCode: $captchaCode)\n }\n }\n}",
-                "variables": {
-                    "libid": lib_id,
-                    "key": seat_key,
-                    "captchaCode": "",
-                    "captcha": ""
-                }
-            }
-            res = self._post(save_payload)
-            if 'errors' in res:
-                 error_item = res['errors'][0]
-                 raise Exception(error_item.get('msg') or error_item.get('message') or 'Prereserve Failed')
-            return True
+            res = self._post(self._prereserve_save_payload(lib_id, seat_key))
+            return self._check_prereserve_saved(res)
         else:
             raise Exception(f"Prereserve Check Failed: {msg}")
 
+    @staticmethod
+    def _refresh_payload():
+        return {
+            "operationName": "index",
+            "query": "query index { userAuth { currentUser { user_id } prereserve { prereserveCheckMsg } } }",
+            "variables": {}
+        }
+
     def refresh_page(self):
         try:
-            self._post({
-                "operationName": "index",
-                "query": "query index { userAuth { currentUser { user_id } prereserve { prereserveCheckMsg } } }",
-                "variables": {}
-            })
+            self._post(self._refresh_payload())
         except Exception:
             pass
 
+    KEEP_ALIVE_PAGE_URL = 'https://wechat.v2.traceint.com/index.php/reserve/index.html?f=wechat'
+
+    def _get_keep_alive_page(self):
+        with upstream_metrics.track('keep_alive_page') as call:
+            call.response = self.session.get(self.KEEP_ALIVE_PAGE_URL, headers=self._keep_alive_page_headers(), timeout=10)
+            return call.response
+
+    def _keep_alive_page_headers(self):
+        headers = self.headers.copy()
+        headers.update({
+            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8',
+            'Sec-Fetch-Dest': 'document',
+            'Sec-Fetch-Mode': 'navigate',
+            'Sec-Fetch-Site': 'none',
+            'Upgrade-Insecure-Requests': '1'
+        })
+        return headers
+
+    @staticmethod
+    def _keep_alive_query_payload():
+        return {
+            "operationName": "getUserCancleConfig",
+            "query": "query getUserCancleConfig {\n userAuth {\n user {\n holdValidate: getSchConfig(fields: \"hold_validate\", extra: true)\n }\n }\n}",
+            "variables": {}
+        }
+
     def keep_alive(self, do_keepalive_query: bool = True):
         """
         执行保活：
@@ -535,29 +904,15 @@ class LibService:
             except Exception:
                 pass
             # 1) WeChat Session Update (GET Request) - Simulates user activity
-            url = 'https://wechat.v2.traceint.com/index.php/reserve/index.html?f=wechat'
-            headers = self.headers.copy()
-            headers.update({
-                'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8',
-                'Sec-Fetch-Dest': 'document',
-                'Sec-Fetch-Mode': 'navigate',
-                'Sec-Fetch-Site': 'none',
-                'Upgrade-Insecure-Requests': '1'
-            })
-            r = self.session.get(url, headers=headers, timeout=10)
+            r = self._get_keep_alive_page()
             if r.cookies:
                 self._update_cookies(r.cookies.get_dict())
             page_ok = True
             # 2) Cookie Update (GraphQL getUserCancleConfig) - Critical for token renewal
             # Replaced htmlRule with getUserCancleConfig as per auto-go-library reference
             if do_keepalive_query:
-                rule_payload = {
-                    "operationName": "getUserCancleConfig",
-                    "query": "query getUserCancleConfig {\n userAuth {\n user {\n holdValidate: getSchConfig(fields: \"hold_validate\", extra: true)\n }\n }\n}",
-                    "variables": {}
-                }
                 try:
-                    self._post(rule_payload)
+                    self._post(self._keep_alive_query_payload())
                     api_ok = True
                 except Exception as e:
                     logger.error(f"Keep-alive query failed: {e}")
@@ -568,22 +923,28 @@ class LibService:
             return {"page_ok": page_ok, "api_ok": api_ok}
 
     # --- Check In (Integral) ---
-    def check_in_integral(self):
-        list_payload = {
+    @staticmethod
+    def _credit_list_payload():
+        return {
             "operationName": "getList",
             "query": "query getList {\n userAuth {\n credit {\n tasks {\n id\n }\n }\n }\n}"
         }
-        r = self._post(list_payload)
+
+    @staticmethod
+    def _credit_done_payload(task_id: int):
+        return {
+            "operationName": "done",
+            "query":"mutation done($user_task_id: Int!) {\n userAuth {\n credit {\n done(user_task_id: "
+                    "$user_task_id)\n }\n }\n}",
+            "variables": {"user_task_id": task_id}
+        }
+
+    def check_in_integral(self):
+        r = self._post(self._credit_list_payload())
         tasks = r.get('data', {}).get('userAuth', {}).get('credit', {}).get('tasks', [])
-        
+
         if tasks:
-            task_id = tasks[0]['id']
-            done_payload = {
-                "operationName": "done",
-                "query":"mutation done($user_task_id: Int!) {\n userAuth {\n credit {\n done(user_task_id: "
-                        "$user_task_id)\n }\n }\n}",
-                "variables": {"user_task_id": task_id}
-            }
+            done_payload = self._credit_done_payload(tasks[0]['id'])
             self._post(done_payload)
             time.sleep(1)
             self._post(done_payload) # Double tap as in original code
@@ -591,43 +952,285 @@ class LibService:
         return False
 
     # --- Hold (Temporary Leave) ---
+    @staticmethod
+    def _reserve_status_payload():
+        return {"operationName": "index", "query": graphql_query.RESERVE_STATUS_ONLY, "variables": {}}
+
+    @staticmethod
+    def _hold_payload():
+        return {
+            "operationName": "reserveHold",
+            "query": "mutation reserveHold {\n userAuth {\n reserve {\n reserveHold\n }\n }\n}"
+        }
+
+    @_invalidates_reserve_state
     def hold_seat(self):
         # Check status first
-        index_payload = {
-            "operationName": "index",
-            "query": "query index { userAuth { reserve { reserve { status } } } }",
-            "variables": {}
-        }
-        r = self._post(index_payload)
+        r = self._post(self._reserve_status_payload())
         status = r.get('data', {}).get('userAuth', {}).get('reserve', {}).get('reserve', {}).get('status')
-        
+
         if status == 3: # Assuming 3 is "seated"
-            hold_payload = {
-                "operationName": "reserveHold",
-                "query": "mutation reserveHold {\n userAuth {\n reserve {\n reserveHold\n }\n }\n}"
-            }
-            self._post(hold_payload)
+            self._post(self._hold_payload())
             return True
         return False
 
     # --- Withdraw ---
+    @_invalidates_reserve_state
     def withdraw_seat(self):
-        index_payload = {
-            "operationName": "index",
-            "query": "query index { userAuth { reserve { getSToken } } }",
-            "variables": {}
-        }
-        r = self._post(index_payload)
-        token = r.get('data', {}).get('userAuth', {}).get('reserve', {}).get('getSToken')
-        
+        r = self._post(self._stoken_payload())
+        token = self._parse_stoken(r)
+
         if token:
-            withdraw_payload = {
-                "operationName": "reserveCancle",
-                "query": "mutation reserveCancle($sToken: String!) {\n userAuth {\n "
-                         "reserve {\n reserveCancle(sToken: $sToken) {\n "
-                         "timerange\n }\n }\n }\n}",
-                "variables": {"sToken": token}
-            }
-            self._post(withdraw_payload)
+            self._post(self._cancel_payload(token))
+            return True
+        return False
+
+    def close(self):
+        if self.session is not None:
+            self.session.close()
+
+
+class AsyncLibService(LibService):
+    """
+    LibService 的异步版本。
+    不持有独立的 requests.Session，所有请求走进程级共享的 httpx 连接池（见 http_client），
+    从而在早高峰时复用已握手的 TCP/TLS 连接。
+    """
+
+    def _create_session(self):
+        return None
+
+    def _request_headers(self, headers: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+        # Host/Connection are hop-by-hop for the pooled client (and illegal over HTTP/2).
+        return {k: v for k, v in (headers or self.headers).items() if k not in ('Host', 'Connection')}
+
+    async def _post(self, payload: Dict[str, Any], silent: bool = False) -> Dict[str, Any]:
+        key = self._flight_key(payload)
+        if key is None:
+            return await self._send_post(payload, silent)
+        return await _post_flight.do(key, lambda: self._send_post(payload, silent))
+
+    async def _get_keep_alive_page(self):
+        with upstream_metrics.track('keep_alive_page') as call:
+            call.response = await http_client.request(
+                'GET', self.KEEP_ALIVE_PAGE_URL,
+                headers=self._request_headers(self._keep_alive_page_headers())
+            )
+            return call.response
+
+    async def _send_post(self, payload: Dict[str, Any], silent: bool = False) -> Dict[str, Any]:
+        body = gql_codec.encode_payload(payload)
+        r = None
+        with upstream_metrics.track(payload.get('operationName'), sent=len(body)) as call:
+            try:
+                t0 = time.time()
+                r = call.response = await http_client.request('POST', self.BASE_URL, content=body, headers=self._request_headers())
+                clock_sync.clock.observe_date_header(t0, r.headers.get('Date'), time.time())
+                r.raise_for_status()
+
+                # Update cookies automatically from response (handles SERVERID and auth tokens)
+                if r.cookies:
+                    self._update_cookies(dict(r.cookies))
+
+                data = gql_codec.loads(r.content)
+                self._check_errors(data, payload, silent)
+                self._record_activity(data)
+                return data
+            except Exception as e:
+                if not silent:
+                    logger.error(f"Request failed: {e}")
+                if r is not None and not silent:
+                    logger.error(f"Response content: {r.text}")
+                raise
+
+    # --- Crawl / Info ---
+    async def get_user_info(self):
+        data = await self._post(self._user_info_payload())
+        return self._parse_user_info(data)
+
+    async def get_seat_info(self):
+        user_auth = self._user_auth(await self._post(self._often_seats_payload()))
+        return self._parse_seat_info(user_auth)
+
+    # --- Reserve ---
+    async def prepare_reserve(self, lib_id: int, force: bool = False):
+        if force or lib_id not in self._lib_layout_seen:
+            await self._post(self._lib_preflight_payload(lib_id))
+            self._lib_layout_seen.add(lib_id)
+
+    @_invalidates_reserve_state
+    async def reserve_seat(self, lib_id: int, seat_key: str):
+        await self.prepare_reserve(lib_id)
+
+        res = await self._post(self._reserve_payload(lib_id, seat_key))
+
+        # Do not trust reserveSeat error messages. Always trust index status.
+        seat, _ = await self.confirm_reserve([{'lib_id': lib_id, 'seat_key': seat_key}], self._reserve_accepted(res))
+        if seat:
+            return True
+
+        self._raise_reserve_failure(res)
+
+    @_invalidates_reserve_state
+    async def attempt_reserve(self, lib_id: int, seat_key: str) -> Dict[str, Any]:
+        """Send reserueSeat only (no confirmation); callers confirm with confirm_reserve."""
+        await self.prepare_reserve(lib_id)
+        return await self._post(self._reserve_payload(lib_id, seat_key))
+
+    async def _poll_reserve_status(self):
+        try:
+            r = await self._post(self._reserve_confirm_payload(), silent=True)
+            return self._parse_reserve_info(r, silent=True)
+        except Exception:
+            return None
+
+    async def confirm_reserve(self, seats, accepted: bool = True):
+        reserve_info = await self._poll_reserve_status()
+        delays = self._confirm_delays(accepted)
+        while True:
+            seat = self._match_reserved(reserve_info, seats)
+            if seat or reserve_info:
+                return seat, reserve_info
+            delay = next(delays, None)
+            if delay is None:
+                return None, reserve_info
+            await asyncio.sleep(delay)
+            reserve_info = await self._poll_reserve_status()
+
+    @_invalidates_reserve_state
+    async def cancel_reserve(self):
+        r = await self._post(self._stoken_payload())
+        token = self._parse_stoken(r)
+
+        if not token:
+            raise Exception("无法获取取消凭证(sToken)，请重试")
+
+        res = await self._post(self._cancel_payload(token))
+        return self._parse_cancel_result(res)
+
+    async def get_reserve_info(self, silent: bool = False, fresh: bool = False, raise_errors: bool = False):
+        cached = self._cached_reserve_state(fresh)
+        if cached is not reserve_state_cache.MISS:
+            return cached
+        try:
+            generation = self._reserve_state_generation()
+            r = await self._post(self._reserve_info_payload(), silent=silent)
+            reserve_info = self._parse_reserve_info(r, silent)
+            self._store_reserve_state(reserve_info, generation)
+            return reserve_info
+        except Exception as e:
+            if not silent:
+                logger.error(f"get_reserve_info failed: {e}")
+            if raise_errors:
+                raise
+            return None
+
+    async def get_seat_state(self, lib_id: Optional[int] = None):
+        generation = self._reserve_state_generation()
+        data = await self._post(self._seat_state_payload(lib_id))
+        return self._parse_seat_state(data, lib_id, generation)
+
+    # --- Interactive Info ---
+    async def get_lib_list(self):
+        try:
+            data = await self._post(self._lib_list_payload())
+            return self._parse_lib_list(data)
+        except Exception as e:
+            logger.error(f"get_lib_list failed: {e}")
+            return []
+
+    async def get_floor_list(self, lib_id: int):
+        return []
+
+    async def get_lib_layout(self, lib_id: int):
+        data = await self._post(self._lib_layout_payload(lib_id))
+        return self._parse_lib_layout(data)
+
+    async def get_lib_status(self, lib_id: int):
+        data = await self._post(self._lib_status_payload(lib_id))
+        return self._parse_lib_layout(data)
+
+    async def check_alive(self) -> bool:
+        user_auth = self._user_auth(await self._post(self._liveness_payload()))
+        self._remember_school(user_auth)
+        return True
+
+    async def get_school_id(self):
+        if self.school_id is None:
+            await self.check_alive()
+        return self.school_id
+
+    # --- Pre-reserve (Next Day) ---
+    @_invalidates_reserve_state
+    async def prereserve_seat(self, lib_id: int, seat_key: str):
+        r = await self._post(self._prereserve_check_payload())
+        msg = self._parse_prereserve_msg(r)
+
+        if msg == '':
+            await self._wait_queue()
+            res = await self._post(self._prereserve_save_payload(lib_id, seat_key))
+            return self._check_prereserve_saved(res)
+        else:
+            raise Exception(f"Prereserve Check Failed: {msg}")
+
+    async def refresh_page(self):
+        try:
+            await self._post(self._refresh_payload())
+        except Exception:
+            pass
+
+    async def keep_alive(self, do_keepalive_query: bool = True):
+        """异步保活，流程与 LibService.keep_alive 一致"""
+        page_ok = False
+        api_ok = False
+        try:
+            await asyncio.sleep(random.uniform(0.1, 0.6))
+            r = await self._get_keep_alive_page()
+            if r.cookies:
+                self._update_cookies(dict(r.cookies))
+            page_ok = True
+            if do_keepalive_query:
+                try:
+                    await self._post(self._keep_alive_query_payload())
+                    api_ok = True
+                except Exception as e:
+                    logger.error(f"Keep-alive query failed: {e}")
+            return {"page_ok": page_ok, "api_ok": api_ok}
+        except Exception as e:
+            logger.error(f"Keep-alive critical failure: {e}")
+            return {"page_ok": page_ok, "api_ok": api_ok}
+
+    # --- Check In (Integral) ---
+    async def check_in_integral(self):
+        r = await self._post(self._credit_list_payload())
+        tasks = r.get('data', {}).get('userAuth', {}).get('credit', {}).get('tasks', [])
+
+        if tasks:
+            done_payload = self._credit_done_payload(tasks[0]['id'])
+            await self._post(done_payload)
+            await asyncio.sleep(1)
+            await self._post(done_payload)
+            return True
+        return False
+
+    # --- Hold (Temporary Leave) ---
+    @_invalidates_reserve_state
+    async def hold_seat(self):
+        r = await self._post(self._reserve_status_payload())
+        status = r.get('data', {}).get('userAuth', {}).get('reserve', {}).get('reserve', {}).get('status')
+
+        if status == 3:
+            await self._post(self._hold_payload())
+            return True
+        return False
+
+    # --- Withdraw ---
+    @_invalidates_reserve_state
+    async def withdraw_seat(self):
+        r = await self._post(self._stoken_payload())
+        token = self._parse_stoken(r)
+
+        if token:
+            await self._post(self._cancel_payload(token))
             return True
         return False
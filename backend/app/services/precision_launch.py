@@ -0,0 +1,80 @@
+"""
+精准发射（precision launch）
+
+预约任务在放座时刻前提前 lead 秒被唤醒：先完成预约状态检查、候选座位解析、
+页面刷新与 libLayout 预检，把连接和会话都预热好，然后精确睡眠到目标时间戳再发出
+reserueSeat，并记录实际发射时刻与目标的偏差。
+"""
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Optional
+
+from apscheduler.triggers.base import BaseTrigger
+
+DEFAULT_LEAD_SECONDS = float(os.getenv("PRECISION_LEAD_SECONDS", "15"))
+# Below this remaining time we stop trusting time.sleep() granularity and spin
+SPIN_SECONDS = float(os.getenv("PRECISION_SPIN_MS", "20")) / 1000
+MAX_LEAD_SECONDS = 120
+# A target further away than lead + this margin means the run was not woken by LeadTrigger
+LAUNCH_MARGIN_SECONDS = float(os.getenv("PRECISION_LAUNCH_MARGIN_SECONDS", "5"))
+# Precision runs sleep through their lead, so they get their own pool instead of holding scheduler workers
+LAUNCH_WORKERS = int(os.getenv("PRECISION_LAUNCH_WORKERS", "20"))
+
+
+def is_enabled(config: Optional[Dict[str, Any]]) -> bool:
+    return bool((config or {}).get('precision'))
+
+
+def lead_seconds(config: Optional[Dict[str, Any]]) -> float:
+    try:
+        lead = float((config or {}).get('lead_seconds', DEFAULT_LEAD_SECONDS))
+    except (TypeError, ValueError):
+        lead = DEFAULT_LEAD_SECONDS
+    return min(max(lead, 0.0), MAX_LEAD_SECONDS)
+
+
+def fire_offset_seconds(config: Optional[Dict[str, Any]]) -> float:
+    """Optional user tweak (ms, may be negative) applied to the target, e.g. to compensate one-way latency."""
+    try:
+        return float((config or {}).get('fire_offset_ms', 0)) / 1000
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class LeadTrigger(BaseTrigger):
+    """Fires `lead` seconds before every fire time of the wrapped trigger."""
+
+    def __init__(self, trigger: BaseTrigger, lead: float):
+        self.trigger = trigger
+        self.lead = timedelta(seconds=lead)
+
+    def get_next_fire_time(self, previous_fire_time, now):
+        previous = previous_fire_time + self.lead if previous_fire_time else None
+        next_fire = self.trigger.get_next_fire_time(previous, now + self.lead)
+        return next_fire - self.lead if next_fire else None
+
+    def target_for(self, now: datetime) -> Optional[datetime]:
+        """
+        The launch time a wake-up at `now` belongs to (tolerates waking up to `lead` late).
+        A wake-up later than that resolves to the next fire time; callers must check the distance.
+        """
+        return self.trigger.get_next_fire_time(None, now - self.lead)
+
+    def __str__(self):
+        return f"lead[{self.lead.total_seconds():g}s]({self.trigger})"
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} (trigger={self.trigger!r}, lead={self.lead.total_seconds():g}s)>"
+
+
+def sleep_until(target: float, clock: Callable[[], float] = time.time):
+    """Sleep until clock() >= target: coarse sleep first, then spin for the last few milliseconds."""
+    while True:
+        remaining = target - clock()
+        if remaining <= 0:
+            return
+        if remaining > SPIN_SECONDS:
+            time.sleep(remaining - SPIN_SECONDS)
+        else:
+            time.sleep(0)
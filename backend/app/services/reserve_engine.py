@@ -0,0 +1,117 @@
+"""
+多座位并发预约引擎（default_all 策略）
+
+按用户常用座位的顺序给候选座位排序，每个阅览室只拉取一次 libLayout 得到实时座位状态
+（同时充当 reserueSeat 之前的预检），跳过明确已被占用的座位；对剩余座位按批次并发发出
+reserueSeat，在这一批全部返回后立即查询预约状态确认是哪一个座位成功，不再固定等待
+（确认轮询见 LibService.confirm_reserve）。精准发射时布局在 lead 阶段用 fetch_layouts 提前拉取
+并传给 reserve_any，目标时刻之后线上只剩 reserueSeat。
+"""
+import asyncio
+import logging
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.services.lib_service import AsyncLibService
+
+logger = logging.getLogger(__name__)
+
+FANOUT_WIDTH = int(os.getenv("RESERVE_FANOUT_WIDTH", "3"))
+
+
+def is_fatal_error(e: Exception) -> bool:
+    """Errors that will fail every seat alike (dead cookie, temporary ban)."""
+    msg = str(e).lower()
+    return '40001' in msg or '403' in msg or 'cookie失效或账号被临时限制' in msg
+
+
+def seat_free(seat: Dict[str, Any]) -> bool:
+    # Same rule as the frontend: seat_status (or status when absent) == 1 means available
+    raw = seat.get('seat_status') if 'seat_status' in seat else seat.get('status')
+    return raw == 1 and not isinstance(raw, bool)
+
+
+def rank_candidates(seats: List[Dict[str, Any]], layouts: Dict[int, Optional[Dict[str, Any]]]):
+    """
+    Keep the user's preference order, but put seats the layout shows as free first and
+    drop seats shown as taken. Seats without usable live status (layout failed or the
+    room is not open yet) are still attempted, after the known-free ones.
+    """
+    free, unknown = [], []
+    for seat in seats:
+        layout = layouts.get(seat['lib_id'])
+        if not layout or not layout.get('is_open'):
+            unknown.append(seat)
+            continue
+        live = {str(s.get('key')): s for s in (layout.get('lib_layout') or {}).get('seats') or []}
+        state = live.get(str(seat['seat_key']))
+        if state is None:
+            unknown.append(seat)
+        elif seat_free(state):
+            free.append(seat)
+    return free + unknown
+
+
+async def fetch_layouts(service: AsyncLibService, lib_ids) -> Dict[int, Optional[Dict[str, Any]]]:
+    async def fetch(lib_id):
+        try:
+            layout = await service.get_lib_layout(lib_id)
+            # The full layout query is a superset of the libLayout preflight
+            service._lib_layout_seen.add(lib_id)
+            return layout
+        except Exception as e:
+            if is_fatal_error(e):
+                raise
+            logger.warning(f"Live layout for lib {lib_id} unavailable: {e}")
+            return None
+
+    lib_ids = list(dict.fromkeys(lib_ids))
+    layouts = await asyncio.gather(*(fetch(lib_id) for lib_id in lib_ids))
+    return dict(zip(lib_ids, layouts))
+
+
+async def reserve_any(service: AsyncLibService, seats: List[Dict[str, Any]], width: int = FANOUT_WIDTH,
+                      layouts: Optional[Dict[int, Optional[Dict[str, Any]]]] = None
+                      ) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+    """
+    Try to get any one of `seats`. Returns (seat, reserve_info) on success, (None, None) when no
+    candidate was free, and raises the last upstream error if every attempt failed.
+    Pass `layouts` (from fetch_layouts) to rank on a prefetched snapshot instead of fetching now.
+    """
+    if layouts is None:
+        layouts = await fetch_layouts(service, [seat['lib_id'] for seat in seats])
+    candidates = rank_candidates(seats, layouts)
+    logger.info(f"Reserve fan-out: {len(candidates)}/{len(seats)} candidate seat(s) after live status check")
+
+    last_error = None
+    width = max(1, width)
+    for i in range(0, len(candidates), width):
+        batch = candidates[i:i + width]
+        results = await asyncio.gather(
+            *(service.attempt_reserve(seat['lib_id'], seat['seat_key']) for seat in batch),
+            return_exceptions=True
+        )
+        for res in results:
+            if isinstance(res, Exception):
+                if is_fatal_error(res):
+                    raise res
+                last_error = res
+
+        accepted = any(not isinstance(res, Exception) and service._reserve_accepted(res) for res in results)
+        seat, reserve_info = await service.confirm_reserve(batch, accepted)
+        if seat:
+            return seat, reserve_info
+        if reserve_info:
+            # Holding some other seat already (e.g. reserved elsewhere meanwhile); do not grab a second one
+            return None, reserve_info
+
+        for res in results:
+            if not isinstance(res, Exception):
+                try:
+                    service._raise_reserve_failure(res)
+                except Exception as e:
+                    last_error = e
+
+    if last_error:
+        raise last_error
+    return None, None
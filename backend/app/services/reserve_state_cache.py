@@ -0,0 +1,51 @@
+"""
+按用户缓存的预约状态（index 查询解析结果）
+
+仪表盘、座位监控等会在短时间内反复查询同一用户的预约状态，这里按 user_id 缓存解析后的结果
+（包括"当前无预约"），TTL 很短；预约、取消、暂离、退座、预约明日等写操作完成后立即失效。
+每次失效都会递增该用户的代数，失效前发出的查询返回后不会再把旧状态写回缓存。
+"""
+import copy
+import os
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+RESERVE_STATE_TTL = float(os.getenv("RESERVE_STATE_TTL_SECONDS", "10"))
+
+MISS = object()
+
+
+class ReserveStateCache:
+    def __init__(self, ttl: float = RESERVE_STATE_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # user_id -> (stored_at, reserve_info or None)
+        self._entries: Dict[int, Tuple[float, Optional[Dict[str, Any]]]] = {}
+        self._generations: Dict[int, int] = {}
+
+    def get(self, user_id: int):
+        """Cached reserve info (may be None = no reservation), or MISS."""
+        with self._lock:
+            entry = self._entries.get(user_id)
+        if entry is None or time.monotonic() - entry[0] >= self.ttl:
+            return MISS
+        return copy.deepcopy(entry[1])
+
+    def generation(self, user_id: int) -> int:
+        with self._lock:
+            return self._generations.get(user_id, 0)
+
+    def put(self, user_id: int, reserve_info: Optional[Dict[str, Any]], generation: int):
+        with self._lock:
+            if self._generations.get(user_id, 0) != generation:
+                return
+            self._entries[user_id] = (time.monotonic(), copy.deepcopy(reserve_info))
+
+    def invalidate(self, user_id: int):
+        with self._lock:
+            self._entries.pop(user_id, None)
+            self._generations[user_id] = self._generations.get(user_id, 0) + 1
+
+
+cache = ReserveStateCache()
@@ -0,0 +1,522 @@
+"""
+座位状态监控（监督举报、即将过期、Cookie 失效提醒）
+
+每个用户按自己的预约状态决定下一次检查时间，只在状态即将变化时密集轮询：
+  无预约                  -> 每 SEAT_MONITOR_IDLE_SECONDS 一次
+  已预约未签到 / 暂离(4)    -> 平时宽松，距 exp_date 不足 15 分钟时每 SEAT_MONITOR_TIGHT_SECONDS 一次
+  已签到 / 已入座(2, 3)     -> 每 SEAT_MONITOR_SEATED_SECONDS 一次（监督举报无法预测）
+  被监督(5)               -> 每 SEAT_MONITOR_TIGHT_SECONDS 一次
+闭馆时间内不检查，顺延到下一次开馆。到期用户由进程内调度器每 SEAT_MONITOR_TICK_SECONDS
+取出，在有界线程池上并发检查，受时间预算约束，未完成的用户通过 cursor 留到下一轮。
+外部 Cron（/bark/cron/seat-monitor）调用同一个入口，两者不会叠加运行。
+
+被监督后的延迟签到登记为调度器的一次性任务（DateTrigger），准点执行；计划时间同时写入
+seat_status_cache.delayed_signin_at，启动时据此恢复。没有后台调度器时（如 Vercel）
+退回到每轮监控扫描已到期的记录。
+"""
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime, timedelta, time as dt_time
+from typing import Dict, Iterable, Optional
+
+from apscheduler.triggers.date import DateTrigger
+
+from app import database, models
+from app.core.metrics import registry
+from app.services import bark_service, http_client, session_registry
+from app.services.auth_service import AuthService
+
+logger = logging.getLogger(__name__)
+
+SEAT_MONITOR_CONCURRENCY = int(os.getenv("SEAT_MONITOR_CONCURRENCY", "8"))
+# Keep a cycle inside the 3-minute external cron period so invocations never overlap
+SEAT_MONITOR_BUDGET_SECONDS = float(os.getenv("SEAT_MONITOR_BUDGET_SECONDS", "150"))
+SEAT_MONITOR_TICK_SECONDS = int(os.getenv("SEAT_MONITOR_TICK_SECONDS", "30"))
+
+TIGHT_SECONDS = float(os.getenv("SEAT_MONITOR_TIGHT_SECONDS", "60"))
+SEATED_SECONDS = float(os.getenv("SEAT_MONITOR_SEATED_SECONDS", "180"))
+IDLE_SECONDS = float(os.getenv("SEAT_MONITOR_IDLE_SECONDS", "600"))
+ERROR_SECONDS = float(os.getenv("SEAT_MONITOR_ERROR_SECONDS", "1800"))
+# Fallback opening hours when the reservation does not carry its own openTime / closeTime
+OPEN_TIME = os.getenv("SEAT_MONITOR_OPEN_TIME", "06:30")
+CLOSE_TIME = os.getenv("SEAT_MONITOR_CLOSE_TIME", "23:00")
+
+# The expiration reminder fires 8-12 minutes before exp_date; start polling tightly a bit earlier
+EXPIRY_TIGHT = timedelta(minutes=15)
+DELAYED_SIGNIN_DELAY = timedelta(minutes=5)
+# A rescue that is late is still worth running; never let pool queueing drop it as misfired
+DELAYED_SIGNIN_GRACE_SECONDS = 600
+JITTER = 0.1
+
+MONITOR_CYCLE = registry.histogram("seat_monitor_cycle_duration_seconds", "Seat-monitor cycle duration", ("outcome",))
+MONITOR_USERS = registry.counter("seat_monitor_users_checked_total", "Users checked by the seat monitor")
+
+monitor_pool = ThreadPoolExecutor(max_workers=SEAT_MONITOR_CONCURRENCY, thread_name_prefix="seat-monitor")
+_monitor_lock = threading.Lock()
+# Last user dispatched by an unfinished cycle; the next cycle resumes after it
+_monitor_cursor: Optional[int] = None
+# Background scheduler that owns the delayed sign-in jobs (None when only the external cron runs)
+_scheduler = None
+
+
+# ========== 检查时间策略 ==========
+
+def parse_exp_date(value) -> Optional[datetime]:
+    if value is None or value == '':
+        return None
+    if isinstance(value, str) and value.isdigit():
+        return datetime.fromtimestamp(int(value))
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value)
+    return datetime.fromisoformat(str(value))
+
+
+def _parse_clock(value, default: str) -> dt_time:
+    for candidate in (value, default):
+        if candidate is None or candidate == '':
+            continue
+        text = str(candidate).strip()
+        try:
+            if text.isdigit() and len(text) >= 9:
+                return datetime.fromtimestamp(int(text[:10])).time()
+            parts = [int(p) for p in text.split(':')]
+            return dt_time(parts[0], parts[1] if len(parts) > 1 else 0)
+        except (ValueError, IndexError):
+            continue
+    return dt_time(0, 0)
+
+
+def _open_hours(reserve_info: Optional[dict]):
+    info = reserve_info or {}
+    return _parse_clock(info.get('openTime'), OPEN_TIME), _parse_clock(info.get('closeTime'), CLOSE_TIME)
+
+
+def _within_open_hours(at: datetime, open_t: dt_time, close_t: dt_time) -> datetime:
+    """Push a check time that falls while the library is closed to the next opening."""
+    if open_t == close_t:
+        return at
+    t = at.time()
+    if open_t < close_t:
+        if t < open_t:
+            return datetime.combine(at.date(), open_t)
+        if t >= close_t:
+            return datetime.combine(at.date() + timedelta(days=1), open_t)
+        return at
+    # Opening hours wrap past midnight
+    if close_t <= t < open_t:
+        return datetime.combine(at.date(), open_t)
+    return at
+
+
+def _jittered(seconds: float) -> timedelta:
+    return timedelta(seconds=seconds * (1 + random.uniform(0, JITTER)))
+
+
+def next_check_at(reserve_info: Optional[dict], now: datetime, error: bool = False) -> datetime:
+    """When this user next needs a look, given what the last check saw."""
+    open_t, close_t = _open_hours(reserve_info)
+    if error:
+        return _within_open_hours(now + _jittered(ERROR_SECONDS), open_t, close_t)
+    if not reserve_info:
+        return _within_open_hours(now + _jittered(IDLE_SECONDS), open_t, close_t)
+
+    status = reserve_info.get('status')
+    if status == 5:
+        # The delayed sign-in and the reminder both depend on seeing this promptly
+        return now + timedelta(seconds=TIGHT_SECONDS)
+
+    if status in (1, 4):
+        try:
+            exp = parse_exp_date(reserve_info.get('exp_date'))
+        except (TypeError, ValueError, OSError):
+            exp = None
+        if exp is not None:
+            if exp - now <= EXPIRY_TIGHT:
+                return now + timedelta(seconds=TIGHT_SECONDS)
+            relaxed = now + _jittered(IDLE_SECONDS if status == 1 else SEATED_SECONDS)
+            return _within_open_hours(min(exp - EXPIRY_TIGHT, relaxed), open_t, close_t)
+
+    return _within_open_hours(now + _jittered(SEATED_SECONDS), open_t, close_t)
+
+
+class MonitorSchedule:
+    """user_id -> next check time; users never seen are due immediately."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._next: Dict[int, datetime] = {}
+
+    def due(self, user_ids: Iterable[int], now: datetime) -> set:
+        with self._lock:
+            return {uid for uid in user_ids if self._next.get(uid, now) <= now}
+
+    def set(self, user_id: int, at: datetime):
+        with self._lock:
+            self._next[user_id] = at
+
+    def wake(self, user_id: int):
+        """Check this user on the next tick, e.g. right after the scheduler reserved a seat for them."""
+        with self._lock:
+            self._next.pop(user_id, None)
+
+    def retain(self, user_ids: Iterable[int]):
+        keep = set(user_ids)
+        with self._lock:
+            for uid in [uid for uid in self._next if uid not in keep]:
+                del self._next[uid]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._next)
+
+
+schedule = MonitorSchedule()
+
+
+# ========== 监控周期 ==========
+
+def run_cycle(cursor: Optional[int] = None, budget: Optional[float] = None, due_only: bool = True) -> Optional[dict]:
+    """执行一轮监控；上一轮仍在进行时返回 None"""
+    if not _monitor_lock.acquire(blocking=False):
+        return None
+    started = time.perf_counter()
+    db = database.SessionLocal()
+    try:
+        results = _run_seat_monitor_task(db, cursor, budget, due_only)
+        MONITOR_CYCLE.observe(time.perf_counter() - started, outcome='ok')
+        MONITOR_USERS.inc(results["checked_users"])
+        return results
+    except Exception:
+        MONITOR_CYCLE.observe(time.perf_counter() - started, outcome='error')
+        raise
+    finally:
+        db.close()
+        _monitor_lock.release()
+
+
+def run_scheduled_cycle():
+    """进程内调度器的入口（每 SEAT_MONITOR_TICK_SECONDS 一次）"""
+    try:
+        results = run_cycle()
+    except Exception as e:
+        logger.error(f"座位监控任务执行失败: {e}")
+        return
+    if results and (results["checked_users"] or results["notifications_sent"]):
+        logger.info(f"座位监控: 检查 {results['checked_users']} 个用户，发送 {results['notifications_sent']} 条通知，剩余 {results['remaining']}")
+
+
+def _run_seat_monitor_task(db, cursor: Optional[int] = None, budget: Optional[float] = None, due_only: bool = True) -> dict:
+    """
+    用户按 user_id 排成一个环，从上次未完成的位置（cursor）之后开始，只取已到检查时间的用户，
+    在有界线程池上并发检查；超出时间预算后不再派发新用户，已派发的检查完成后返回新的 cursor。
+    """
+    global _monitor_cursor
+    results = {
+        "checked_users": 0,
+        "notifications_sent": 0,
+        "errors": [],
+        "cursor": None,
+        "remaining": 0
+    }
+    budget = SEAT_MONITOR_BUDGET_SECONDS if budget is None else budget
+    deadline = time.monotonic() + budget
+
+    # 没有后台调度器时，由监控轮次执行所有到期的延迟签到任务
+    if _scheduler is None:
+        delayed_signins = db.query(models.SeatStatusCache.user_id).filter(
+            models.SeatStatusCache.delayed_signin_at != None,
+            models.SeatStatusCache.delayed_signin_at <= datetime.now()
+        ).all()
+        for (user_id,) in delayed_signins:
+            if _run_delayed_signin(db, user_id):
+                results["notifications_sent"] += 1
+
+    # 获取所有启用Bark推送且绑定了Cookie的用户（只取ID和Cookie，工作线程各自使用独立会话）
+    entries = db.query(models.User.id, models.WechatConfig.cookie).join(
+        models.BarkConfig, models.User.id == models.BarkConfig.user_id
+    ).join(
+        models.WechatConfig, models.User.id == models.WechatConfig.user_id
+    ).filter(
+        models.BarkConfig.is_enabled == True,
+        models.WechatConfig.cookie != None,
+        models.WechatConfig.cookie != ''
+    ).order_by(models.User.id).all()
+
+    schedule.retain(e[0] for e in entries)
+    if due_only:
+        due = schedule.due((e[0] for e in entries), datetime.now())
+        entries = [e for e in entries if e[0] in due]
+
+    # 从 cursor 之后继续，再绕回开头
+    if cursor is None:
+        cursor = _monitor_cursor
+    if cursor is not None:
+        entries = [e for e in entries if e[0] > cursor] + [e for e in entries if e[0] <= cursor]
+
+    # 然后并发执行常规的座位状态监控，同时在途的检查不超过并发上限
+    inflight = {}
+    index = 0
+    while True:
+        while index < len(entries) and len(inflight) < SEAT_MONITOR_CONCURRENCY and time.monotonic() < deadline:
+            user_id, cookie = entries[index]
+            inflight[monitor_pool.submit(_monitor_user, user_id, cookie)] = user_id
+            index += 1
+        if not inflight:
+            break
+        done, _ = wait(inflight, return_when=FIRST_COMPLETED)
+        for future in done:
+            user_id = inflight.pop(future)
+            outcome = future.result()
+            schedule.set(user_id, outcome["next_check_at"])
+            results["checked_users"] += 1
+            results["notifications_sent"] += outcome["notifications_sent"]
+            if outcome["error"]:
+                results["errors"].append(outcome["error"])
+
+    if index < len(entries):
+        results["cursor"] = entries[index - 1][0] if index else cursor
+        results["remaining"] = len(entries) - index
+        logger.warning(f"座位监控超出时间预算 {budget}s，剩余 {results['remaining']} 个用户留到下一轮")
+    _monitor_cursor = results["cursor"]
+
+    if results["checked_users"]:
+        logger.info(f"座位监控任务完成: {results}")
+    return results
+
+
+def _monitor_user(user_id: int, cookie: str) -> dict:
+    """检查单个用户的座位状态（在监控线程池中运行，使用独立的数据库会话）"""
+    outcome = {"notifications_sent": 0, "error": None, "next_check_at": None}
+    db = database.SessionLocal()
+    try:
+        # 获取用户当前座位信息
+        service = session_registry.acquire(user_id, cookie)
+
+        try:
+            # Failures must reach the error branches below, not read as "no reservation"
+            reserve_info = http_client.run_sync(service.get_reserve_info(raise_errors=True))
+        except Exception as e:
+            error_msg = str(e).lower()
+
+            # 检测Cookie失效
+            if '40001' in error_msg or 'cookie失效' in error_msg or '403' in error_msg:
+                # 换 Cookie 之前再查也没有意义
+                outcome["next_check_at"] = next_check_at(None, datetime.now(), error=True)
+                cache = db.query(models.SeatStatusCache).filter_by(user_id=user_id).first()
+                if not cache:
+                    cache = models.SeatStatusCache(user_id=user_id)
+                    db.add(cache)
+
+                # 只发送一次Cookie失效通知
+                if not cache.cookie_invalid_notified:
+                    if bark_service.send_cookie_invalid_notification(db, user_id):
+                        outcome["notifications_sent"] += 1
+                        cache.cookie_invalid_notified = True
+                        db.commit()
+            else:
+                # 临时故障：按已入座的节奏重试
+                outcome["next_check_at"] = datetime.now() + _jittered(SEATED_SECONDS)
+
+            return outcome
+
+        outcome["next_check_at"] = next_check_at(reserve_info, datetime.now())
+
+        # 获取或创建状态缓存
+        cache = db.query(models.SeatStatusCache).filter_by(user_id=user_id).first()
+        if not cache:
+            cache = models.SeatStatusCache(user_id=user_id)
+            db.add(cache)
+
+        if not reserve_info:
+            # 用户当前无座位，重置通知标志
+            cache.supervised_notified = False
+            cache.expiration_notified = False
+            cache.cookie_invalid_notified = False
+            cache.last_status = None
+            db.commit()
+            return outcome
+
+        # Cookie有效，重置Cookie失效通知标志
+        cache.cookie_invalid_notified = False
+
+        current_status = reserve_info.get('status')
+        current_exp_date = reserve_info.get('exp_date')
+
+        # 检测监督举报（status变为5）
+        if current_status == 5 and cache.last_status != 5:
+            if not cache.supervised_notified:
+                if bark_service.send_supervised_notification(db, user_id):
+                    outcome["notifications_sent"] += 1
+                    cache.supervised_notified = True
+
+                # 设置5分钟后的延迟签到时间
+                cache.delayed_signin_at = datetime.now() + DELAYED_SIGNIN_DELAY
+                logger.info(f"用户 {user_id} 座位被监督，计划在 {cache.delayed_signin_at} 执行自动签到")
+
+        # 检测预约即将过期（距离过期8-12分钟）
+        if current_exp_date:
+            try:
+                # 解析过期时间
+                exp_datetime = parse_exp_date(current_exp_date)
+
+                time_left_seconds = (exp_datetime - datetime.now()).total_seconds()
+                time_left_minutes = time_left_seconds / 60
+
+                # 在8-12分钟窗口内提醒
+                if 8 <= time_left_minutes <= 12 and not cache.expiration_notified:
+                    if bark_service.send_expiration_notification(db, user_id, time_left_minutes):
+                        outcome["notifications_sent"] += 1
+                        cache.expiration_notified = True
+
+                # 时间充足，重置过期通知标志
+                if time_left_minutes > 15:
+                    cache.expiration_notified = False
+
+            except Exception as exp_error:
+                logger.warning(f"解析过期时间失败: {exp_error}")
+
+        # 更新缓存
+        cache.last_status = current_status
+        cache.last_exp_date = str(current_exp_date) if current_exp_date else None
+        cache.updated_at = datetime.now()
+        db.commit()
+
+        # 落库之后再登记定时任务，重启时可以从表中恢复
+        if cache.delayed_signin_at is not None:
+            schedule_delayed_signin(user_id, cache.delayed_signin_at)
+
+    except Exception as user_error:
+        db.rollback()
+        outcome["error"] = f"用户{user_id}: {str(user_error)}"
+        logger.error(f"监控用户{user_id}时发生错误: {user_error}")
+    finally:
+        db.close()
+    if outcome["next_check_at"] is None:
+        outcome["next_check_at"] = datetime.now() + timedelta(seconds=SEATED_SECONDS)
+    return outcome
+
+
+def execute_delayed_signin(db, user_id: int) -> str:
+    """执行延迟签到"""
+    user = db.query(models.User).filter_by(id=user_id).first()
+    if not user or not user.wechat_config:
+        raise Exception("用户不存在")
+
+    if not (user.wechat_config.sess_id and user.wechat_config.major and user.wechat_config.minor):
+        raise Exception("用户未配置蓝牙参数")
+
+    # 执行蓝牙签到
+    result = AuthService.sign_in(
+        user.wechat_config.sess_id,
+        user.wechat_config.major,
+        user.wechat_config.minor
+    )
+
+    # 发送签到结果通知
+    bark_service.send_notification(
+        db=db,
+        user_id=user.id,
+        notification_type=bark_service.NotificationType.AUTO_SIGNIN_AFTER_SUPERVISED,
+        title="🤖 自动签到完成",
+        content=f"检测到座位被监督举报，已自动执行蓝牙签到。结果：{result}",
+        icon="✅"
+    )
+
+    # 重置监督通知标志
+    cache = db.query(models.SeatStatusCache).filter_by(user_id=user.id).first()
+    if cache:
+        cache.supervised_notified = False
+        db.commit()
+
+    # 签到后状态会变化，下一轮就检查
+    schedule.wake(user.id)
+    return result
+
+
+# ========== 延迟签到定时任务 ==========
+
+def _delayed_signin_job_id(user_id: int) -> str:
+    return f"delayed_signin_{user_id}"
+
+
+def bind_scheduler(scheduler):
+    """由后台调度器在启动时调用；之后延迟签到按计划时间准点执行"""
+    global _scheduler
+    _scheduler = scheduler
+
+
+def schedule_delayed_signin(user_id: int, run_at: datetime):
+    if _scheduler is None:
+        return
+    # Compare in naive local time like the rest of the monitor; a time already in the past runs right away
+    if run_at.tzinfo is not None:
+        run_at = run_at.astimezone().replace(tzinfo=None)
+    run_at = max(run_at, datetime.now())
+    try:
+        _scheduler.add_job(
+            run_delayed_signin,
+            DateTrigger(run_date=run_at.astimezone(_scheduler.timezone)),
+            id=_delayed_signin_job_id(user_id),
+            args=[user_id],
+            replace_existing=True,
+            misfire_grace_time=DELAYED_SIGNIN_GRACE_SECONDS,
+            name="Delayed Sign-in"
+        )
+        logger.info(f"用户 {user_id} 的延迟签到已计划在 {run_at:%H:%M:%S} 执行")
+    except Exception as e:
+        logger.error(f"登记用户 {user_id} 的延迟签到任务失败: {e}")
+
+
+def rehydrate_delayed_signins() -> int:
+    """启动时把表中尚未执行的延迟签到重新登记为定时任务"""
+    db = database.SessionLocal()
+    try:
+        pending = db.query(models.SeatStatusCache.user_id, models.SeatStatusCache.delayed_signin_at).filter(
+            models.SeatStatusCache.delayed_signin_at != None
+        ).all()
+    except Exception as e:
+        logger.error(f"加载待执行的延迟签到失败: {e}")
+        return 0
+    finally:
+        db.close()
+    for user_id, run_at in pending:
+        schedule_delayed_signin(user_id, run_at)
+    if pending:
+        logger.info(f"Rehydrated {len(pending)} delayed sign-in job(s)")
+    return len(pending)
+
+
+def run_delayed_signin(user_id: int):
+    """延迟签到定时任务入口"""
+    db = database.SessionLocal()
+    try:
+        _run_delayed_signin(db, user_id)
+    finally:
+        db.close()
+
+
+def _run_delayed_signin(db, user_id: int) -> bool:
+    cache = db.query(models.SeatStatusCache).filter_by(user_id=user_id).first()
+    # 标记已被清除（已执行或已取消）时不再签到
+    if not cache or cache.delayed_signin_at is None:
+        return False
+    try:
+        logger.info(f"执行用户 {user_id} 的延迟签到任务")
+        result = execute_delayed_signin(db, user_id)
+        # 清除延迟签到标记
+        cache.delayed_signin_at = None
+        cache.supervised_notified = False
+        db.commit()
+        logger.info(f"用户 {user_id} 延迟签到成功: {result}")
+        return True
+    except Exception as signin_error:
+        logger.error(f"用户 {user_id} 延迟签到失败: {signin_error}")
+        # 清除标记，避免重复尝试
+        db.rollback()
+        cache.delayed_signin_at = None
+        db.commit()
+        return False
@@ -0,0 +1,107 @@
+"""
+进程级 LibService 会话注册表
+
+每个用户只缓存一个长生命周期的 AsyncLibService 实例（已解析的 Cookie、libLayout 预检记录），
+避免每次调用都重新初始化 Cookie 并重复 libLayout 预检。路由和调度任务直接 await；保活、
+座位监控等同步调用方通过 http_client.run_sync 驱动同一个实例，因此每个用户只有一份 Cookie。
+空闲超时或超出容量（LRU）的实例会被移除并显式关闭底层连接。容量至少为 LIB_SESSION_MAX，
+并随 ensure_capacity() 报告的用户数增长，避免全量保活时反复淘汰。
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from app.services.cookie_store import store as cookie_store
+from app.services.lib_service import AsyncLibService
+
+logger = logging.getLogger(__name__)
+
+MAX_SESSIONS = int(os.getenv("LIB_SESSION_MAX", "2000"))
+IDLE_SECONDS = int(os.getenv("LIB_SESSION_IDLE_SECONDS", "1800"))
+# Extra room over the known user count for users bound since the count was taken
+CAPACITY_HEADROOM = 1.25
+
+
+def _persist_cookie(user_id: int, cookie: str):
+    cookie_store.submit(user_id, cookie)
+
+
+class LibServiceRegistry:
+    def __init__(self, max_size: int = MAX_SESSIONS, idle_seconds: int = IDLE_SECONDS):
+        self.max_size = max_size
+        self.idle_seconds = idle_seconds
+        self._lock = threading.Lock()
+        # user_id -> [service, last_used]; ordered from least to most recently used
+        self._entries = OrderedDict()
+
+    def ensure_capacity(self, user_count: int):
+        """Grow the cap so every user with a cookie fits (never shrinks below the configured size)."""
+        with self._lock:
+            self.max_size = max(self.max_size, int(user_count * CAPACITY_HEADROOM))
+
+    def acquire(self, user_id: int, cookie: str) -> AsyncLibService:
+        evicted = []
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                service = AsyncLibService(cookie, lambda new_cookie: _persist_cookie(user_id, new_cookie))
+                service.user_id = user_id
+                entry = [service, 0.0]
+                self._entries[user_id] = entry
+            else:
+                entry[0].adopt_cookie(cookie)
+                self._entries.move_to_end(user_id)
+            entry[1] = time.monotonic()
+            evicted = self._collect_evictions()
+        self._close(evicted)
+        return entry[0]
+
+    def evict(self, user_id: int):
+        """Drop the user's cached instance, e.g. after the cookie was deactivated."""
+        with self._lock:
+            entry = self._entries.pop(user_id, None)
+            evicted = [entry[0]] if entry else []
+        cookie_store.discard(user_id)
+        self._close(evicted)
+
+    def close_all(self):
+        with self._lock:
+            evicted = [entry[0] for entry in self._entries.values()]
+            self._entries.clear()
+        self._close(evicted)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _collect_evictions(self):
+        # Entries are kept in LRU order, so idle ones are always at the front.
+        # The most recent entry is the one being handed out and is never evicted.
+        evicted = []
+        now = time.monotonic()
+        while len(self._entries) > 1:
+            key, (service, last_used) = next(iter(self._entries.items()))
+            if len(self._entries) <= self.max_size and now - last_used < self.idle_seconds:
+                break
+            self._entries.popitem(last=False)
+            evicted.append(service)
+        return evicted
+
+    @staticmethod
+    def _close(services):
+        for service in services:
+            try:
+                service.close()
+            except Exception as e:
+                logger.warning(f"Failed to close LibService session: {e}")
+
+
+registry = LibServiceRegistry()
+
+
+def acquire(user_id: int, cookie: str) -> AsyncLibService:
+    return registry.acquire(user_id, cookie)
+
+
+def evict(user_id: int):
+    registry.evict(user_id)
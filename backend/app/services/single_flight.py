@@ -0,0 +1,63 @@
+"""
+Single-flight 请求合并
+
+同一个 key 的并发调用只会真正执行一次，其余调用等待并共享这一次的结果（或异常）。
+调用方可能处在不同的事件循环上（uvicorn 循环、调度器线程里 asyncio.run 起的循环），
+因此用线程安全的 concurrent.futures.Future 作为共享结果。
+"""
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._inflight: Dict[Hashable, Future] = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        with self._lock:
+            shared = self._inflight.get(key)
+            leader = shared is None
+            if leader:
+                shared = self._inflight[key] = Future()
+        if not leader:
+            return await asyncio.wrap_future(shared)
+
+        try:
+            result = await fn()
+        except BaseException as e:
+            shared.set_exception(e)
+            raise
+        else:
+            shared.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def do_sync(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        """Blocking variant for thread-based callers (sync LibService)."""
+        with self._lock:
+            shared = self._inflight.get(key)
+            leader = shared is None
+            if leader:
+                shared = self._inflight[key] = Future()
+        if not leader:
+            return shared.result()
+
+        try:
+            result = fn()
+        except BaseException as e:
+            shared.set_exception(e)
+            raise
+        else:
+            shared.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def __len__(self):
+        return len(self._inflight)
@@ -0,0 +1,225 @@
+"""
+调度任务执行记录（排队延迟 / 启动延迟）
+
+APScheduler 的线程池执行器被替换为 TimedThreadPoolExecutor：提交时记下计划时间和提交时间，
+工作线程真正开始执行时记下开始时间，结束后记下结束时间和结果。由此得到：
+  lag       = 开始 - 计划（总延迟）
+  pool_wait = 开始 - 提交（线程池排队）
+记录先进入内存缓冲，由后台线程批量写入 task_runs 表，不占用任务线程；同时写入进程内指标。
+summarize() 按计划时间的分钟聚合 p50/p95/p99，用来判断是否需要更多工作线程。
+"""
+import concurrent.futures
+import logging
+import math
+import os
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from apscheduler.events import EVENT_JOB_ERROR, EVENT_JOB_MISSED
+from apscheduler.executors.pool import BasePoolExecutor
+
+from app import database, models
+from app.core.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+SCHEDULER_WORKERS = int(os.getenv("SCHEDULER_WORKERS", "10"))
+FLUSH_SECONDS = float(os.getenv("TASK_RUN_FLUSH_SECONDS", "5"))
+FLUSH_BATCH_SIZE = int(os.getenv("TASK_RUN_FLUSH_BATCH_SIZE", "200"))
+RETENTION_DAYS = int(os.getenv("TASK_RUN_RETENTION_DAYS", "14"))
+
+POOL_WAIT = registry.histogram("scheduler_pool_wait_seconds", "Time a submitted job waited for a scheduler worker thread", ("kind",))
+START_LAG = registry.histogram("scheduler_start_lag_seconds", "Delay between a job's scheduled run time and its actual start", ("kind",))
+BUSY_WORKERS = registry.gauge("scheduler_busy_workers", "Scheduler worker threads currently running a job")
+
+
+def job_kind(job_id: str) -> str:
+    """Task jobs are keyed by numeric task id; per-user jobs (e.g. delayed_signin_42) drop their id suffix."""
+    return 'task' if job_id.isdigit() else re.sub(r'_\d+$', '', job_id)
+
+
+def _outcome(events) -> str:
+    codes = [e.code for e in events or ()]
+    if EVENT_JOB_ERROR in codes:
+        return 'error'
+    if codes and all(code == EVENT_JOB_MISSED for code in codes):
+        return 'missed'
+    return 'success'
+
+
+class TaskRunRecorder:
+    def __init__(self, flush_seconds: float = FLUSH_SECONDS, batch_size: int = FLUSH_BATCH_SIZE):
+        self.flush_seconds = flush_seconds
+        self.batch_size = batch_size
+        self._cond = threading.Condition()
+        self._pending: List[dict] = []
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = False
+
+    def record(self, job_id: str, scheduled: float, submitted: float, started: float, finished: float, status: str):
+        kind = job_kind(job_id)
+        POOL_WAIT.observe(max(0.0, started - submitted), kind=kind)
+        START_LAG.observe(max(0.0, started - scheduled), kind=kind)
+        row = {
+            "job_id": job_id,
+            "task_id": int(job_id) if job_id.isdigit() else None,
+            "scheduled_at": datetime.fromtimestamp(scheduled),
+            "submitted_at": datetime.fromtimestamp(submitted),
+            "started_at": datetime.fromtimestamp(started),
+            "finished_at": datetime.fromtimestamp(finished),
+            "lag_ms": int(round((started - scheduled) * 1000)),
+            "pool_wait_ms": int(round((started - submitted) * 1000)),
+            "duration_ms": int(round((finished - started) * 1000)),
+            "status": status,
+        }
+        with self._cond:
+            self._pending.append(row)
+            if self._thread is None or not self._thread.is_alive():
+                self._stopped = False
+                self._thread = threading.Thread(target=self._run, name="task-run-writer", daemon=True)
+                self._thread.start()
+            if len(self._pending) >= self.batch_size:
+                self._cond.notify()
+
+    def flush(self):
+        with self._cond:
+            batch, self._pending = self._pending, []
+        self._write(batch)
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        self.flush()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._stopped and len(self._pending) < self.batch_size:
+                    self._cond.wait(timeout=self.flush_seconds)
+                if self._stopped:
+                    return
+                batch, self._pending = self._pending, []
+            self._write(batch)
+
+    @staticmethod
+    def _write(batch: List[dict]):
+        if not batch:
+            return
+        db = database.SessionLocal()
+        try:
+            db.bulk_insert_mappings(models.TaskRun, batch)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Failed to write {len(batch)} task run record(s): {e}")
+        finally:
+            db.close()
+
+
+recorder = TaskRunRecorder()
+
+
+class _TimedPool:
+    """Stands in for the executor's concurrent.futures pool and timestamps every job it runs."""
+
+    def __init__(self, pool: concurrent.futures.ThreadPoolExecutor, recorder: TaskRunRecorder):
+        self._pool = pool
+        self._recorder = recorder
+
+    def submit(self, fn, job, jobstore_alias, run_times, logger_name):
+        submitted = time.time()
+        # With coalescing there is a single run time; otherwise the earliest one is the real lateness
+        scheduled = min(run_times).timestamp() if run_times else submitted
+
+        def timed_run():
+            started = time.time()
+            BUSY_WORKERS.inc()
+            events = None
+            try:
+                events = fn(job, jobstore_alias, run_times, logger_name)
+                return events
+            finally:
+                BUSY_WORKERS.dec()
+                try:
+                    self._recorder.record(job.id, scheduled, submitted, started, time.time(),
+                                          _outcome(events) if events is not None else 'error')
+                except Exception as e:
+                    logger.error(f"Failed to record run of job {job.id}: {e}")
+
+        return self._pool.submit(timed_run)
+
+    def shutdown(self, wait=True):
+        self._pool.shutdown(wait)
+
+
+class TimedThreadPoolExecutor(BasePoolExecutor):
+    """Drop-in for APScheduler's ThreadPoolExecutor that records queueing delay per job run."""
+
+    def __init__(self, max_workers: int = SCHEDULER_WORKERS, recorder: TaskRunRecorder = recorder):
+        pool = concurrent.futures.ThreadPoolExecutor(int(max_workers), thread_name_prefix="scheduler")
+        super().__init__(_TimedPool(pool, recorder))
+
+
+def _percentile(sorted_values: List[int], q: float) -> Optional[int]:
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(q * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(db, minutes: int = 60, job_kind_filter: Optional[str] = None) -> List[Dict]:
+    """Per-minute (by scheduled time) lag and pool-wait percentiles over the last `minutes`."""
+    since = datetime.now() - timedelta(minutes=minutes)
+    query = db.query(
+        models.TaskRun.job_id, models.TaskRun.scheduled_at, models.TaskRun.lag_ms,
+        models.TaskRun.pool_wait_ms, models.TaskRun.status,
+    ).filter(models.TaskRun.scheduled_at >= since)
+
+    buckets: Dict[datetime, dict] = {}
+    for job_id, scheduled_at, lag_ms, pool_wait_ms, status in query:
+        if job_kind_filter and job_kind(job_id) != job_kind_filter:
+            continue
+        minute = scheduled_at.replace(second=0, microsecond=0, tzinfo=None)
+        bucket = buckets.setdefault(minute, {"lag": [], "wait": [], "error": 0, "missed": 0})
+        bucket["lag"].append(lag_ms)
+        bucket["wait"].append(pool_wait_ms)
+        if status in ('error', 'missed'):
+            bucket[status] += 1
+
+    result = []
+    for minute in sorted(buckets):
+        lag = sorted(buckets[minute]["lag"])
+        wait = sorted(buckets[minute]["wait"])
+        result.append({
+            "minute": minute.isoformat(),
+            "runs": len(lag),
+            "errors": buckets[minute]["error"],
+            # Runs dropped because they waited past the job's misfire grace time
+            "missed": buckets[minute]["missed"],
+            "lag_ms": {"p50": _percentile(lag, 0.50), "p95": _percentile(lag, 0.95),
+                       "p99": _percentile(lag, 0.99), "max": lag[-1]},
+            "pool_wait_ms": {"p50": _percentile(wait, 0.50), "p95": _percentile(wait, 0.95),
+                             "p99": _percentile(wait, 0.99), "max": wait[-1]},
+        })
+    return result
+
+
+def prune(retention_days: int = RETENTION_DAYS) -> int:
+    db = database.SessionLocal()
+    try:
+        cutoff = datetime.now() - timedelta(days=retention_days)
+        deleted = db.query(models.TaskRun).filter(models.TaskRun.scheduled_at < cutoff).delete(synchronize_session=False)
+        db.commit()
+        if deleted:
+            logger.info(f"Pruned {deleted} task run record(s) older than {retention_days} days")
+        return deleted
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Failed to prune task run records: {e}")
+        return 0
+    finally:
+        db.close()
@@ -0,0 +1,83 @@
+"""
+Traceint 上游调用指标
+
+按操作（GraphQL operationName、keep_alive_page、getTime、sign、prereserve_queue 等）记录
+耗时直方图、错误码计数（40001 / 40005 / 403 / timeout / HTTP 状态码）以及收发字节数。
+"""
+import asyncio
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+import httpx
+import requests
+
+from app.core.metrics import registry
+
+LATENCY = registry.histogram(
+    "upstream_request_duration_seconds", "Traceint call latency by operation", ("operation",))
+CALLS = registry.counter(
+    "upstream_requests_total", "Traceint calls by operation and outcome", ("operation", "outcome"))
+ERRORS = registry.counter(
+    "upstream_errors_total", "Traceint call failures by operation and error code", ("operation", "code"))
+BYTES = registry.counter(
+    "upstream_bytes_total", "Bytes exchanged with Traceint by operation and direction", ("operation", "direction"))
+
+
+def classify_error(e: Optional[BaseException], status_code: Optional[int] = None) -> str:
+    if isinstance(e, (httpx.TimeoutException, requests.Timeout, asyncio.TimeoutError, TimeoutError)):
+        return 'timeout'
+    msg = str(e) if e is not None else ''
+    if '40001' in msg:
+        return '40001'
+    if '40005' in msg:
+        return '40005'
+    if status_code == 403 or '403' in msg:
+        return '403'
+    if '超时' in msg or 'timed out' in msg.lower():
+        return 'timeout'
+    if status_code and status_code >= 400:
+        return f'http_{status_code}'
+    return 'error'
+
+
+def record(operation: str, seconds: float, sent: int = 0, received: int = 0,
+           error: Optional[BaseException] = None, status_code: Optional[int] = None):
+    operation = operation or 'unknown'
+    LATENCY.observe(seconds, operation=operation)
+    if sent:
+        BYTES.inc(sent, operation=operation, direction='sent')
+    if received:
+        BYTES.inc(received, operation=operation, direction='received')
+    if error is None and (status_code is None or status_code < 400):
+        CALLS.inc(operation=operation, outcome='ok')
+    else:
+        CALLS.inc(operation=operation, outcome='error')
+        ERRORS.inc(operation=operation, code=classify_error(error, status_code))
+
+
+class Call:
+    """Filled in by the caller inside track(): the response (for size/status) or explicit byte counts."""
+    __slots__ = ("sent", "received", "response")
+
+    def __init__(self, sent: int = 0):
+        self.sent = sent
+        self.received = 0
+        self.response = None
+
+
+@contextmanager
+def track(operation: str, sent: int = 0):
+    call = Call(sent)
+    started = time.perf_counter()
+    error = None
+    try:
+        yield call
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        r = call.response
+        received = call.received or (len(r.content) if r is not None else 0)
+        record(operation, time.perf_counter() - started, call.sent, received, error,
+               r.status_code if r is not None else None)
@@ -1,4 +1,4 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 import sys
 import os
@@ -8,7 +8,9 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from app import models, database, scheduler, crud
 from sqlalchemy import inspect, text
-from app.routers import auth, library, admin, tasks, cron, bark
+from app.routers import auth, library, admin, tasks, cron, bark, metrics
+from app.services import http_client, session_registry, cookie_store, task_runs, bark_outbox
+from app.core.metrics import registry
 import time
 from sqlalchemy.exc import OperationalError
 
@@ -38,6 +40,21 @@ def init_db():
                             conn.execute(text("ALTER TABLE bark_configs RENAME COLUMN device_token TO bark_key"))
                         print("Migrated: renamed bark_configs.device_token to bark_key")
                 
+                # Migrate bark_notifications table: delivery attempts for the outbox
+                if inspector.has_table("bark_notifications"):
+                    notification_cols = [c['name'] for c in inspector.get_columns('bark_notifications')]
+                    if 'attempts' not in notification_cols:
+                        with database.engine.begin() as conn:
+                            conn.execute(text("ALTER TABLE bark_notifications ADD COLUMN attempts INT DEFAULT 0"))
+                        print("Migrated: added bark_notifications.attempts column")
+                    if 'next_attempt_at' not in notification_cols:
+                        with database.engine.begin() as conn:
+                            if database.engine.dialect.name == 'mysql':
+                                conn.execute(text("ALTER TABLE bark_notifications ADD COLUMN next_attempt_at DATETIME"))
+                            else:
+                                conn.execute(text("ALTER TABLE bark_notifications ADD COLUMN next_attempt_at TIMESTAMP WITH TIME ZONE"))
+                        print("Migrated: added bark_notifications.next_attempt_at column")
+                
                 # Migrate seat_status_cache table: add delayed_signin_at if missing
                 if inspector.has_table("seat_status_cache"):
                     cache_cols = [c['name'] for c in inspector.get_columns('seat_status_cache')]
@@ -60,6 +77,12 @@ def init_db():
                             else:
                                 conn.execute(text("ALTER TABLE seat_status_cache ADD COLUMN htmlrule_backoff_until TIMESTAMP WITH TIME ZONE"))
                         print("Migrated: added seat_status_cache.htmlrule_backoff_until column")
+                    # Pending delayed sign-ins are reloaded by this column at startup
+                    cache_indexes = [i['name'] for i in inspector.get_indexes('seat_status_cache')]
+                    if 'ix_seat_status_cache_delayed_signin_at' not in cache_indexes:
+                        with database.engine.begin() as conn:
+                            conn.execute(text("CREATE INDEX ix_seat_status_cache_delayed_signin_at ON seat_status_cache (delayed_signin_at)"))
+                        print("Migrated: added index on seat_status_cache.delayed_signin_at")
             except Exception as e:
                 print(f"Migration check failed: {e}")
             return
@@ -84,6 +107,25 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+HTTP_LATENCY = registry.histogram("http_request_duration_seconds", "API request latency by router", ("router",))
+HTTP_REQUESTS = registry.counter("http_requests_total", "API requests by router, method and status class", ("router", "method", "status"))
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Label by the matched router's tag, not the raw path, to keep the series count bounded
+        route = request.scope.get("route")
+        tags = getattr(route, "tags", None)
+        router_name = tags[0] if tags else ("root" if route is not None else "unmatched")
+        HTTP_LATENCY.observe(time.perf_counter() - started, router=router_name)
+        HTTP_REQUESTS.inc(router=router_name, method=request.method, status=f"{status // 100}xx")
+
 # Routers
 app.include_router(auth.router)
 app.include_router(library.router)
@@ -91,6 +133,7 @@ app.include_router(admin.router)
 app.include_router(tasks.router)
 app.include_router(cron.router)
 app.include_router(bark.router)
+app.include_router(metrics.router)
 
 @app.on_event("startup")
 def startup_event():
@@ -99,6 +142,10 @@ def startup_event():
     else:
         print("Running on Vercel: Background scheduler disabled.")
 
+    # Deliver Bark notifications a previous process queued but never sent
+    if bark_outbox.ASYNC_DELIVERY:
+        bark_outbox.outbox.rehydrate()
+
     # Seed Invite Code
     db = database.SessionLocal()
     try:
@@ -123,6 +170,14 @@ def startup_event():
     finally:
         db.close()
 
+@app.on_event("shutdown")
+def shutdown_event():
+    session_registry.registry.close_all()
+    cookie_store.store.stop()
+    task_runs.recorder.stop()
+    bark_outbox.outbox.stop()
+    http_client.close()
+
 @app.get("/")
 def read_root():
     return {"message": "欢迎使用 FuckLib 自助图书馆 API"}